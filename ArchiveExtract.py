@@ -0,0 +1,397 @@
+import argparse
+import os
+import posixpath
+import queue
+import re
+import tarfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import py7zr
+from py7zr.callbacks import ExtractCallback
+
+from ParallelCompress import COPY_SIZE, DEFAULT_THREADS, open_reader
+
+WRITE_QUEUE_DEPTH = 8  # blocks buffered between the tar reader and the writer thread
+# Small zip entries go to the workers in batches, so per-task overhead does not dominate
+BATCH_ENTRIES = 128
+BATCH_BYTES = 1024 * 1024
+DRIVE = re.compile(r"^[A-Za-z]:")
+
+
+class UnsafeArchive(ValueError):
+    """Raised for a member that would be written outside the output folder"""
+
+
+class ExtractCanceled(Exception):
+    """Raised inside a running extraction when it is canceled"""
+
+
+def member_target(output_dir, name):
+    """The path a member called name extracts to, raising UnsafeArchive if it is outside output_dir.
+
+    The check is on the name alone: absolute paths, drive letters and ".."
+    components are refused without touching the disk.
+    """
+    parts = name.replace("\\", "/").split("/")
+    if name.startswith(("/", "\\")) or DRIVE.match(name) or ".." in parts:
+        raise UnsafeArchive(f"Refusing to extract {name!r}: it points outside the output folder.")
+    root = os.path.abspath(output_dir)
+    target = os.path.normpath(os.path.join(root, *[part for part in parts if part not in ("", ".")]))
+    if os.path.commonpath([root, target]) != root:
+        raise UnsafeArchive(f"Refusing to extract {name!r}: it points outside the output folder.")
+    return target
+
+
+def _check_canceled(is_canceled):
+    if is_canceled and is_canceled():
+        raise ExtractCanceled()
+
+
+def extract_zip(archive_path, output_dir, threads=DEFAULT_THREADS, progress=None, is_canceled=None):
+    """Extracts a zip with several entries decoded and written at once.
+
+    Every name in the central directory is checked before anything is
+    written. Entries go to the workers in batches of up to BATCH_ENTRIES
+    entries or BATCH_BYTES bytes. Each worker streams its entries through
+    its own archive handle in COPY_SIZE blocks, so memory stays at one
+    block per thread whatever the entry sizes. progress(name, bytes done,
+    size) is called from the workers.
+    """
+    with zipfile.ZipFile(archive_path) as archive:
+        members = archive.infolist()
+    # A name that repeats extracts once, from its last entry, as zipfile would leave it
+    targets = {}
+    for member in members:
+        targets[member_target(output_dir, member.filename)] = member
+
+    handles = []
+    handles_lock = threading.Lock()
+    local = threading.local()
+
+    def extract_batch(batch):
+        for target, member in batch:
+            extract_member(target, member)
+
+    def extract_member(target, member):
+        _check_canceled(is_canceled)
+        if member.is_dir():
+            os.makedirs(target, exist_ok=True)
+            return
+        if getattr(local, "archive", None) is None:
+            # ZipFile handles are not shared between threads
+            local.archive = zipfile.ZipFile(archive_path)
+            with handles_lock:
+                handles.append(local.archive)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        bytes_done = 0
+        with local.archive.open(member) as src, open(target, "wb") as dst:
+            while True:
+                block = src.read(COPY_SIZE)
+                if not block:
+                    break
+                dst.write(block)
+                bytes_done += len(block)
+                if progress:
+                    progress(member.filename, bytes_done, member.file_size)
+                _check_canceled(is_canceled)
+        if progress and not member.file_size:
+            progress(member.filename, 0, 0)
+        mtime = time.mktime(member.date_time + (0, 0, -1))
+        os.utime(target, (mtime, mtime))
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+            futures = [executor.submit(extract_batch, batch) for batch in _batches(targets.items())]
+            try:
+                for future in futures:
+                    future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+    finally:
+        for handle in handles:
+            handle.close()
+
+
+def _batches(items):
+    batch = []
+    batch_bytes = 0
+    for target, member in items:
+        batch.append((target, member))
+        batch_bytes += member.file_size
+        if len(batch) >= BATCH_ENTRIES or batch_bytes >= BATCH_BYTES:
+            yield batch
+            batch = []
+            batch_bytes = 0
+    if batch:
+        yield batch
+
+
+class _TarWriter(threading.Thread):
+    """Applies file operations from a queue, so disk writes overlap with decompressing the tar.
+
+    After an error it keeps draining the queue, so the reader never blocks
+    on a full queue; the error is raised by extract_tar at the end.
+    """
+
+    def __init__(self, operations):
+        super().__init__(daemon=True)
+        self.operations = operations
+        self.file = None
+        self.error = None
+
+    def run(self):
+        for operation in iter(self.operations.get, None):
+            if self.error is not None:
+                continue
+            try:
+                getattr(self, operation[0])(*operation[1:])
+            except BaseException as e:
+                self.error = e
+        if self.file is not None:
+            self.file.close()
+
+    def mkdir(self, target):
+        os.makedirs(target, exist_ok=True)
+
+    def open(self, target):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        self.file = open(target, "wb")
+
+    def write(self, block):
+        self.file.write(block)
+
+    def close(self, target, mtime, mode):
+        self.file.close()
+        self.file = None
+        os.utime(target, (mtime, mtime))
+        os.chmod(target, mode & 0o777)
+
+    def symlink(self, link_target, target):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.lexists(target):
+            os.remove(target)
+        os.symlink(link_target, target)
+
+    def link(self, source, target):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.lexists(target):
+            os.remove(target)
+        os.link(source, target)
+
+
+class _TarChecker:
+    """Checks tar members in archive order and returns the writer operations that create them.
+
+    Member names get the strict member_target check. Link targets may use
+    "..", as in pkg/bin/tool -> ../lib/tool, as long as they resolve inside
+    the output folder, resolved one component at a time. A chain of links
+    could still escape, so nothing is written, linked or resolved through a
+    path that is a symlink, and no symlink is made where an earlier link
+    target already went through.
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.root = os.path.abspath(output_dir)
+        self.symlinks = set()
+        self.traversed = set()  # paths link targets went through, which must not become symlinks later
+
+    def _link_target(self, member, path):
+        """Resolves path, relative to the archive root, one component at a time; it must stay inside"""
+        if posixpath.isabs(path) or DRIVE.match(path):
+            raise UnsafeArchive(f"Refusing to extract {member.name!r}: it links outside the output folder.")
+        parts = []
+        components = [part for part in path.split("/") if part not in ("", ".")]
+        for index, part in enumerate(components):
+            if part == "..":
+                if not parts:
+                    raise UnsafeArchive(f"Refusing to extract {member.name!r}: it links outside the output folder.")
+                parts.pop()
+            else:
+                parts.append(part)
+            if index < len(components) - 1:
+                # Going on from a symlink would resolve somewhere else than it reads
+                step = member_target(self.output_dir, "/".join(parts))
+                if step in self.symlinks:
+                    raise UnsafeArchive(f"Refusing to extract {member.name!r}: it links through a symbolic link.")
+                self.traversed.add(step)
+        return member_target(self.output_dir, "/".join(parts))
+
+    def _check_not_through_symlink(self, member, target):
+        path = target
+        while path != self.root:
+            if path in self.symlinks:
+                raise UnsafeArchive(f"Refusing to extract {member.name!r}: it goes through a symbolic link.")
+            path = os.path.dirname(path)
+
+    def operations(self, member):
+        """The writer operations that create member (file data excluded), raising UnsafeArchive for unsafe ones"""
+        target = member_target(self.output_dir, member.name)
+        self._check_not_through_symlink(member, os.path.dirname(target))
+        if target in self.symlinks and not member.issym():
+            # Opening or linking over it would write wherever it points
+            raise UnsafeArchive(f"Refusing to extract {member.name!r}: it goes through a symbolic link.")
+        if member.isdir():
+            return [("mkdir", target)]
+        if member.issym():
+            if target in self.traversed:
+                raise UnsafeArchive(f"Refusing to extract {member.name!r}: an earlier link goes through it.")
+            # A symlink is resolved from the folder it sits in
+            self._link_target(member, posixpath.join(posixpath.dirname(member.name), member.linkname))
+            self.symlinks.add(target)
+            return [("symlink", member.linkname, target)]
+        if member.islnk():
+            # A hard link names another member, relative to the archive root
+            source = self._link_target(member, member.linkname)
+            self._check_not_through_symlink(member, source)
+            return [("link", source, target)]
+        if member.isfile():
+            return [("open", target)]
+        return []  # devices and fifos are not extracted
+
+
+def extract_tar(archive_path, output_dir, codec=None, progress=None, is_canceled=None):
+    """Extracts a tar, decompressing and reading it on this thread while a writer thread does the disk I/O.
+
+    codec is "zst" or "xz" for those compressed tars; with None, plain,
+    gzip, bzip2 and xz tars are detected. Member data moves in COPY_SIZE
+    blocks through a queue of WRITE_QUEUE_DEPTH, which bounds memory. A
+    plain tar has all its members checked before anything is written.
+    Checking a compressed tar first would mean decompressing it twice, so
+    its members are checked as they stream: an unsafe member stops the
+    extraction before it is written, but members before it are already
+    extracted. progress(name, bytes done, size) is called as members are
+    read.
+    """
+    if codec is None and not _is_compressed(archive_path):
+        # Seeking over the members of a plain tar is cheap, so check them all first
+        checker = _TarChecker(output_dir)
+        with tarfile.open(archive_path, "r:") as tar:
+            for member in tar:
+                checker.operations(member)
+
+    operations = queue.Queue(WRITE_QUEUE_DEPTH)
+    writer = _TarWriter(operations)
+    checker = _TarChecker(output_dir)
+    writer.start()
+    try:
+        with open(archive_path, "rb") as raw:
+            source = open_reader(raw, codec) if codec else raw
+            with source, tarfile.open(fileobj=source, mode="r|" if codec else "r|*") as tar:
+                for member in tar:
+                    _check_canceled(is_canceled)
+                    if writer.error is not None:
+                        break
+                    member_operations = checker.operations(member)
+                    for operation in member_operations:
+                        operations.put(operation)
+                    if member_operations and member_operations[0][0] == "open":
+                        _queue_file_data(tar, member, operations, progress, is_canceled)
+                        operations.put(("close", member_operations[0][1], member.mtime, member.mode))
+    finally:
+        operations.put(None)
+        writer.join()
+    if writer.error is not None:
+        raise writer.error
+
+
+def _queue_file_data(tar, member, operations, progress, is_canceled):
+    src = tar.extractfile(member)
+    bytes_done = 0
+    while True:
+        block = src.read(COPY_SIZE)
+        if not block:
+            break
+        operations.put(("write", block))
+        bytes_done += len(block)
+        if progress:
+            progress(member.name, bytes_done, member.size)
+        _check_canceled(is_canceled)
+    if progress and not member.size:
+        progress(member.name, 0, 0)
+
+
+def _is_compressed(archive_path):
+    with open(archive_path, "rb") as file:
+        start = file.read(6)
+    return start.startswith((b"\x1f\x8b", b"BZh", b"\xfd7zXZ\x00", b"\x28\xb5\x2f\xfd"))
+
+
+class _SevenZipProgress(ExtractCallback):
+    # py7zr reports members as they finish; sizes come from the archive listing, directories are skipped
+    def __init__(self, sizes, progress):
+        self.sizes = sizes
+        self.progress = progress
+
+    def report_start_preparation(self):
+        pass
+
+    def report_start(self, processing_file_path, processing_bytes):
+        pass
+
+    def report_update(self, decompressed_bytes):
+        pass
+
+    def report_end(self, processing_file_path, wrote_bytes):
+        size = self.sizes.get(processing_file_path)
+        if self.progress and size is not None:
+            self.progress(processing_file_path, size, size)
+
+    def report_warning(self, message):
+        pass
+
+    def report_postprocess(self):
+        pass
+
+
+def extract_7z(archive_path, output_dir, progress=None, is_canceled=None):
+    """Extracts a 7z after checking every name in its header; py7zr streams the data to disk.
+
+    py7zr calls back from its own reporter thread, where an exception cannot
+    stop it, so a cancel only takes effect before extraction starts.
+    """
+    with py7zr.SevenZipFile(archive_path, "r") as archive:
+        sizes = {}
+        for info in archive.list():
+            member_target(output_dir, info.filename)
+            if not info.is_directory:
+                sizes[info.filename] = info.uncompressed or 0
+        _check_canceled(is_canceled)
+        archive.extractall(output_dir, callback=_SevenZipProgress(sizes, progress))
+
+
+def extract(archive_path, output_dir, compression_type, threads=DEFAULT_THREADS, progress=None, is_canceled=None):
+    """Extracts a zip, 7z, tar, tar.zst or tar.xz archive into output_dir"""
+    if compression_type == "zip":
+        extract_zip(archive_path, output_dir, threads, progress, is_canceled)
+    elif compression_type == "7z":
+        extract_7z(archive_path, output_dir, progress, is_canceled)
+    elif compression_type == "tar":
+        extract_tar(archive_path, output_dir, None, progress, is_canceled)
+    elif compression_type in ("tar.zst", "tar.xz"):
+        extract_tar(archive_path, output_dir, compression_type[4:], progress, is_canceled)
+    else:
+        raise ValueError(f"Unknown archive type: {compression_type}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract an archive with bounded memory, checking names first")
+    parser.add_argument("archive")
+    parser.add_argument("output", nargs="?", help="output folder (default: the archive's folder)")
+    parser.add_argument("--type", choices=["zip", "7z", "tar", "tar.zst", "tar.xz"],
+                        help="archive type (default: from the file name)")
+    parser.add_argument("--threads", type=int, default=DEFAULT_THREADS, help="zip entries written at once")
+    args = parser.parse_args()
+
+    archive_type = args.type
+    if archive_type is None:
+        archive_type = next((suffix for suffix in ("tar.zst", "tar.xz", "zip", "7z", "tar")
+                             if args.archive.endswith("." + suffix)), "tar")
+    start_time = time.perf_counter()
+    extract(args.archive, args.output or os.path.dirname(os.path.abspath(args.archive)), archive_type, args.threads,
+            progress=lambda name, done, size: print(f"{name}  {done:,}/{size:,}") if done == size else None)
+    print(f"Extracted in {time.perf_counter() - start_time:.2f} s")
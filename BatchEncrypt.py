@@ -0,0 +1,212 @@
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from cryptography.fernet import Fernet
+
+import CryptoStream
+from CompressPipeline import CODEC_NONE, CODECS, compress_encrypt_file, decrypt_decompress_file
+from KeyStore import KeyStore, KeyNotFound, key_id_extension, read_key_id
+
+ENCRYPTED_SUFFIX = ".enc"
+SUMMARY_NAME = "batch_summary.json"
+DEFAULT_FILE_WORKERS = min(4, CryptoStream.DEFAULT_WORKERS)
+
+BatchJob = namedtuple("BatchJob", "input_path output_path size")
+
+
+class BatchCanceled(Exception):
+    """Raised inside a running job when the batch is canceled"""
+
+
+def output_name(file_name, decrypt=False):
+    if decrypt:
+        return os.path.splitext(file_name)[0]
+    return file_name + ENCRYPTED_SUFFIX
+
+
+def collect_jobs(paths, save_folder, decrypt=False):
+    """Expands files and directories into BatchJobs, largest first.
+
+    A directory keeps its layout under save_folder, inside a folder named
+    after it.
+    """
+    jobs = []
+    for path in paths:
+        if os.path.isdir(path):
+            base = os.path.basename(os.path.normpath(path))
+            for dir_path, _, files in os.walk(path):
+                relative_dir = os.path.relpath(dir_path, path)
+                for file in files:
+                    file_path = os.path.join(dir_path, file)
+                    output_path = os.path.normpath(
+                        os.path.join(save_folder, base, relative_dir, output_name(file, decrypt)))
+                    jobs.append(BatchJob(file_path, output_path, os.path.getsize(file_path)))
+        else:
+            output_path = os.path.join(save_folder, output_name(os.path.basename(path), decrypt))
+            jobs.append(BatchJob(path, output_path, os.path.getsize(path)))
+
+    # Big files start first so one of them does not hold up the end of the batch
+    jobs.sort(key=lambda job: job.size, reverse=True)
+    return jobs
+
+
+def _decrypt_legacy(input_path, output_path, key):
+    # Files from before the chunked format are a single Fernet token under the same key text
+    with open(input_path, "rb") as file:
+        data = Fernet(base64.urlsafe_b64encode(key)).decrypt(file.read())
+    with CryptoStream.atomic_output(output_path) as file:
+        file.write(data)
+
+
+def _job_key(job, key, key_store):
+    # Without an explicit key each file names its key in the header and the store supplies it
+    if key is not None:
+        return key
+    if key_store is None:
+        raise ValueError("No key given and no key store to look one up in.")
+    if not CryptoStream.is_container(job.input_path):
+        raise ValueError("Files in the old format need their key entered by hand.")
+    key_id = read_key_id(job.input_path)
+    if key_id is None:
+        raise ValueError("The file records no key id, enter its key by hand.")
+    try:
+        return key_store.get_key(key_id)
+    except KeyNotFound:
+        raise ValueError(f"Key {key_id} is not in the key store.")
+
+
+def _run_job(job, key, decrypt, chunk_workers, progress, is_canceled, key_store=None, key_id=None,
+             codec=CODEC_NONE):
+    def report(bytes_done):
+        if is_canceled and is_canceled():
+            raise BatchCanceled()
+        if progress:
+            progress(bytes_done)
+
+    if is_canceled and is_canceled():
+        raise BatchCanceled()
+    os.makedirs(os.path.dirname(job.output_path) or ".", exist_ok=True)
+    if not decrypt:
+        # Every file gets its own data key, wrapped by the one batch key
+        compress_encrypt_file(job.input_path, job.output_path, key, codec, progress=report, workers=chunk_workers,
+                              wrap=True, extensions=key_id_extension(key_id) if key_id else None)
+    elif CryptoStream.is_container(job.input_path):
+        # Compressed containers are decompressed on the fly, plain ones just decrypted
+        decrypt_decompress_file(job.input_path, job.output_path, _job_key(job, key, key_store), progress=report,
+                                workers=chunk_workers)
+    else:
+        _decrypt_legacy(job.input_path, job.output_path, _job_key(job, key, key_store))
+    report(job.size)
+
+
+def run_batch(jobs, key, decrypt=False, workers=DEFAULT_FILE_WORKERS, chunk_workers=1, progress=None,
+              file_done=None, is_canceled=None, key_store=None, key_id=None, codec=CODEC_NONE):
+    """Encrypts (or decrypts) every job, at most workers files at a time.
+
+    progress(index, bytes_done) and file_done(index, result) are called from
+    the worker threads. A failed file does not stop the batch. When
+    encrypting, key_id is recorded in every header; when decrypting with
+    key=None, each file's key is looked up in key_store by the id in its
+    header. A codec other than CODEC_NONE compresses each file in the same
+    pass before encrypting it. Returns one result dict per job, in job
+    order, with a status of "ok", "failed" or "canceled".
+    """
+    results = [None] * len(jobs)
+
+    def run(index):
+        job = jobs[index]
+        start = time.monotonic()
+        result = {"input": job.input_path, "output": job.output_path, "size": job.size,
+                  "status": "ok", "error": "", "seconds": 0.0}
+        try:
+            _run_job(job, key, decrypt, chunk_workers,
+                     progress and (lambda bytes_done: progress(index, bytes_done)), is_canceled, key_store, key_id,
+                     codec)
+        except BatchCanceled:
+            result["status"] = "canceled"
+        except Exception as e:
+            result["status"] = "failed"
+            result["error"] = str(e) or type(e).__name__
+        result["seconds"] = round(time.monotonic() - start, 3)
+        results[index] = result
+        if file_done:
+            file_done(index, result)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for future in [executor.submit(run, index) for index in range(len(jobs))]:
+            future.result()
+    return results
+
+
+def summarize(results, decrypt=False):
+    counts = {status: sum(result["status"] == status for result in results) for status in ("ok", "failed", "canceled")}
+    return {
+        "mode": "decrypt" if decrypt else "encrypt",
+        "files": len(results),
+        "succeeded": counts["ok"],
+        "failed": counts["failed"],
+        "canceled": counts["canceled"],
+        "bytes": sum(result["size"] for result in results if result["status"] == "ok"),
+        "results": results,
+    }
+
+
+def write_summary(results, summary_path, decrypt=False):
+    """Writes the per-file results and totals as JSON"""
+    with open(summary_path, "w", encoding="utf-8") as summary_file:
+        json.dump(summarize(results, decrypt), summary_file, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Encrypt or decrypt many files under one master key")
+    parser.add_argument("mode", choices=["encrypt", "decrypt"])
+    parser.add_argument("paths", nargs="+", help="files and directories to process")
+    parser.add_argument("--output", required=True, help="folder for the results")
+    parser.add_argument("--key-file",
+                        help="master key file; created with a new key when encrypting and it does not exist")
+    parser.add_argument("--key-store", action="store_true",
+                        help="record the key in the local key store, or look keys up there when decrypting")
+    parser.add_argument("--compress", choices=list(CODECS), default="none",
+                        help="compress each file in the same pass before encrypting it")
+    parser.add_argument("--workers", type=int, default=DEFAULT_FILE_WORKERS, help="files processed at once")
+    parser.add_argument("--summary", help=f"summary path (default: {SUMMARY_NAME} in the output folder)")
+    args = parser.parse_args()
+
+    decrypt = args.mode == "decrypt"
+    if not args.key_file and not args.key_store:
+        parser.error("give --key-file, --key-store or both")
+    master_key = None
+    if args.key_file:
+        if not decrypt and not os.path.exists(args.key_file):
+            with open(args.key_file, "wb") as key_file:
+                key_file.write(Fernet.generate_key())
+        with open(args.key_file, "rb") as key_file:
+            master_key = CryptoStream.key_from_text(key_file.read().strip())
+    elif not decrypt:
+        master_key = os.urandom(CryptoStream.KEY_SIZE)
+
+    batch_jobs = collect_jobs(args.paths, args.output, decrypt)
+    store = KeyStore() if args.key_store else None
+    try:
+        batch_key_id = None
+        if store is not None and not decrypt:
+            batch_key_id = store.add_key(master_key, f"{len(batch_jobs)} files from {', '.join(args.paths)}")
+            print(f"Key id: {batch_key_id}")
+        batch_results = run_batch(batch_jobs, master_key, decrypt, args.workers, key_store=store,
+                                  key_id=batch_key_id, codec=CODECS[args.compress])
+    finally:
+        if store is not None:
+            store.close()
+    for batch_result in batch_results:
+        detail = f"  {batch_result['error']}" if batch_result["error"] else ""
+        print(f"{batch_result['status'].upper():>8}  {batch_result['input']}{detail}")
+    write_summary(batch_results, args.summary or os.path.join(args.output, SUMMARY_NAME), decrypt)
+    totals = summarize(batch_results, decrypt)
+    print(f"{totals['succeeded']} ok, {totals['failed']} failed, {totals['canceled']} canceled")
+    sys.exit(1 if totals["failed"] else 0)
@@ -0,0 +1,321 @@
+import argparse
+import lzma
+import os
+import queue
+import threading
+import time
+
+import pyzstd
+
+import CryptoStream
+
+# Codec ids stored in the EXT_CODEC header extension
+CODEC_NONE = 0
+CODEC_ZSTD = 1
+CODEC_XZ = 2
+CODECS = {"none": CODEC_NONE, "zstd": CODEC_ZSTD, "xz": CODEC_XZ}
+DEFAULT_LEVELS = {CODEC_ZSTD: 3, CODEC_XZ: 6}
+
+READ_SIZE = 1024 * 1024
+PIPE_DEPTH = 4  # blocks buffered between two stages, so memory stays bounded
+
+
+class _PipeClosed(Exception):
+    """Raised in a producer whose consumer has stopped"""
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+_END = object()
+
+
+class _Pipe:
+    """Bounded queue between two pipeline threads that also carries errors and shutdown"""
+
+    def __init__(self, depth=PIPE_DEPTH):
+        self.queue = queue.Queue(depth)
+        self.closed = threading.Event()
+
+    def put(self, item):
+        # A consumer that failed closes the pipe, so a blocked producer gives up instead of hanging
+        while not self.closed.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise _PipeClosed()
+
+    def get(self):
+        item = self.queue.get()
+        if isinstance(item, _Failure):
+            raise item.error
+        return item
+
+    def items(self):
+        while True:
+            item = self.get()
+            if item is _END:
+                return
+            yield item
+
+    def close(self):
+        self.closed.set()
+
+
+class _PipeReader:
+    """File-like read() over a pipe of byte blocks, so encrypt_stream can consume it"""
+
+    def __init__(self, pipe):
+        self.pipe = pipe
+        self.buffer = bytearray()
+        self.done = False
+
+    def read(self, size):
+        while len(self.buffer) < size and not self.done:
+            item = self.pipe.get()
+            if item is _END:
+                self.done = True
+            else:
+                self.buffer += item
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+
+class _PipeWriter:
+    """File-like write() into a pipe; copies, because decrypt_stream reuses its output buffer"""
+
+    def __init__(self, pipe):
+        self.pipe = pipe
+
+    def write(self, data):
+        self.pipe.put(bytes(data))
+        return len(data)
+
+
+def _stage(target, source, sink, errors):
+    # Runs one stage on its own thread. On the way out it closes its source, so an
+    # upstream producer does not block on it, and passes any error downstream.
+    def run():
+        try:
+            target()
+        except _PipeClosed:
+            pass
+        except BaseException as e:
+            errors.append(e)
+            if sink is not None:
+                _put_failure(sink, e)
+        finally:
+            if source is not None:
+                source.close()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def _put_failure(pipe, error):
+    try:
+        pipe.put(_Failure(error))
+    except _PipeClosed:
+        pass
+
+
+def new_compressor(codec, level=None):
+    if level is None:
+        level = DEFAULT_LEVELS.get(codec)
+    if codec == CODEC_ZSTD:
+        compressor = pyzstd.ZstdCompressor(level)
+        return compressor.compress, compressor.flush
+    if codec == CODEC_XZ:
+        compressor = lzma.LZMACompressor(preset=level)
+        return compressor.compress, compressor.flush
+    raise ValueError(f"Unknown codec id: {codec}")
+
+
+def new_decompressor(codec):
+    """Returns decompress(block), a generator of output pieces of at most READ_SIZE bytes"""
+    if codec == CODEC_ZSTD:
+        # Accepts concatenated frames, such as output from multi-threaded compressors
+        decompressor = pyzstd.EndlessZstdDecompressor()
+    elif codec == CODEC_XZ:
+        decompressor = lzma.LZMADecompressor()
+    else:
+        raise CryptoStream.InvalidStream(f"Unknown codec id in header: {codec}")
+
+    def decompress(block):
+        # Output is capped per call so one very compressible block cannot balloon memory
+        data = decompressor.decompress(block, READ_SIZE)
+        while True:
+            if data:
+                yield data
+            if decompressor.needs_input or getattr(decompressor, "eof", False):
+                return
+            data = decompressor.decompress(b"", READ_SIZE)
+    return decompress
+
+
+def compress_encrypt_file(input_path, output_path, key, codec=CODEC_ZSTD, level=None,
+                          chunk_size=CryptoStream.CHUNK_SIZE, extensions=None, progress=None, wrap=False, workers=1):
+    """Compresses and encrypts a file in one pass, without an intermediate file.
+
+    Reading, compressing and encrypting plus writing run on three threads
+    joined by small bounded queues. The codec is recorded in the container
+    header. progress receives the number of input bytes read so far.
+    """
+    if codec == CODEC_NONE:
+        return CryptoStream.encrypt_file(input_path, output_path, key, chunk_size, extensions=extensions,
+                                         progress=progress, workers=workers, wrap=wrap)
+    compress, flush = new_compressor(codec, level)
+    extensions = dict(extensions or {})
+    extensions[CryptoStream.EXT_CODEC] = bytes([codec])
+
+    raw_pipe = _Pipe()
+    compressed_pipe = _Pipe()
+    errors = []
+
+    def read():
+        bytes_read = 0
+        with open(input_path, "rb") as src:
+            while True:
+                block = src.read(READ_SIZE)
+                if not block:
+                    break
+                raw_pipe.put(block)
+                bytes_read += len(block)
+                if progress:
+                    progress(bytes_read)
+        raw_pipe.put(_END)
+
+    def compress_blocks():
+        for block in raw_pipe.items():
+            compressed = compress(block)
+            if compressed:
+                compressed_pipe.put(compressed)
+        compressed_pipe.put(flush())
+        compressed_pipe.put(_END)
+
+    threads = [_stage(read, None, raw_pipe, errors), _stage(compress_blocks, raw_pipe, compressed_pipe, errors)]
+    try:
+        with CryptoStream.atomic_output(output_path) as dst:
+            return CryptoStream.encrypt_stream(_PipeReader(compressed_pipe), dst, key, chunk_size,
+                                               extensions=extensions, workers=workers, wrap=wrap)
+    finally:
+        raw_pipe.close()
+        compressed_pipe.close()
+        for thread in threads:
+            thread.join()
+
+
+def stored_codec(input_path):
+    """The codec id recorded in a container header (CODEC_NONE if there is none)"""
+    with open(input_path, "rb") as src:
+        header = CryptoStream.read_header(src)
+    codec = header.extensions.get(CryptoStream.EXT_CODEC)
+    return codec[0] if codec else CODEC_NONE
+
+
+def decrypt_decompress_file(input_path, output_path, key, progress=None, workers=1):
+    """Reverse of compress_encrypt_file: decrypt, decompress and write on three threads.
+
+    Containers without a codec are decrypted directly. Only authenticated
+    plaintext reaches the decompressor, and output_path only appears once
+    the whole file has decrypted. progress receives output bytes written.
+    """
+    codec = stored_codec(input_path)
+    if codec == CODEC_NONE:
+        return CryptoStream.decrypt_file(input_path, output_path, key, progress, workers)
+    decompress = new_decompressor(codec)
+
+    compressed_pipe = _Pipe()
+    plain_pipe = _Pipe()
+    errors = []
+
+    def decompress_blocks():
+        for block in compressed_pipe.items():
+            for data in decompress(block):
+                plain_pipe.put(data)
+        plain_pipe.put(_END)
+
+    with CryptoStream.atomic_output(output_path) as dst:
+        def write():
+            bytes_written = 0
+            for block in plain_pipe.items():
+                dst.write(block)
+                bytes_written += len(block)
+                if progress:
+                    progress(bytes_written)
+
+        threads = [_stage(decompress_blocks, compressed_pipe, plain_pipe, errors),
+                   _stage(write, plain_pipe, None, errors)]
+        try:
+            with open(input_path, "rb") as src:
+                header = CryptoStream.decrypt_stream(src, _PipeWriter(compressed_pipe), key, workers=workers)
+            compressed_pipe.put(_END)
+        except _PipeClosed:
+            pass  # a later stage stopped, its error is raised below
+        except BaseException as e:
+            _put_failure(compressed_pipe, e)
+            raise
+        finally:
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0]
+        return header
+
+
+def benchmark(input_path, key=None, codec=CODEC_ZSTD, level=None):
+    """Times the fused pipeline against compressing to a temporary file and then encrypting it"""
+    import tempfile
+
+    key = key or os.urandom(CryptoStream.KEY_SIZE)
+    compress, flush = new_compressor(codec, level)
+    with tempfile.TemporaryDirectory() as folder:
+        output = os.path.join(folder, "fused.enc")
+        start = time.perf_counter()
+        compress_encrypt_file(input_path, output, key, codec, level)
+        fused = time.perf_counter() - start
+
+        intermediate = os.path.join(folder, "intermediate.bin")
+        start = time.perf_counter()
+        with open(input_path, "rb") as src, open(intermediate, "wb") as dst:
+            for block in iter(lambda: src.read(READ_SIZE), b""):
+                dst.write(compress(block))
+            dst.write(flush())
+        CryptoStream.encrypt_file(intermediate, os.path.join(folder, "two_step.enc"), key)
+        two_step = time.perf_counter() - start
+        return {"fused": fused, "two step": two_step, "output size": os.path.getsize(output)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compress and encrypt in one pass, or the reverse")
+    parser.add_argument("mode", choices=["encrypt", "decrypt", "benchmark"])
+    parser.add_argument("input", help="file to process")
+    parser.add_argument("output", nargs="?", help="result path")
+    parser.add_argument("--key-file", help="base64 key file (created when encrypting and missing)")
+    parser.add_argument("--codec", choices=list(CODECS), default="zstd")
+    parser.add_argument("--level", type=int, help="compression level")
+    args = parser.parse_args()
+
+    if args.mode == "benchmark":
+        for label, value in benchmark(args.input, codec=CODECS[args.codec], level=args.level).items():
+            print(f"{label:>12}: {value:,.3f}" if isinstance(value, float) else f"{label:>12}: {value:,}")
+        raise SystemExit(0)
+
+    if not args.output or not args.key_file:
+        parser.error("encrypt and decrypt need an output path and --key-file")
+    if args.mode == "encrypt" and not os.path.exists(args.key_file):
+        import base64
+        with open(args.key_file, "wb") as key_file:
+            key_file.write(base64.urlsafe_b64encode(os.urandom(CryptoStream.KEY_SIZE)))
+    with open(args.key_file, "rb") as key_file:
+        cli_key = CryptoStream.key_from_text(key_file.read().strip())
+    if args.mode == "encrypt":
+        compress_encrypt_file(args.input, args.output, cli_key, CODECS[args.codec], args.level)
+    else:
+        decrypt_decompress_file(args.input, args.output, cli_key)
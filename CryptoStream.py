@@ -0,0 +1,524 @@
+import argparse
+import base64
+import io
+import mmap
+import os
+import struct
+import tempfile
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+
+# Container layout
+#   header: magic | version | cipher | chunk size | nonce prefix | extension length | extensions
+#   chunks: ciphertext + 16 byte tag, every chunk holds chunk_size plaintext bytes except the last
+# Each chunk nonce is the 7 byte prefix, a 4 byte chunk counter and a final-chunk flag, and the
+# whole header is authenticated with every chunk, so reordering, truncation and header edits
+# all fail authentication.
+MAGIC = b"SSCS"
+VERSION = 1
+HEADER_FORMAT = ">4sBBI7sH"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+NONCE_PREFIX_SIZE = 7
+TAG_SIZE = 16
+KEY_SIZE = 32
+
+CHUNK_SIZE = 1024 * 1024  # plaintext bytes per authenticated chunk
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+AES_GCM = 1
+CHACHA20_POLY1305 = 2
+
+# Header extension tags
+EXT_WRAPPED_KEY = 1  # per-file data key, AES-GCM wrapped under a master key
+EXT_KEY_ID = 2  # id of the master key in the local KeyStore
+EXT_CODEC = 3  # compression applied before encryption, see CompressPipeline
+WRAP_NONCE_SIZE = 12
+CIPHERS = {
+    AES_GCM: AESGCM,
+    CHACHA20_POLY1305: ChaCha20Poly1305,
+}
+
+Header = namedtuple("Header", "version cipher chunk_size nonce_prefix extensions raw")
+
+
+class InvalidStream(Exception):
+    """Raised when a container is malformed, was tampered with or the key is wrong"""
+
+
+def key_from_text(key_text):
+    """Decodes a url-safe base64 key, the same text format Fernet keys use"""
+    if isinstance(key_text, str):
+        key_text = key_text.encode()
+    try:
+        key = base64.urlsafe_b64decode(key_text)
+    except ValueError:
+        raise ValueError("The key is not valid base64.")
+    if len(key) != KEY_SIZE:
+        raise ValueError("The key must decode to 32 bytes.")
+    return key
+
+
+def _pack_extensions(extensions):
+    # Extensions are tag (1 byte), length (2 bytes), value records
+    packed = b""
+    for tag, value in sorted((extensions or {}).items()):
+        packed += struct.pack(">BH", tag, len(value)) + value
+    return packed
+
+
+def _unpack_extensions(data):
+    extensions = {}
+    offset = 0
+    while offset < len(data):
+        if offset + 3 > len(data):
+            raise InvalidStream("Truncated header extension.")
+        tag, length = struct.unpack_from(">BH", data, offset)
+        offset += 3
+        if offset + length > len(data):
+            raise InvalidStream("Truncated header extension.")
+        extensions[tag] = data[offset:offset + length]
+        offset += length
+    return extensions
+
+
+def build_header(cipher=AES_GCM, chunk_size=CHUNK_SIZE, extensions=None, nonce_prefix=None):
+    if cipher not in CIPHERS:
+        raise ValueError(f"Unknown cipher id: {cipher}")
+    if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+        raise ValueError(f"Chunk size must be between 1 and {MAX_CHUNK_SIZE} bytes.")
+    if nonce_prefix is None:
+        nonce_prefix = os.urandom(NONCE_PREFIX_SIZE)
+    packed = _pack_extensions(extensions)
+    raw = struct.pack(HEADER_FORMAT, MAGIC, VERSION, cipher, chunk_size, nonce_prefix, len(packed)) + packed
+    return Header(VERSION, cipher, chunk_size, nonce_prefix, dict(extensions or {}), raw)
+
+
+def read_header(src):
+    """Reads and parses the container header from a binary stream positioned at its start"""
+    fixed = src.read(HEADER_SIZE)
+    if len(fixed) < HEADER_SIZE:
+        raise InvalidStream("File is too short to be an encrypted container.")
+    magic, version, cipher, chunk_size, nonce_prefix, extension_length = struct.unpack(HEADER_FORMAT, fixed)
+    if magic != MAGIC:
+        raise InvalidStream("Not an encrypted container.")
+    if version != VERSION:
+        raise InvalidStream(f"Unsupported container version: {version}")
+    if cipher not in CIPHERS:
+        raise InvalidStream(f"Unknown cipher id: {cipher}")
+    if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+        raise InvalidStream("Invalid chunk size in header.")
+    packed = src.read(extension_length)
+    if len(packed) < extension_length:
+        raise InvalidStream("Truncated header.")
+    return Header(version, cipher, chunk_size, nonce_prefix, _unpack_extensions(packed), fixed + packed)
+
+
+def is_container(file_path):
+    """True if the file starts with the chunked container magic"""
+    with open(file_path, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def wrap_key(master_key, data_key):
+    """Encrypts a data key under a master key; returns nonce + ciphertext + tag"""
+    nonce = os.urandom(WRAP_NONCE_SIZE)
+    return nonce + AESGCM(master_key).encrypt(nonce, data_key, MAGIC)
+
+
+def unwrap_key(master_key, wrapped):
+    if len(wrapped) != WRAP_NONCE_SIZE + KEY_SIZE + TAG_SIZE:
+        raise InvalidStream("Malformed wrapped key in header.")
+    try:
+        return AESGCM(master_key).decrypt(wrapped[:WRAP_NONCE_SIZE], wrapped[WRAP_NONCE_SIZE:], MAGIC)
+    except InvalidTag:
+        raise InvalidStream("Decryption failed: wrong key for this file.")
+
+
+def chunk_nonce(nonce_prefix, index, last):
+    if index > 0xffffffff:
+        raise InvalidStream("Too many chunks for one container.")
+    return nonce_prefix + struct.pack(">IB", index, 1 if last else 0)
+
+
+def _read_full(src, size):
+    # read() on raw or unbuffered streams may return short, keep going until size or EOF
+    data = src.read(size)
+    if data is None:
+        data = b""
+    while len(data) < size:
+        more = src.read(size - len(data))
+        if not more:
+            break
+        data += more
+    return data
+
+
+def _read_blocks(src, block_size):
+    # Yields (index, block, last); one block of lookahead tells us which block is the final one
+    index = 0
+    block = _read_full(src, block_size)
+    while True:
+        following = _read_full(src, block_size) if len(block) == block_size else b""
+        last = not following
+        yield index, block, last
+        if last:
+            return
+        block = following
+        index += 1
+
+
+def _view_blocks(view, block_size):
+    # Same blocks as _read_blocks, but as zero-copy slices of a memory-mapped file
+    count = max(1, -(-len(view) // block_size))
+    for index in range(count):
+        yield index, view[index * block_size:(index + 1) * block_size], index == count - 1
+
+
+def _source_blocks(src, block_size):
+    # A memory-mapped source is sliced from its current position, anything else is read
+    if isinstance(src, mmap.mmap):
+        return _view_blocks(memoryview(src)[src.tell():], block_size)
+    return _read_blocks(src, block_size)
+
+
+class _GcmBuffer:
+    """AES-GCM for one chunk at a time into a single preallocated output buffer.
+
+    The AEAD classes return a new bytes object per call; update_into on the
+    lower level cipher writes into the same bytearray every time instead. The
+    returned view is only valid until the next call.
+    """
+
+    def __init__(self, key, chunk_size, aad):
+        self.key = algorithms.AES(key)
+        self.aad = aad
+        # update_into needs room for one extra cipher block
+        self.buffer = bytearray(chunk_size + 16)
+        self.view = memoryview(self.buffer)
+
+    def seal(self, nonce, chunk):
+        encryptor = Cipher(self.key, modes.GCM(nonce)).encryptor()
+        encryptor.authenticate_additional_data(self.aad)
+        length = encryptor.update_into(chunk, self.buffer)
+        encryptor.finalize()
+        return self.view[:length], encryptor.tag
+
+    def open(self, nonce, block):
+        decryptor = Cipher(self.key, modes.GCM(nonce, bytes(block[-TAG_SIZE:]))).decryptor()
+        decryptor.authenticate_additional_data(self.aad)
+        length = decryptor.update_into(block[:-TAG_SIZE], self.buffer)
+        decryptor.finalize()  # raises InvalidTag before any of the plaintext is handed out
+        return self.view[:length]
+
+
+def _writev_all(fd, parts):
+    # os.writev may write less than asked for, resubmit whatever is left
+    parts = [memoryview(part).cast("B") for part in parts]
+    while parts:
+        written = os.writev(fd, parts)
+        while parts and written >= len(parts[0]):
+            written -= len(parts[0])
+            parts.pop(0)
+        if parts and written:
+            parts[0] = parts[0][written:]
+
+
+def _part_writer(dst):
+    # Unbuffered files get each chunk's pieces in a single writev call; other streams use write()
+    if hasattr(os, "writev") and isinstance(dst, io.FileIO):
+        fd = dst.fileno()
+        return lambda parts: _writev_all(fd, parts)
+
+    def write(parts):
+        for part in parts:
+            dst.write(part)
+    return write
+
+
+def _ordered_map(function, jobs, workers):
+    """Yields function(*job) for every job, in job order.
+
+    With more than one worker the jobs run on a thread pool (the AEAD calls
+    release the GIL). At most 2 * workers jobs are in flight; that window is
+    the reorder buffer, so memory stays bounded while results are written out
+    strictly in order.
+    """
+    if workers <= 1:
+        for job in jobs:
+            yield function(*job)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        try:
+            for job in jobs:
+                pending.append(executor.submit(function, *job))
+                if len(pending) >= workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def encrypt_stream(src, dst, key, chunk_size=CHUNK_SIZE, cipher=AES_GCM, extensions=None, progress=None,
+                   workers=1, wrap=False):
+    """Encrypts everything readable from src into dst as a chunked container.
+
+    Memory use is bounded by a few chunks per worker regardless of the input
+    size. src may be an mmap, which is sliced instead of read. progress, if
+    given, receives the running count of plaintext bytes. With wrap=True key
+    is used as a master key: the chunks are encrypted under a fresh random
+    data key that is stored, wrapped, in the header.
+    """
+    if wrap:
+        extensions = dict(extensions or {})
+        data_key = os.urandom(KEY_SIZE)
+        extensions[EXT_WRAPPED_KEY] = wrap_key(key, data_key)
+        key = data_key
+    header = build_header(cipher, chunk_size, extensions)
+    write = _part_writer(dst)
+    write([header.raw])
+
+    if cipher == AES_GCM and workers <= 1:
+        gcm = _GcmBuffer(key, chunk_size, header.raw)
+
+        def seal(index, chunk, last):
+            return len(chunk), gcm.seal(chunk_nonce(header.nonce_prefix, index, last), chunk)
+    else:
+        aead = CIPHERS[cipher](key)
+
+        def seal(index, chunk, last):
+            return len(chunk), (aead.encrypt(chunk_nonce(header.nonce_prefix, index, last), chunk, header.raw),)
+
+    bytes_done = 0
+    for size, parts in _ordered_map(seal, _source_blocks(src, chunk_size), workers):
+        write(parts)
+        bytes_done += size
+        if progress:
+            progress(bytes_done)
+    return header
+
+
+def decrypt_stream(src, dst, key, progress=None, workers=1):
+    """Decrypts a chunked container from src into dst, authenticating every chunk.
+
+    Raises InvalidStream on a wrong key, tampering or truncation. Plaintext of
+    chunks before the failing one may already have been written to dst. For
+    containers with a wrapped data key, key is the master key.
+    """
+    header = read_header(src)
+    if EXT_WRAPPED_KEY in header.extensions:
+        key = unwrap_key(key, header.extensions[EXT_WRAPPED_KEY])
+    write = _part_writer(dst)
+
+    if header.cipher == AES_GCM and workers <= 1:
+        gcm = _GcmBuffer(key, header.chunk_size, header.raw)
+        open_chunk = gcm.open
+    else:
+        aead = CIPHERS[header.cipher](key)
+
+        def open_chunk(nonce, block):
+            return aead.decrypt(nonce, block, header.raw)
+
+    def open_block(index, block, last):
+        if len(block) < TAG_SIZE:
+            raise InvalidStream("Encrypted file is truncated.")
+        try:
+            return open_chunk(chunk_nonce(header.nonce_prefix, index, last), block)
+        except InvalidTag:
+            raise InvalidStream("Decryption failed: wrong key, or the file is corrupted or truncated.")
+
+    bytes_done = 0
+    for plaintext in _ordered_map(open_block, _source_blocks(src, header.chunk_size + TAG_SIZE), workers):
+        write([plaintext])
+        bytes_done += len(plaintext)
+        if progress:
+            progress(bytes_done)
+    return header
+
+
+def _open_source(file):
+    # Map the input so chunks are sliced from the page cache instead of copied into new bytes
+    try:
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, OSError):  # empty files and non-regular files cannot be mapped
+        return None
+
+
+def _close_source(mapped):
+    try:
+        mapped.close()
+    except BufferError:
+        # A traceback still holds a chunk view; the map is released along with it
+        pass
+
+
+@contextmanager
+def atomic_output(output_path, buffering=-1):
+    """Opens a temporary file next to output_path for writing in binary mode.
+
+    When the block finishes the data is fsync'd and the temporary file is
+    renamed over output_path in one step, so a crash or error never leaves a
+    truncated output behind; on error the temporary file is removed instead.
+    """
+    folder, name = os.path.split(os.path.abspath(output_path))
+    fd, temp_path = tempfile.mkstemp(prefix=f".{name}.", suffix=".part", dir=folder)
+    try:
+        with open(fd, "wb", buffering=buffering) as file:
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, output_path)
+    except BaseException:
+        _remove_partial(temp_path)
+        raise
+
+
+def _output_buffering():
+    # Unbuffered where os.writev is available, so chunk pieces go straight to the file
+    return 0 if hasattr(os, "writev") else -1
+
+
+def encrypt_file(input_path, output_path, key, chunk_size=CHUNK_SIZE, cipher=AES_GCM, extensions=None,
+                 progress=None, workers=1, wrap=False, preamble=b""):
+    """Encrypts a file into a chunked container; output_path only appears once it is complete.
+
+    preamble, if given, is written before the container for formats that wrap it.
+    """
+    with open(input_path, "rb") as file:
+        mapped = _open_source(file)
+        try:
+            with atomic_output(output_path, _output_buffering()) as dst:
+                if preamble:
+                    _part_writer(dst)([preamble])
+                return encrypt_stream(mapped if mapped is not None else file, dst, key, chunk_size, cipher,
+                                      extensions, progress, workers, wrap)
+        finally:
+            if mapped is not None:
+                _close_source(mapped)
+
+
+def decrypt_file(input_path, output_path, key, progress=None, workers=1, offset=0):
+    """Decrypts a chunked container; output_path only appears once every chunk has authenticated.
+
+    offset skips that many bytes of preamble before the container starts.
+    """
+    with open(input_path, "rb") as file:
+        mapped = _open_source(file)
+        (mapped if mapped is not None else file).seek(offset)
+        try:
+            with atomic_output(output_path, _output_buffering()) as dst:
+                return decrypt_stream(mapped if mapped is not None else file, dst, key, progress, workers)
+        finally:
+            if mapped is not None:
+                _close_source(mapped)
+
+
+def _remove_partial(output_path):
+    try:
+        os.remove(output_path)
+    except OSError:
+        pass
+
+
+class _NullSink:
+    # Discards output so the benchmark measures encryption rather than disk speed
+    def write(self, data):
+        return len(data)
+
+
+def benchmark(size_mb=256, workers=None, chunk_size=CHUNK_SIZE, cipher=AES_GCM, repeat=3):
+    """Encrypts size_mb of in-memory random data sequentially and in parallel, returns (seconds, MB/s) per path"""
+    if workers is None:
+        workers = DEFAULT_WORKERS
+    data = os.urandom(size_mb * 1024 * 1024)
+    key = os.urandom(KEY_SIZE)
+    results = {}
+    for label, count in (("sequential", 1), ("parallel", workers)):
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            encrypt_stream(io.BytesIO(data), _NullSink(), key, chunk_size, cipher, workers=count)
+            best = min(best, time.perf_counter() - start)
+        results[label] = (best, size_mb / best if best else 0.0)
+    return results
+
+
+def memory_check(size_mb=64, chunk_size=CHUNK_SIZE):
+    """Peak traced allocation, in bytes, of encrypting a size_mb file three ways.
+
+    "whole file" is the old read-everything Fernet path, "chunked read" streams
+    with read() calls and "mapped" is encrypt_file with its mmap input and
+    reused output buffer. Only the last one should stay near a single chunk.
+    """
+    import tracemalloc
+    from cryptography.fernet import Fernet
+
+    with tempfile.TemporaryDirectory() as folder:
+        source = os.path.join(folder, "plain.bin")
+        output = os.path.join(folder, "plain.bin.enc")
+        with open(source, "wb") as file:
+            for _ in range(size_mb):
+                file.write(os.urandom(1024 * 1024))
+
+        def whole_file():
+            with open(source, "rb") as file:
+                token = Fernet(Fernet.generate_key()).encrypt(file.read())
+            with open(output, "wb") as file:
+                file.write(token)
+
+        def chunked_read():
+            with open(source, "rb") as src, open(output, "wb") as dst:
+                encrypt_stream(src, dst, os.urandom(KEY_SIZE), chunk_size)
+
+        def mapped():
+            encrypt_file(source, output, os.urandom(KEY_SIZE), chunk_size)
+
+        peaks = {}
+        for label, run in (("whole file", whole_file), ("chunked read", chunked_read), ("mapped", mapped)):
+            tracemalloc.start()
+            try:
+                run()
+                peaks[label] = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+    return peaks
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark sequential vs parallel chunk encryption")
+    parser.add_argument("--size-mb", type=int, default=256, help="amount of data to encrypt")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="threads for the parallel path")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="plaintext bytes per chunk")
+    parser.add_argument("--cipher", choices=["aes-gcm", "chacha20-poly1305"], default="aes-gcm")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per path, best time is reported")
+    parser.add_argument("--memory", action="store_true",
+                        help="measure peak allocations with tracemalloc instead of throughput")
+    args = parser.parse_args()
+
+    if args.memory:
+        peaks = memory_check(args.size_mb, args.chunk_size)
+        for label, peak in peaks.items():
+            print(f"{label:>12}: {peak / (1024 * 1024):,.2f} MiB peak")
+        # The mapped path should hold about one chunk of output, not the file
+        limit = 2 * (args.chunk_size + TAG_SIZE) + 64 * 1024
+        if peaks["mapped"] > limit:
+            print(f"FAIL: mapped path peaked above {limit:,} bytes")
+            raise SystemExit(1)
+        print("OK")
+        raise SystemExit(0)
+
+    cipher_id = AES_GCM if args.cipher == "aes-gcm" else CHACHA20_POLY1305
+    timings = benchmark(args.size_mb, args.workers, args.chunk_size, cipher_id, args.repeat)
+    for label, (seconds, throughput) in timings.items():
+        print(f"{label:>10}: {seconds:.3f} s  {throughput:,.1f} MB/s")
+    print(f"   speedup: {timings['sequential'][0] / timings['parallel'][0]:.2f}x")
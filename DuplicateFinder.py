@@ -0,0 +1,119 @@
+import argparse
+import hashlib
+import json
+import os
+import stat as stat_module
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+from HashEngine import DEFAULT_WORKERS, hash_file
+
+PARTIAL_SIZE = 64 * 1024  # bytes sampled from each end of a file in the partial stage
+FULL_HASH = "blake2b"
+
+
+def collect_files(roots, min_size=1):
+    """Maps file size to paths under roots, listing each hard-linked inode only once"""
+    by_size = defaultdict(list)
+    seen = set()
+    for root in roots:
+        for dir_path, _, files in os.walk(root):
+            for file in files:
+                file_path = os.path.join(dir_path, file)
+                try:
+                    stat = os.lstat(file_path)
+                except OSError:
+                    continue
+                if not stat_module.S_ISREG(stat.st_mode) or stat.st_size < min_size:
+                    continue
+                # Hard links share their data, so they are not wasted space
+                if (stat.st_dev, stat.st_ino) in seen:
+                    continue
+                seen.add((stat.st_dev, stat.st_ino))
+                by_size[stat.st_size].append(file_path)
+    return by_size
+
+
+def partial_hash(file_path, size):
+    """BLAKE2b of the first and last PARTIAL_SIZE bytes; covers the whole file when it is small"""
+    hasher = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as file:
+        hasher.update(file.read(PARTIAL_SIZE))
+        if size > PARTIAL_SIZE:
+            file.seek(max(PARTIAL_SIZE, size - PARTIAL_SIZE))
+            hasher.update(file.read(PARTIAL_SIZE))
+    return hasher.hexdigest()
+
+
+def _full_hash(file_path):
+    return hash_file(file_path, [FULL_HASH])[FULL_HASH]
+
+
+def _split_groups(groups, submit):
+    # Regroups every candidate group by the digest submit(path, size) resolves to, keeping only collisions
+    jobs = [(size, path, submit(path, size)) for size, paths in groups for path in paths]
+    regrouped = defaultdict(list)
+    for size, path, future in jobs:
+        try:
+            key = future.result()
+        except OSError:
+            continue
+        regrouped[(size, key)].append(path)
+    return [(size, key, paths) for (size, key), paths in regrouped.items() if len(paths) > 1]
+
+
+def find_duplicates(roots, workers=None, min_size=1):
+    """Finds files with identical content under the given roots.
+
+    Files are grouped by size first, then by a hash of their first and last
+    64 KiB, and only files still colliding after that are fully hashed, in a
+    process pool. Returns a list of {"size", "digest", "paths", "wasted"}
+    dicts, largest waste first.
+    """
+    if workers is None:
+        workers = DEFAULT_WORKERS
+
+    by_size = collect_files(roots, min_size)
+    candidates = [(size, paths) for size, paths in by_size.items() if len(paths) > 1]
+
+    # Partial reads are small and I/O bound, so threads are enough here
+    with ThreadPoolExecutor(max_workers=workers * 4) as executor:
+        partial_groups = _split_groups(candidates, partial(executor.submit, partial_hash))
+
+    # Files no larger than both samples were already hashed in full by the partial stage
+    duplicates = [(size, key, paths) for size, key, paths in partial_groups if size <= 2 * PARTIAL_SIZE]
+    remaining = [(size, paths) for size, _, paths in partial_groups if size > 2 * PARTIAL_SIZE]
+    if remaining:
+        # Largest files first so one big file does not hold up the end of the run
+        remaining.sort(key=lambda group: group[0], reverse=True)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            duplicates += _split_groups(remaining, lambda path, size: executor.submit(_full_hash, path))
+
+    report = [
+        {"size": size, "digest": digest, "paths": sorted(paths), "wasted": size * (len(paths) - 1)}
+        for size, digest, paths in duplicates
+    ]
+    report.sort(key=lambda group: group["wasted"], reverse=True)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find duplicate files by size, partial hash, then full hash")
+    parser.add_argument("roots", nargs="+", help="directories to scan")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="full hashing processes")
+    parser.add_argument("--min-size", type=int, default=1, help="ignore files smaller than this many bytes")
+    parser.add_argument("--json", help="also write the report to this JSON file")
+    args = parser.parse_args()
+
+    groups = find_duplicates(args.roots, args.workers, args.min_size)
+    for group in groups:
+        print(f"{len(group['paths'])} copies of {group['size']:,} bytes ({group['wasted']:,} bytes wasted)")
+        for path in group["paths"]:
+            print(f"    {path}")
+    total = sum(group["wasted"] for group in groups)
+    print(f"{len(groups)} duplicate sets, {total:,} bytes wasted")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as report_file:
+            json.dump(groups, report_file, indent=2)
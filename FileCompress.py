@@ -1,12 +1,9 @@
-import bz2
 import os
-import shutil
 import sys
-import tarfile
-import zipfile
+import threading
+import time
 
-import py7zr
-from PySide6.QtCore import QFile
+from PySide6.QtCore import QFile, QThread, Signal
 from PySide6.QtUiTools import QUiLoader
 from PySide6.QtWidgets import (
     QApplication,
@@ -15,6 +12,124 @@ from PySide6.QtWidgets import (
     QFileDialog,
 )
 
+import ArchiveExtract
+import ParallelCompress
+import ParallelZip
+
+ARCHIVE_TYPES = ("zip", "tar", "7z", "tar.zst", "tar.xz")
+
+
+class ExtractThread(QThread):
+    progress_updated = Signal(str, object, object, int)  # member, bytes done, member size, members done
+    extract_complete = Signal()
+    extract_failed = Signal(str)
+    extract_canceled = Signal()
+
+    def __init__(self, archive_path, compression_type, threads):
+        super().__init__()
+        self.archive_path = archive_path
+        self.compression_type = compression_type
+        self.threads = threads
+        self.is_canceled = False
+        self.members_done = 0
+        self.lock = threading.Lock()
+        self.last_emit = 0.0
+
+    def run(self):
+        try:
+            ArchiveExtract.extract(self.archive_path, os.path.dirname(self.archive_path), self.compression_type,
+                                   self.threads, progress=self.report_progress,
+                                   is_canceled=lambda: self.is_canceled)
+        except ArchiveExtract.ExtractCanceled:
+            self.extract_canceled.emit()
+            return
+        except Exception as e:
+            self.extract_failed.emit(str(e) or type(e).__name__)
+            return
+        self.extract_complete.emit()
+
+    def report_progress(self, name, bytes_done, size):
+        # Zip members report from several workers; updates go out at most ten times per second
+        with self.lock:
+            if bytes_done == size:
+                self.members_done += 1
+            now = time.monotonic()
+            if now - self.last_emit < 0.1:
+                return
+            self.last_emit = now
+            self.progress_updated.emit(name, bytes_done, size, self.members_done)
+
+
+class CompressThread(QThread):
+    progress_updated = Signal(str, object, object)  # current file, bytes (or zip entries) done, total
+    compress_complete = Signal()
+    compress_failed = Signal(str)
+    compress_canceled = Signal()
+
+    def __init__(self, path, output_file, compression_type, level, threads, store_incompressible):
+        super().__init__()
+        self.path = path
+        self.output_file = output_file
+        self.compression_type = compression_type
+        self.level = level
+        self.threads = threads
+        self.store_incompressible = store_incompressible
+        self.is_canceled = False
+        self.last_emit = 0.0
+
+    def run(self):
+        try:
+            self.compress()
+        except ParallelCompress.CompressCanceled:
+            self.remove_output()
+            self.compress_canceled.emit()
+            return
+        except Exception as e:
+            self.remove_output()
+            self.compress_failed.emit(str(e) or type(e).__name__)
+            return
+        self.compress_complete.emit()
+
+    def compress(self):
+        is_canceled = self.canceled
+        if self.compression_type == "zip":
+            # Entries are deflated on several threads and written in order with their own headers
+            entries = ParallelZip.zip_entries(self.path)
+            ParallelZip.write_zip(self.output_file, entries, self.level, self.threads,
+                                  lambda count: self.report_progress(f"{count} of {len(entries)} files", count,
+                                                                     len(entries)),
+                                  self.store_incompressible, is_canceled)
+        elif self.compression_type == "7z":
+            ParallelCompress.compress_7z(self.path, self.output_file, self.store_incompressible,
+                                         self.report_progress, is_canceled)
+        elif self.compression_type == "tar":
+            ParallelCompress.compress_tar(self.path, self.output_file, None, progress=self.report_progress,
+                                          is_canceled=is_canceled)
+        elif self.compression_type.startswith("tar."):
+            ParallelCompress.compress_tar(self.path, self.output_file,
+                                          ParallelCompress.codec_of(self.compression_type), self.level,
+                                          self.threads, self.store_incompressible, self.report_progress,
+                                          is_canceled)
+        else:
+            # zst, xz and bzip2; the last two compress independent blocks in parallel
+            ParallelCompress.compress_file(self.path, self.output_file, self.compression_type, self.level,
+                                           self.threads, self.report_progress, is_canceled)
+
+    def canceled(self):
+        return self.is_canceled
+
+    def report_progress(self, name, done, total):
+        now = time.monotonic()
+        if now - self.last_emit < 0.1:
+            return
+        self.last_emit = now
+        self.progress_updated.emit(name, done, total)
+
+    def remove_output(self):
+        # A partly written archive cannot be opened, so it is not left behind
+        if os.path.exists(self.output_file):
+            os.remove(self.output_file)
+
 
 class FileCompress(QWidget):
     def __init__(self):
@@ -39,6 +154,16 @@ class FileCompress(QWidget):
         self.ui.ChooseFile.textChanged.connect(self.validate_path_input)
         self.ui.ChooseFile.textChanged.connect(self.update_button_states)
         self.ui.BtnMainMenu.clicked.connect(self.close)
+        self.ui.BtnCancel.clicked.connect(self.cancel_thread)
+        for radio_button in self.format_buttons():
+            radio_button.toggled.connect(self.update_options)
+
+        # Level and thread count for the zip, zstd, xz and bzip2 formats
+        self.ui.SpinThreads.setRange(1, max(64, ParallelCompress.DEFAULT_THREADS))
+        self.ui.SpinThreads.setValue(ParallelCompress.DEFAULT_THREADS)
+        self.update_options()
+        self.ui.ProgressBar.setRange(0, 1000)
+        self.thread = None
 
         # Set the window properties
         self.setWindowTitle("File Compressor")
@@ -67,20 +192,13 @@ class FileCompress(QWidget):
             self.show_error_dialog("Please select a compression type.")
             return
 
-        try:
-            output_file = f"{folder_path}.{compression_type}"
-            if compression_type == "zip":
-                self.compress_zip(folder_path, output_file)
-            elif compression_type == "tar":
-                self.compress_tar(folder_path, output_file)
-            elif compression_type == "7z":
-                self.compress_7z(folder_path, output_file)
-            elif compression_type == "bz2":
-                self.compress_bz2(folder_path, output_file)
-
-            self.show_info_dialog("Compression successful.")
-        except Exception as e:
-            self.show_error_dialog(f"Compression error: {str(e)}")
+        if compression_type in ("zst", "xz") and os.path.isdir(folder_path):
+            self.show_error_dialog("Zstandard and XZ compress a single file. "
+                                   "Choose TAR + Zstandard or TAR + XZ for a folder.")
+            return
+
+        # Compression runs on a worker thread with progress; the result is reported when it ends
+        self.start_compress(folder_path, f"{folder_path}.{compression_type}", compression_type)
 
     def decompress_folder(self):
         file_path = self.ui.ChooseFile.text()
@@ -93,6 +211,11 @@ class FileCompress(QWidget):
             self.show_error_dialog("Please select a compression type.")
             return
 
+        if os.path.isfile(file_path) and compression_type in ARCHIVE_TYPES:
+            # Archives extract on a worker thread with progress; the result is reported when it ends
+            self.start_extract(file_path, compression_type)
+            return
+
         try:
             if os.path.isfile(file_path):
                 self.decompress_file(file_path, compression_type)
@@ -110,46 +233,101 @@ class FileCompress(QWidget):
         except Exception as e:
             self.show_error_dialog(f"Decompression error: {str(e)}")
 
-    def compress_zip(self, folder_path, output_file):
-        with zipfile.ZipFile(output_file, "w", zipfile.ZIP_DEFLATED) as zipf:
-            for root, _, files in os.walk(folder_path):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    relative_path = os.path.relpath(file_path, folder_path)
-                    zipf.write(file_path, relative_path)
+    def start_compress(self, path, output_file, compression_type):
+        if self.thread is not None and self.thread.isRunning():
+            return
+        self.ui.ProgressBar.setValue(0)
+        self.ui.LblStatus.setText("Compressing...")
+        self.set_busy(True)
+        self.thread = CompressThread(path, output_file, compression_type, self.ui.SpinLevel.value(),
+                                     self.ui.SpinThreads.value(), self.ui.ChkStoreCompressed.isChecked())
+        self.thread.progress_updated.connect(self.update_compress_progress)
+        self.thread.compress_complete.connect(self.compress_complete)
+        self.thread.compress_failed.connect(self.compress_failed)
+        self.thread.compress_canceled.connect(self.compress_canceled)
+        self.thread.start()
+
+    def update_compress_progress(self, name, done, total):
+        self.ui.ProgressBar.setValue(int(done * 1000 / total) if total else 1000)
+        self.ui.LblStatus.setText(os.path.basename(name.rstrip("/")))
+
+    def compress_complete(self):
+        self.set_busy(False)
+        self.ui.ProgressBar.setValue(1000)
+        self.ui.LblStatus.setText(f"Wrote {os.path.basename(self.thread.output_file)}")
+        self.show_info_dialog("Compression successful.")
+
+    def compress_failed(self, message):
+        self.set_busy(False)
+        self.ui.LblStatus.setText("")
+        self.show_error_dialog(f"Compression error: {message}")
+
+    def compress_canceled(self):
+        self.set_busy(False)
+        self.ui.LblStatus.setText("Canceled")
+        self.show_info_dialog("Compression canceled. The unfinished archive was deleted.")
+
+    def start_extract(self, file_path, compression_type):
+        if self.thread is not None and self.thread.isRunning():
+            return
+        self.ui.ProgressBar.setValue(0)
+        self.ui.LblStatus.setText("Extracting...")
+        self.set_busy(True)
+        self.thread = ExtractThread(file_path, compression_type, self.ui.SpinThreads.value())
+        self.thread.progress_updated.connect(self.update_progress)
+        self.thread.extract_complete.connect(self.extract_complete)
+        self.thread.extract_failed.connect(self.extract_failed)
+        self.thread.extract_canceled.connect(self.extract_canceled)
+        self.thread.start()
+
+    def update_progress(self, name, bytes_done, size, members_done):
+        self.ui.ProgressBar.setValue(int(bytes_done * 1000 / size) if size else 1000)
+        self.ui.LblStatus.setText(f"{os.path.basename(name.rstrip('/'))}  ({members_done} files done)")
+
+    def extract_complete(self):
+        self.set_busy(False)
+        self.ui.ProgressBar.setValue(1000)
+        self.ui.LblStatus.setText(f"{self.thread.members_done} files extracted")
+        self.show_info_dialog("Decompression successful.")
+
+    def extract_failed(self, message):
+        self.set_busy(False)
+        self.ui.LblStatus.setText("")
+        self.show_error_dialog(f"Decompression error: {message}")
+
+    def extract_canceled(self):
+        self.set_busy(False)
+        self.ui.LblStatus.setText("Canceled")
+        self.show_info_dialog("Decompression canceled. Files already extracted were kept.")
+
+    def cancel_thread(self):
+        if self.thread is not None and self.thread.isRunning():
+            self.thread.is_canceled = True
+
+    def set_busy(self, busy):
+        for button in (self.ui.BtnCompress, self.ui.BtnDecompress, self.ui.BtnFileChoose):
+            button.setEnabled(not busy)
+        self.ui.BtnCancel.setEnabled(busy)
 
     def decompress_zip(self, zip_file):
-        output_dir = os.path.dirname(zip_file)
-        with zipfile.ZipFile(zip_file, "r") as zipf:
-            zipf.extractall(output_dir)
-
-    def compress_tar(self, folder_path, output_file):
-        with tarfile.open(output_file, "w") as tar:
-            tar.add(folder_path, arcname=os.path.basename(folder_path))
+        ArchiveExtract.extract_zip(zip_file, os.path.dirname(zip_file), self.ui.SpinThreads.value())
 
     def decompress_tar(self, tar_file):
-        output_dir = os.path.dirname(tar_file)
-        with tarfile.open(tar_file, "r") as tar:
-            tar.extractall(output_dir)
-
-    def compress_7z(self, folder_path, output_file):
-        with py7zr.SevenZipFile(output_file, "w") as archive:
-            archive.writeall(folder_path, os.path.basename(folder_path))
+        ArchiveExtract.extract_tar(tar_file, os.path.dirname(tar_file))
 
     def decompress_7z(self, archive_file):
-        output_dir = os.path.dirname(archive_file)
-        with py7zr.SevenZipFile(archive_file, "r") as archive:
-            archive.extractall(output_dir)
+        ArchiveExtract.extract_7z(archive_file, os.path.dirname(archive_file))
 
-    def compress_bz2(self, file_path, output_file):
-        with open(file_path, "rb") as input_file, bz2.open(output_file, "wb") as bz2_file:
-            shutil.copyfileobj(input_file, bz2_file)
+    def decompress_parallel(self, file_path, compression_type):
+        codec = ParallelCompress.codec_of(compression_type)
+        if compression_type.startswith("tar."):
+            ArchiveExtract.extract_tar(file_path, os.path.dirname(file_path), codec)
+        else:
+            ParallelCompress.decompress_file(file_path, os.path.splitext(file_path)[0], codec)
 
     def decompress_bz2(self, file_path):
-        output_dir = os.path.dirname(file_path)
         output_file = os.path.splitext(file_path)[0]
-        with bz2.open(file_path, "rb") as bz2_file, open(output_file, "wb") as output_file:
-            shutil.copyfileobj(bz2_file, output_file)
+        ParallelCompress.decompress_file(file_path, output_file, "bz2", self.ui.SpinThreads.value())
 
     def decompress_file(self, file_path, compression_type):
         if compression_type == "zip":
@@ -160,6 +338,8 @@ class FileCompress(QWidget):
             self.decompress_7z(file_path)
         elif compression_type == "bz2":
             self.decompress_bz2(file_path)
+        elif compression_type in ParallelCompress.FORMATS:
+            self.decompress_parallel(file_path, compression_type)
 
     def get_selected_compression_type(self):
         if self.ui.RdZip.isChecked():
@@ -170,9 +350,41 @@ class FileCompress(QWidget):
             return "7z"
         elif self.ui.RdBzip.isChecked():
             return "bz2"
+        elif self.ui.RdZstd.isChecked():
+            return "zst"
+        elif self.ui.RdXz.isChecked():
+            return "xz"
+        elif self.ui.RdTarZstd.isChecked():
+            return "tar.zst"
+        elif self.ui.RdTarXz.isChecked():
+            return "tar.xz"
         else:
             return ""
 
+    def format_buttons(self):
+        return [self.ui.RdZip, self.ui.RdRAR, self.ui.Rd7z, self.ui.RdBzip,
+                self.ui.RdZstd, self.ui.RdXz, self.ui.RdTarZstd, self.ui.RdTarXz]
+
+    def update_options(self):
+        # Level and threads only apply to zip, zstd, xz and bzip2; each has its own level range
+        compression_type = self.get_selected_compression_type()
+        self.ui.ChkStoreCompressed.setEnabled(compression_type in ("zip", "7z", "tar.zst"))
+        if compression_type == "7z":
+            self.ui.ChkStoreCompressed.setToolTip(
+                "7z archives are stored uncompressed as a whole, and only when at least "
+                f"{ParallelCompress.STORE_SHARE:.0%} of their bytes are already compressed")
+        else:
+            self.ui.ChkStoreCompressed.setToolTip("Skips recompressing images, video, archives and encrypted files")
+        enabled = ParallelCompress.codec_of(compression_type) in ParallelCompress.LEVELS
+        for widget in (self.ui.LblLevel, self.ui.SpinLevel, self.ui.LblThreads, self.ui.SpinThreads):
+            widget.setEnabled(enabled)
+        if not enabled:
+            return
+        lowest, highest, default = ParallelCompress.LEVELS[ParallelCompress.codec_of(compression_type)]
+        if (self.ui.SpinLevel.minimum(), self.ui.SpinLevel.maximum()) != (lowest, highest):
+            self.ui.SpinLevel.setRange(lowest, highest)
+            self.ui.SpinLevel.setValue(default)
+
     def show_error_dialog(self, message):
         error_dialog = QMessageBox(self)
         error_dialog.setIcon(QMessageBox.Warning)
@@ -222,7 +434,8 @@ class FileCompress(QWidget):
         )
 
         # Set stylesheet for buttons
-        buttons = [self.ui.BtnFileChoose, self.ui.BtnCompress, self.ui.BtnDecompress, self.ui.BtnMainMenu]
+        buttons = [self.ui.BtnFileChoose, self.ui.BtnCompress, self.ui.BtnDecompress, self.ui.BtnCancel,
+                   self.ui.BtnMainMenu]
         for button in buttons:
             button.setStyleSheet(
                 "QPushButton { background-color: #4CAF50; color: white; border: 1px solid #61afef; border-radius: 5px; padding: 10px; }"
@@ -230,8 +443,7 @@ class FileCompress(QWidget):
             )
 
         # Set stylesheet for radio buttons
-        radio_buttons = [self.ui.RdZip, self.ui.RdRAR, self.ui.Rd7z, self.ui.RdBzip]
-        for radio_button in radio_buttons:
+        for radio_button in self.format_buttons():
             radio_button.setStyleSheet(
                 "QRadioButton { color: black; font-size: 16px; }"
                 "QRadioButton::indicator { width: 16px; height: 16px; }"
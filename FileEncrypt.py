@@ -1,18 +1,68 @@
 import os
 import sys
+import threading
+import time
 
-from PySide6.QtCore import QFile
+from PySide6.QtCore import QFile, QThread, Signal
 from PySide6.QtUiTools import QUiLoader
-from PySide6.QtWidgets import QApplication, QWidget, QMessageBox, QFileDialog
+from PySide6.QtWidgets import QApplication, QWidget, QMessageBox, QFileDialog, QHeaderView, QTableWidgetItem
 from cryptography.fernet import Fernet
 
+import BatchEncrypt
+import CryptoStream
+from CompressPipeline import CODEC_NONE, CODEC_ZSTD
+from KeyStore import KeyStore
+
 
 def generate_random_key():
-    """Generates a random 32-byte key for encryption"""
-    key = Fernet.generate_key()
-    with open('key.key', 'wb') as key_file:
-        key_file.write(key)
-    return key
+    """Generates a random 32-byte key for encryption, as base64 text"""
+    return Fernet.generate_key()
+
+
+class BatchThread(QThread):
+    progress_updated = Signal(list, float)  # bytes done per job, bytes per second overall
+    file_finished = Signal(int, dict)
+    batch_complete = Signal(list)
+
+    def __init__(self, jobs, key, decrypt, chunk_workers, key_store=None, key_id=None, codec=CODEC_NONE):
+        super().__init__()
+        self.jobs = jobs
+        self.key = key
+        self.decrypt = decrypt
+        self.chunk_workers = chunk_workers
+        self.key_store = key_store
+        self.key_id = key_id
+        self.codec = codec
+        self.is_canceled = False
+        self.bytes_done = [0] * len(jobs)
+        self.lock = threading.Lock()
+        self.start_time = 0.0
+        self.last_emit = 0.0
+
+    def run(self):
+        self.start_time = time.monotonic()
+        # Split the cores between files running at once and chunks within each file
+        file_workers = min(BatchEncrypt.DEFAULT_FILE_WORKERS, len(self.jobs)) or 1
+        results = BatchEncrypt.run_batch(self.jobs, self.key, self.decrypt, file_workers,
+                                         max(1, self.chunk_workers // file_workers),
+                                         progress=self.report_progress, file_done=self.file_finished.emit,
+                                         is_canceled=lambda: self.is_canceled, key_store=self.key_store,
+                                         key_id=self.key_id, codec=self.codec)
+        self.report_progress(None, None, force=True)
+        self.batch_complete.emit(results)
+
+    def report_progress(self, index, bytes_done, force=False):
+        # Called from every worker; updates go out at most ten times per second
+        with self.lock:
+            if index is not None:
+                self.bytes_done[index] = bytes_done
+            now = time.monotonic()
+            if not force and now - self.last_emit < 0.1:
+                return
+            self.last_emit = now
+            snapshot = list(self.bytes_done)
+        elapsed = now - self.start_time
+        self.progress_updated.emit(snapshot, sum(snapshot) / elapsed if elapsed > 0 else 0.0)
 
 
 class FileEncrypt(QWidget):
@@ -33,11 +83,34 @@ class FileEncrypt(QWidget):
 
         # Button Events
         self.ui.BtnChooseFile.clicked.connect(self.choose_file)
+        self.ui.BtnChooseFolder.clicked.connect(self.choose_folder)
         self.ui.BtnSaveFile.clicked.connect(self.choose_save_folder)
         self.ui.BtnEncrypt.clicked.connect(self.encrypt_file)
         self.ui.BtnDecrypt.clicked.connect(self.decrypt_file)
+        self.ui.BtnCancel.clicked.connect(self.cancel_batch)
         self.ui.BtnClear.clicked.connect(self.clear_fields)
         self.ui.BtnMainMenu.clicked.connect(self.Close)
+        # A path typed or pasted over a dialog selection replaces it
+        self.ui.FileSelect.textEdited.connect(self.clear_selection)
+
+        # Chunks are independent, so one thread per core by default
+        self.ui.SpinWorkers.setValue(min(CryptoStream.DEFAULT_WORKERS, self.ui.SpinWorkers.maximum()))
+
+        self.file_paths = []
+        self.thread = None
+        # Keys are recorded in the local key store so decryption can find them again
+        self.key_store_error = ""
+        try:
+            self.key_store = KeyStore()
+        except Exception as e:
+            # Keys then have to be typed in; say so rather than fail on the first key id lookup
+            self.key_store = None
+            self.key_store_error = f"Key store unavailable: {str(e) or type(e).__name__}"
+            self.ui.LblStatus.setText(self.key_store_error)
+        self.jobs = []
+        self.bytes_done = []
+        self.decrypting = False
+        self.ui.TableFiles.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
 
         # Set the window properties
         self.setWindowTitle("File Encryptor")
@@ -58,8 +131,31 @@ class FileEncrypt(QWidget):
         file_paths, _ = file_dialog.getOpenFileNames(self, "Choose file(s)")
 
         if file_paths:
-            # Update the QLineEdit with the selected file path
-            self.ui.FileSelect.setText(file_paths[0])
+            self.set_inputs(file_paths)
+
+    def choose_folder(self):
+        folder = QFileDialog.getExistingDirectory(self, "Choose a folder to encrypt or decrypt")
+
+        if folder:
+            self.set_inputs([folder])
+
+    def set_inputs(self, paths):
+        # Every selected file (or folder) is processed, not just the first one
+        self.file_paths = paths
+        if len(paths) == 1:
+            self.ui.FileSelect.setText(paths[0])
+        else:
+            self.ui.FileSelect.setText(f"{len(paths)} files selected")
+
+    def clear_selection(self):
+        self.file_paths = []
+
+    def selected_paths(self):
+        # Dialog picks first, otherwise whatever path is in the field, as before batches existed
+        if self.file_paths:
+            return self.file_paths
+        file_path = self.ui.FileSelect.text().strip()
+        return [file_path] if file_path else []
 
     def choose_save_folder(self):
         save_folder = QFileDialog.getExistingDirectory(self, "Choose a folder to save the file")
@@ -69,86 +165,171 @@ class FileEncrypt(QWidget):
             self.ui.FileSave.setText(save_folder)
 
     def encrypt_file(self):
-        file_path = self.ui.FileSelect.text()
         save_folder = self.ui.FileSave.text()
+        file_paths = self.selected_paths()
 
-        if not file_path or not save_folder:
+        if not file_paths or not save_folder:
             QMessageBox.warning(self, "Encryption Error", "Please choose a file and a save folder.")
             return
 
-        # Generate a random 32-byte key for encryption
+        # One random master key for the whole batch, each file gets its own data key wrapped by it
         key = generate_random_key()
+        master_key = CryptoStream.key_from_text(key)
+        key_id = None
+        if self.key_store is not None:
+            label = f"{len(file_paths)} item(s) starting with {os.path.basename(file_paths[0])}"
+            key_id = self.key_store.add_key(master_key, label)
         self.ui.HashKey.setText(key.decode())
-        fernet = Fernet(key)
-
-        try:
-            with open(file_path, 'rb') as file:
-                file_data = file.read()
-
-            encrypted_data = fernet.encrypt(file_data)
-
-            # Get the file name from the original file path
-            file_name = os.path.basename(file_path)
-
-            # Create the save file path using the selected folder and original file name
-            save_path = os.path.join(save_folder, file_name + '.enc')
-
-            with open(save_path, 'wb') as file:
-                file.write(encrypted_data)
-
-            QMessageBox.information(self, "Encryption Successful", "File encrypted and saved successfully.")
-        except FileNotFoundError:
-            QMessageBox.critical(self, "Encryption Error", "File not found.")
-        except PermissionError:
-            QMessageBox.critical(self, "Encryption Error", "Permission denied. Please check file access permissions.")
-        except Exception as e:
-            QMessageBox.critical(self, "Encryption Error", f"An error occurred while encrypting the file:\n{str(e)}")
+        self.start_batch(master_key, decrypt=False, key_id=key_id)
 
     def decrypt_file(self):
-        file_path = self.ui.FileSelect.text()
         save_folder = self.ui.FileSave.text()
         key = self.ui.HashKey.text().encode()
 
-        if not file_path or not save_folder:
+        if not self.selected_paths() or not save_folder:
             QMessageBox.warning(self, "Decryption Error", "Please choose a file and a save folder.")
             return
 
-        if not key:
-            QMessageBox.warning(self, "Decryption Error", "Please enter a valid decryption key.")
+        if not key and self.key_store is None:
+            message = "Please enter a valid decryption key."
+            if self.key_store_error:
+                message += f"\n{self.key_store_error}, so keys cannot be looked up by key id."
+            QMessageBox.warning(self, "Decryption Error", message)
             return
 
+        # With an empty key field every file's key is looked up in the key store by its header key id
+        master_key = None
+        if key:
+            try:
+                master_key = CryptoStream.key_from_text(key)
+            except ValueError as e:
+                QMessageBox.warning(self, "Decryption Error", str(e))
+                return
+        self.start_batch(master_key, decrypt=True)
+
+    def start_batch(self, key, decrypt, key_id=None):
+        title = "Decryption Error" if decrypt else "Encryption Error"
+        if self.thread is not None and self.thread.isRunning():
+            return
         try:
-            fernet = Fernet(key)
-
-            with open(file_path, 'rb') as file:
-                file_data = file.read()
-
-            decrypted_data = fernet.decrypt(file_data)
-
-            # Get the original file name from the encrypted file path
-            file_name = os.path.splitext(os.path.basename(file_path))[0]
-
-            # Create the save file path using the selected folder and original file name
-            save_path = os.path.join(save_folder, file_name)
-
-            with open(save_path, 'wb') as file:
-                file.write(decrypted_data)
-
-            QMessageBox.information(self, "Decryption Successful", "File decrypted and saved successfully.")
+            self.jobs = BatchEncrypt.collect_jobs(self.selected_paths(), self.ui.FileSave.text(), decrypt)
         except FileNotFoundError:
-            QMessageBox.critical(self, "Decryption Error", "File not found.")
-        except PermissionError:
-            QMessageBox.critical(self, "Decryption Error", "Permission denied. Please check file access permissions.")
-        except Exception as e:
-            QMessageBox.critical(self, "Decryption Error", f"An error occurred while decrypting the file:\n{str(e)}")
+            QMessageBox.critical(self, title, "File not found.")
+            return
+        except OSError as e:
+            QMessageBox.critical(self, title, f"Could not read the selection:\n{str(e)}")
+            return
+        if not self.jobs:
+            QMessageBox.warning(self, title, "The selected folder contains no files.")
+            return
+
+        self.decrypting = decrypt
+        self.bytes_done = [0] * len(self.jobs)
+        self.ui.TableFiles.setRowCount(len(self.jobs))
+        for row, job in enumerate(self.jobs):
+            self.ui.TableFiles.setItem(row, 0, QTableWidgetItem(job.input_path))
+            self.ui.TableFiles.setItem(row, 1, QTableWidgetItem("0%"))
+            self.ui.TableFiles.setItem(row, 2, QTableWidgetItem("Queued"))
+        self.ui.ProgressTotal.setRange(0, 1000)
+        self.ui.ProgressTotal.setValue(0)
+        self.ui.LblStatus.setText("Starting...")
+        self.set_busy(True)
+
+        codec = CODEC_ZSTD if self.ui.ChkCompress.isChecked() and not decrypt else CODEC_NONE
+        self.thread = BatchThread(self.jobs, key, decrypt, self.ui.SpinWorkers.value(), self.key_store, key_id,
+                                  codec)
+        self.thread.progress_updated.connect(self.update_progress)
+        self.thread.file_finished.connect(self.file_finished)
+        self.thread.batch_complete.connect(self.batch_complete)
+        self.thread.start()
+
+    def cancel_batch(self):
+        if self.thread is not None and self.thread.isRunning():
+            self.thread.is_canceled = True
+            self.ui.BtnCancel.setEnabled(False)
+            self.ui.LblStatus.setText("Canceling...")
+
+    def update_progress(self, bytes_done, speed):
+        for row, done in enumerate(bytes_done):
+            if done == self.bytes_done[row]:
+                continue
+            self.bytes_done[row] = done
+            size = self.jobs[row].size
+            self.ui.TableFiles.item(row, 1).setText(f"{100 if not size else min(100, done * 100 // size)}%")
+            if self.ui.TableFiles.item(row, 2).text() == "Queued":
+                self.ui.TableFiles.item(row, 2).setText("Running")
+
+        done = sum(self.bytes_done)
+        total = sum(job.size for job in self.jobs)
+        self.ui.ProgressTotal.setValue(1000 if not total else min(1000, done * 1000 // total))
+        if self.thread is None or self.thread.is_canceled:
+            return
+        mb = 1024 * 1024
+        status = f"{done / mb:,.1f} / {total / mb:,.1f} MB  -  {speed / mb:,.1f} MB/s"
+        if speed > 0 and done < total:
+            remaining = int((total - done) / speed)
+            status += f"  -  ETA {remaining // 60}:{remaining % 60:02d}"
+        self.ui.LblStatus.setText(status)
+
+    def file_finished(self, row, result):
+        status = {"ok": "Done", "failed": "Failed", "canceled": "Canceled"}[result["status"]]
+        if result["error"]:
+            status = f"{status}: {result['error']}"
+        self.ui.TableFiles.item(row, 2).setText(status)
+        if result["status"] == "ok":
+            self.ui.TableFiles.item(row, 1).setText("100%")
+
+    def batch_complete(self, results):
+        self.set_busy(False)
+        summary = BatchEncrypt.summarize(results, self.decrypting)
+        action = "Decryption" if self.decrypting else "Encryption"
+        text = f"{summary['succeeded']} of {summary['files']} files processed successfully."
+
+        if len(results) > 1:
+            summary_path = os.path.join(self.ui.FileSave.text(), BatchEncrypt.SUMMARY_NAME)
+            try:
+                BatchEncrypt.write_summary(results, summary_path, self.decrypting)
+                text += f"\nSummary written to {summary_path}"
+            except OSError as e:
+                text += f"\nThe summary could not be written: {str(e)}"
+        self.ui.LblStatus.setText(text.splitlines()[0])
+
+        if summary["canceled"]:
+            self.ui.LblStatus.setText(f"{action} canceled. " + text.splitlines()[0])
+            QMessageBox.warning(self, f"{action} Canceled", f"{action} canceled.\n{text}")
+        elif summary["failed"]:
+            errors = "\n".join(f"{os.path.basename(result['input'])}: {result['error']}"
+                               for result in results if result["status"] == "failed")
+            QMessageBox.critical(self, f"{action} Error", f"{text}\n\n{errors}")
+        elif len(results) == 1:
+            past = "decrypted" if self.decrypting else "encrypted"
+            QMessageBox.information(self, f"{action} Successful", f"File {past} and saved successfully.")
+        else:
+            QMessageBox.information(self, f"{action} Successful", text)
+
+    def set_busy(self, busy):
+        for button in (self.ui.BtnEncrypt, self.ui.BtnDecrypt, self.ui.BtnClear, self.ui.BtnChooseFile,
+                       self.ui.BtnChooseFolder, self.ui.ChkCompress):
+            button.setEnabled(not busy)
+        self.ui.BtnCancel.setEnabled(busy)
 
     def clear_fields(self):
         # Clear the file selection, save folder, and hash key fields
         self.ui.FileSelect.clear()
         self.ui.FileSave.clear()
         self.ui.HashKey.clear()
+        self.file_paths = []
+        self.ui.TableFiles.setRowCount(0)
+        self.ui.ProgressTotal.setValue(0)
+        self.ui.LblStatus.setText(self.key_store_error)
 
     def Close(self):
+        if self.thread is not None and self.thread.isRunning():
+            self.thread.is_canceled = True
+            self.thread.wait()
+        if self.key_store is not None:
+            self.key_store.close()
+            self.key_store = None
         self.ui.close()
 
     def apply_styles(self):
@@ -165,6 +346,8 @@ class FileEncrypt(QWidget):
             "QPushButton:pressed { background-color: #43ad13; }"
         )
         self.ui.BtnChooseFile.setStyleSheet(button_style)
+        self.ui.BtnChooseFolder.setStyleSheet(button_style)
+        self.ui.BtnCancel.setStyleSheet(button_style)
         self.ui.BtnSaveFile.setStyleSheet(button_style)
         self.ui.BtnEncrypt.setStyleSheet(button_style)
         self.ui.BtnDecrypt.setStyleSheet(button_style)
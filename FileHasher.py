@@ -1,11 +1,121 @@
-import hashlib
+import os
 import sys
-import zlib
+import time
 
-from PySide6.QtCore import QFile
+from PySide6.QtCore import QFile, QThread, Signal
 from PySide6.QtUiTools import QUiLoader
 from PySide6.QtWidgets import QApplication, QWidget, QMessageBox, QFileDialog
 
+from HashCache import HashCache, cached_hash_file
+from HashEngine import ALGORITHMS, DEFAULT_WORKERS
+from HashManifest import CHECKSUM_FORMATS, hash_tree, write_manifest
+from TreeHash import default_algorithm, tree_hash_file, tree_label, write_tree_hash
+
+
+class HashThread(QThread):
+    progress_updated = Signal(object, object, float)  # bytes done, total bytes, bytes per second
+    hashing_complete = Signal(dict)
+    hashing_failed = Signal(str)
+
+    def __init__(self, path, algorithms, tree_hash=False):
+        super().__init__()
+        self.path = path
+        self.algorithms = algorithms
+        self.tree_hash = tree_hash
+        self.tree = None  # the full tree hash, chunk digests included
+        self.is_canceled = False
+        self.total = 0
+        self.start_time = 0.0
+        self.last_emit = 0.0
+
+    def run(self):
+        hashes = {}
+        try:
+            file_size = os.path.getsize(self.path)
+            # The streaming digests and the tree hash each read the file once
+            self.total = file_size * (bool(self.algorithms) + self.tree_hash)
+            self.start_time = time.monotonic()
+
+            if self.algorithms:
+                # The cache connection has to be opened on the thread that uses it
+                with HashCache() as cache:
+                    digests = cached_hash_file(self.path, self.algorithms, cache, workers=DEFAULT_WORKERS,
+                                               progress=self.report_progress, is_canceled=lambda: self.is_canceled)
+                if digests is None:
+                    return
+                hashes.update(digests)
+
+            if self.tree_hash:
+                offset = file_size if self.algorithms else 0
+                tree = tree_hash_file(self.path, progress=lambda done: self.report_progress(offset + done),
+                                      is_canceled=lambda: self.is_canceled)
+                if tree is None:
+                    return
+                hashes["tree"] = tree["root"]
+                self.tree = tree
+        except IOError as e:
+            self.hashing_failed.emit(f"Error reading the file: {str(e)}")
+            return
+        except Exception as e:
+            # Cache and engine errors too, or the window would wait on a thread that is gone
+            self.hashing_failed.emit(str(e) or type(e).__name__)
+            return
+
+        if not self.is_canceled:
+            self.report_progress(self.total, force=True)
+            self.hashing_complete.emit(hashes)
+
+    def report_progress(self, bytes_done, force=False):
+        # Limit updates to ten per second so the GUI event loop is not flooded
+        now = time.monotonic()
+        if not force and now - self.last_emit < 0.1:
+            return
+        self.last_emit = now
+        elapsed = now - self.start_time
+        speed = bytes_done / elapsed if elapsed > 0 else 0.0
+        self.progress_updated.emit(bytes_done, self.total, speed)
+
+
+class FolderHashThread(QThread):
+    progress_updated = Signal(object, object, float)  # files done, total files, files per second
+    hashing_complete = Signal(int)
+    hashing_failed = Signal(str)
+
+    def __init__(self, folder_path, manifest_path, algorithms):
+        super().__init__()
+        self.folder_path = folder_path
+        self.manifest_path = manifest_path
+        self.algorithms = algorithms
+        self.is_canceled = False
+        self.start_time = 0.0
+        self.last_emit = 0.0
+
+    def run(self):
+        self.start_time = time.monotonic()
+        try:
+            with HashCache() as cache:
+                tree = hash_tree(self.folder_path, self.algorithms, cache=cache, progress=self.report_progress,
+                                 is_canceled=lambda: self.is_canceled)
+            if tree is None:
+                return
+            write_manifest(tree, self.manifest_path, self.folder_path, self.algorithms)
+        except (IOError, ValueError) as e:
+            self.hashing_failed.emit(f"Error hashing the folder: {str(e)}")
+            return
+        except Exception as e:
+            self.hashing_failed.emit(str(e) or type(e).__name__)
+            return
+        self.hashing_complete.emit(len(tree))
+
+    def report_progress(self, files_done, total):
+        # Throttled like HashThread, but the last file is always shown
+        now = time.monotonic()
+        if files_done < total and now - self.last_emit < 0.1:
+            return
+        self.last_emit = now
+        elapsed = now - self.start_time
+        self.progress_updated.emit(files_done, total, files_done / elapsed if elapsed > 0 else 0.0)
+
 
 class FileHasher(QWidget):
     def __init__(self):
@@ -25,10 +135,37 @@ class FileHasher(QWidget):
 
         # Button Events
         self.ui.BtnFile.clicked.connect(self.choose_file)
+        self.ui.BtnFolder.clicked.connect(self.choose_folder)
         self.ui.BtSubmit.clicked.connect(self.calculate_hashes)
+        self.ui.BtnCancel.clicked.connect(self.cancel_hashing)
+        self.ui.BtnSaveTree.clicked.connect(self.save_tree)
         self.ui.BtnClear.clicked.connect(self.Clear_Text)
         self.ui.BtnClose.clicked.connect(self.Close)
 
+        self.thread = None
+        self.tree = None
+        self.ui.ProgressBar.setRange(0, 1000)
+        # The tree root is not the plain BLAKE3/BLAKE2b digest of the file, so name it exactly
+        self.ui.ChkTree.setText(tree_label(default_algorithm()))
+
+        # Algorithm selection checkbox and result field for every digest
+        self.hash_fields = {
+            "md5": (self.ui.ChkMd5, self.ui.lineEdit_3),
+            "sha256": (self.ui.ChkSha256, self.ui.lineEdit_4),
+            "blake2b": (self.ui.ChkBlake2, self.ui.lineEdit_5),
+            "sha3_256": (self.ui.ChkSha3, self.ui.lineEdit_6),
+            "sha512": (self.ui.ChkSha512, self.ui.lineEdit),
+            "crc32": (self.ui.ChkCrc32, self.ui.lineEdit_2),
+            "sha1": (self.ui.ChkSha1, self.ui.lineEdit_7),
+            "xxh64": (self.ui.ChkXxh64, self.ui.lineEdit_8),
+            "xxh3_64": (self.ui.ChkXxh3, self.ui.lineEdit_9),
+            "crc32c": (self.ui.ChkCrc32c, self.ui.lineEdit_10),
+            "tree": (self.ui.ChkTree, self.ui.lineEdit_11),
+        }
+        if "xxh3_64" not in ALGORITHMS:
+            self.ui.ChkXxh3.setEnabled(False)
+            self.ui.ChkXxh3.setToolTip("Install the xxhash package to enable XXH3")
+
         # Show the widget
         self.ui.show()
 
@@ -72,34 +209,132 @@ class FileHasher(QWidget):
         file_path, _ = file_dialog.getOpenFileName(self, "Choose File")
         self.ui.File_Path.setText(file_path)
 
+    def choose_folder(self):
+        folder_path = QFileDialog.getExistingDirectory(self, "Choose Folder")
+        self.ui.File_Path.setText(folder_path)
+
     def calculate_hashes(self):
         file_path = self.ui.File_Path.text()
         if not file_path:
             self.show_error_dialog("Please choose a file.")
             return
 
+        if self.thread is not None:
+            return
+
+        if os.path.isdir(file_path):
+            self.hash_folder(file_path)
+            return
+
+        algorithms = self.selected_algorithms()
+        tree_hash = self.ui.ChkTree.isChecked()
+        if not algorithms and not tree_hash:
+            self.show_error_dialog("Please select at least one hash algorithm.")
+            return
+
+        # Hash on a worker thread so the window stays responsive on large files
+        self.tree = None
+        self.ui.BtnSaveTree.setEnabled(False)
+        self.ui.BtSubmit.setEnabled(False)
+        self.ui.BtnCancel.setEnabled(True)
+        self.ui.ProgressBar.setValue(0)
+        self.ui.LblStatus.setText("Hashing...")
+
+        self.thread = HashThread(file_path, algorithms, tree_hash)
+        self.thread.progress_updated.connect(self.update_progress)
+        self.thread.hashing_complete.connect(self.hashing_complete)
+        self.thread.hashing_failed.connect(self.show_error_dialog)
+        self.thread.finished.connect(self.hashing_finished)
+        self.thread.start()
+
+    def selected_algorithms(self):
+        return [name for name, (checkbox, _) in self.hash_fields.items()
+                if checkbox.isChecked() and name in ALGORITHMS]
+
+    def cancel_hashing(self):
+        if self.thread is not None:
+            self.thread.is_canceled = True
+            self.ui.LblStatus.setText("Canceling...")
+
+    def update_progress(self, bytes_done, total, speed):
+        self.ui.ProgressBar.setValue(int(bytes_done * 1000 / total) if total else 1000)
+        mb = 1024 * 1024
+        status = f"{bytes_done / mb:,.1f} / {total / mb:,.1f} MB  -  {speed / mb:,.1f} MB/s"
+        if speed > 0 and bytes_done < total:
+            remaining = int((total - bytes_done) / speed)
+            status += f"  -  ETA {remaining // 60}:{remaining % 60:02d}"
+        self.ui.LblStatus.setText(status)
+
+    def hashing_complete(self, hashes):
+        # Unselected digests were never computed, so their fields are left empty
+        for name, (_, line_edit) in self.hash_fields.items():
+            line_edit.setText(hashes.get(name, ""))
+        # Kept so the chunk digests can be saved for a later TreeHash.py --verify
+        self.tree = self.thread.tree
+        self.tree_path = self.thread.path
+        self.ui.BtnSaveTree.setEnabled(self.tree is not None)
+
+    def save_tree(self):
+        if self.tree is None:
+            return
+        output_path, _ = QFileDialog.getSaveFileName(self, "Save Tree Hash", self.tree_path + ".tree.json",
+                                                     "Tree hash (*.json)")
+        if not output_path:
+            return
         try:
-            with open(file_path, "rb") as file:
-                data = file.read()
-            # Different hash for calculation
-            md5_hash = hashlib.md5(data).hexdigest()
-            sha256_hash = hashlib.sha256(data).hexdigest()
-            blake2_hash = hashlib.blake2b(data).hexdigest()
-            sha3_hash = hashlib.sha3_256(data).hexdigest()
-            sha512_hash = hashlib.sha512(data).hexdigest()
-            sha1_hash = hashlib.sha1(data).hexdigest()
-            crc32_checksum = zlib.crc32(data)  # Calculate CRC32 checksum using z lib Library 
-            crc32_hash = f"{crc32_checksum & 0xffffffff:08x}"  # Convert checksum to hexadecimal CRC32 hash
-
-            self.ui.lineEdit_3.setText(md5_hash)
-            self.ui.lineEdit_4.setText(sha256_hash)
-            self.ui.lineEdit_5.setText(blake2_hash)
-            self.ui.lineEdit_6.setText(sha3_hash)
-            self.ui.lineEdit.setText(sha512_hash)
-            self.ui.lineEdit_2.setText(crc32_hash)
-            self.ui.lineEdit_7.setText(sha1_hash)
-        except IOError:
-            self.show_error_dialog("Error reading the file.")
+            write_tree_hash(self.tree, output_path)
+        except IOError as e:
+            self.show_error_dialog(f"Error saving the tree hash: {str(e)}")
+
+    def hashing_finished(self):
+        if self.thread.is_canceled:
+            self.ui.ProgressBar.setValue(0)
+            self.ui.LblStatus.setText("Hashing canceled.")
+        self.ui.BtSubmit.setEnabled(True)
+        self.ui.BtnCancel.setEnabled(False)
+        self.thread = None
+
+    def hash_folder(self, folder_path):
+        manifest_path, _ = QFileDialog.getSaveFileName(
+            self, "Save Manifest", folder_path + ".sha256",
+            "SHA-256 manifest (*.sha256);;BLAKE2b manifest (*.b2);;JSON manifest, all digests (*.json)"
+        )
+        if not manifest_path:
+            return
+
+        # A checksum manifest needs just its own digest, the JSON one gets the selected set
+        extension = os.path.splitext(manifest_path)[1].lstrip(".").lower()
+        if extension in CHECKSUM_FORMATS:
+            algorithms = [CHECKSUM_FORMATS[extension]]
+        else:
+            algorithms = self.selected_algorithms()
+        if not algorithms:
+            self.show_error_dialog("Please select at least one hash algorithm for the manifest.")
+            return
+
+        # A large tree takes as long as a large file, so it is hashed off the GUI thread too
+        self.ui.BtSubmit.setEnabled(False)
+        self.ui.BtnCancel.setEnabled(True)
+        self.ui.ProgressBar.setValue(0)
+        self.ui.LblStatus.setText("Hashing folder...")
+
+        self.thread = FolderHashThread(folder_path, manifest_path, algorithms)
+        self.thread.progress_updated.connect(self.update_folder_progress)
+        self.thread.hashing_complete.connect(self.folder_hashed)
+        self.thread.hashing_failed.connect(self.show_error_dialog)
+        self.thread.finished.connect(self.hashing_finished)
+        self.thread.start()
+
+    def folder_hashed(self, files):
+        QMessageBox.information(self, "Manifest Saved", f"Hashed {files} files.\nManifest: {self.thread.manifest_path}")
+
+    def update_folder_progress(self, files_done, total, speed):
+        self.ui.ProgressBar.setValue(int(files_done * 1000 / total) if total else 1000)
+        status = f"{files_done:,} / {total:,} files  -  {speed:,.1f} files/s"
+        if speed > 0 and files_done < total:
+            remaining = int((total - files_done) / speed)
+            status += f"  -  ETA {remaining // 60}:{remaining % 60:02d}"
+        self.ui.LblStatus.setText(status)
 
     def show_error_dialog(self, message):
         error_dialog = QMessageBox(self)
@@ -118,8 +353,19 @@ class FileHasher(QWidget):
         self.ui.lineEdit_5.clear()
         self.ui.lineEdit_6.clear()
         self.ui.lineEdit_7.clear()
+        self.ui.lineEdit_8.clear()
+        self.ui.lineEdit_9.clear()
+        self.ui.lineEdit_10.clear()
+        self.ui.lineEdit_11.clear()
+        self.tree = None
+        self.ui.BtnSaveTree.setEnabled(False)
+        self.ui.ProgressBar.setValue(0)
+        self.ui.LblStatus.clear()
 
     def Close(self):
+        if self.thread is not None:
+            self.thread.is_canceled = True
+            self.thread.wait()
         self.ui.close()
 
 
@@ -1,12 +1,89 @@
+import hashlib
+import hmac
 import os
 import re
 import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 
-from PySide6.QtCore import QFile
+from PySide6.QtCore import QFile, QThread, Signal
 from PySide6.QtUiTools import QUiLoader
-from PySide6.QtWidgets import QApplication, QWidget, QMessageBox, QFileDialog, QInputDialog, QLineEdit
+from PySide6.QtWidgets import (QApplication, QWidget, QMessageBox, QFileDialog, QInputDialog, QLineEdit,
+                               QHeaderView, QTableWidgetItem)
 from cryptography.fernet import Fernet, InvalidToken
 
+import CryptoStream
+from PasswordKey import DEFAULT_PARAMS, KEY_CACHE, PARAMS_SIZE, SALT_SIZE, file_key, pack_params, unpack_params
+
+# Protected file layout: magic | version | scrypt params | kdf salt | file salt,
+# then an HMAC of the header and a chunked CryptoStream container
+LOCK_MAGIC = b"SSLK"
+LOCK_VERSION = 2
+LOCK_HEADER_SIZE = len(LOCK_MAGIC) + 1 + PARAMS_SIZE + 2 * SALT_SIZE
+MAC_SIZE = 32
+MAC_INFO = b"SecureScript header MAC"
+
+
+class LockThread(QThread):
+    progress_updated = Signal(object, object)  # bytes done, total bytes
+    lock_complete = Signal(str)
+    lock_failed = Signal(str, str)  # title, message
+
+    def __init__(self, file_path, password, unlock=False):
+        super().__init__()
+        self.file_path = file_path
+        self.password = password
+        self.unlock = unlock
+        self.total = 0
+        self.last_emit = 0.0
+
+    def run(self):
+        try:
+            self.total = os.path.getsize(self.file_path)
+            if self.unlock:
+                result = unlock_file(self.file_path, self.password, progress=self.report_progress)
+            else:
+                result = password_protect_file(self.file_path, self.password, progress=self.report_progress)
+        except InvalidToken:
+            self.lock_failed.emit("Incorrect Password", "The provided password is incorrect.")
+            return
+        except Exception as e:
+            action = "extract" if self.unlock else "lock"
+            self.lock_failed.emit("Error", f"Failed to {action} the file: {str(e)}")
+            return
+        self.report_progress(self.total, force=True)
+        self.lock_complete.emit(result or "")
+
+    def report_progress(self, bytes_done, force=False):
+        # Limit updates to ten per second so the GUI event loop is not flooded
+        now = time.monotonic()
+        if not force and now - self.last_emit < 0.1:
+            return
+        self.last_emit = now
+        self.progress_updated.emit(bytes_done, self.total)
+
+
+class BulkLockThread(QThread):
+    targets_found = Signal(list)
+    file_finished = Signal(str, str, str)  # file path, status, detail
+    bulk_complete = Signal()
+
+    def __init__(self, folder, password, unlock=False):
+        super().__init__()
+        self.folder = folder
+        self.password = password
+        self.unlock = unlock
+        self.is_canceled = False
+
+    def run(self):
+        targets = collect_lock_targets(self.folder, self.unlock)
+        self.targets_found.emit(targets)
+        for file_path, status, detail in bulk_lock(targets, self.password, self.unlock,
+                                                   is_canceled=lambda: self.is_canceled):
+            self.file_finished.emit(file_path, status, detail)
+        self.bulk_complete.emit()
+
 
 class FileLock(QWidget):
     def __init__(self):
@@ -22,9 +99,18 @@ class FileLock(QWidget):
         self.ui.BtnChooseFile.clicked.connect(self.open_file)
         self.ui.BtnSubmit.clicked.connect(self.lock_file)
         self.ui.BtnExtract.clicked.connect(self.extract_file)
+        self.ui.BtnLockFolder.clicked.connect(self.lock_folder)
+        self.ui.BtnUnlockFolder.clicked.connect(self.unlock_folder)
+        self.ui.BtnCancel.clicked.connect(self.cancel_bulk)
         self.ui.BtnClose.clicked.connect(self.clear_fields)
         self.ui.BtnMainMenu.clicked.connect(self.Clear)
 
+        self.thread = None
+        self.ui.ProgressBar.setRange(0, 1000)
+        self.bulk_rows = {}
+        self.bulk_counts = {}
+        self.ui.TableFiles.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+
         self.ui.show()
 
         style_sheet = """
@@ -60,30 +146,32 @@ class FileLock(QWidget):
         file_path, _ = file_dialog.getOpenFileName(self, "Select File")
         self.ui.TxtChooseFile.setText(file_path)
 
-    def lock_file(self):
+    def read_new_password(self):
+        """Returns the validated password from the form, or None after warning the user"""
         password = self.ui.TxtPassword.text()
         confirm_password = self.ui.TxtConfirmPassword.text()
 
         if password != confirm_password:
             QMessageBox.warning(self, "Error", "Passwords do not match.")
-            return
+            return None
 
         if not password:
             QMessageBox.warning(self, "Error", "Password cannot be empty.")
-            return
+            return None
 
         if not self.validate_password(password):
             QMessageBox.warning(self, "Error", "Password must contain a combination of letters, numbers, and symbols.")
+            return None
+        return password
+
+    def lock_file(self):
+        password = self.read_new_password()
+        if password is None:
             return
 
         file_path = self.ui.TxtChooseFile.text()
         if file_path:
-            try:
-                protected_file_path = password_protect_file(file_path, password)
-                QMessageBox.information(self, "File Locked",
-                                        f"File has been password protected successfully.\nProtected file: {protected_file_path}")
-            except Exception as e:
-                QMessageBox.warning(self, "Error", f"Failed to lock the file: {str(e)}")
+            self.start_thread(file_path, password, unlock=False)
         else:
             QMessageBox.warning(self, "Error", "Please select a file.")
 
@@ -91,26 +179,152 @@ class FileLock(QWidget):
         file_dialog = QFileDialog()
         file_path, _ = file_dialog.getOpenFileName(self, "Select Protected File")
         if file_path:
-            try:
-                extracted_file_path = extract_file(file_path)
-                if extracted_file_path:
-                    QMessageBox.information(self, "File Extracted", "File has been successfully extracted.")
-                else:
-                    QMessageBox.warning(self, "Error",
-                                        "Failed to extract the file. Incorrect password or missing password file.")
-            except InvalidToken:
-                QMessageBox.warning(self, "Incorrect Password", "The provided password is incorrect.")
-            except Exception as e:
-                QMessageBox.warning(self, "Error", f"Failed to extract the file: {str(e)}")
+            password, ok = QInputDialog.getText(self, "Password", "Enter the password:", QLineEdit.Password)
+            if ok:
+                self.start_thread(file_path, password, unlock=True)
         else:
             QMessageBox.warning(self, "Error", "Please select a protected file.")
 
+    def lock_folder(self):
+        password = self.read_new_password()
+        if password is None:
+            return
+
+        folder = QFileDialog.getExistingDirectory(self, "Select Folder to Lock")
+        if folder:
+            self.start_bulk(folder, password, unlock=False)
+
+    def unlock_folder(self):
+        folder = QFileDialog.getExistingDirectory(self, "Select Folder to Unlock")
+        if not folder:
+            return
+
+        # One password for every protected file in the folder
+        password, ok = QInputDialog.getText(self, "Password", "Enter the password:", QLineEdit.Password)
+        if ok:
+            self.start_bulk(folder, password, unlock=True)
+
+    def start_bulk(self, folder, password, unlock):
+        if self.thread is not None and self.thread.isRunning():
+            return
+        self.set_busy(True)
+        self.ui.BtnCancel.setEnabled(True)
+        self.ui.ProgressBar.setValue(0)
+        self.ui.TableFiles.setRowCount(0)
+        self.ui.LblStatus.setText("Scanning folder...")
+        self.bulk_rows = {}
+        self.bulk_counts = {}
+
+        self.thread = BulkLockThread(folder, password, unlock)
+        self.thread.targets_found.connect(self.targets_found)
+        self.thread.file_finished.connect(self.bulk_file_finished)
+        self.thread.bulk_complete.connect(self.bulk_complete)
+        self.thread.finished.connect(self.thread_finished)
+        self.thread.start()
+
+    def targets_found(self, targets):
+        self.ui.TableFiles.setRowCount(len(targets))
+        for row, file_path in enumerate(targets):
+            self.bulk_rows[file_path] = row
+            self.ui.TableFiles.setItem(row, 0, QTableWidgetItem(file_path))
+            self.ui.TableFiles.setItem(row, 1, QTableWidgetItem("Queued"))
+        self.ui.LblStatus.setText(f"0 of {len(targets)} files done")
+
+    def bulk_file_finished(self, file_path, status, detail):
+        row = self.bulk_rows.get(file_path)
+        if row is None:
+            # Files rejected before the pool started are listed too
+            row = self.ui.TableFiles.rowCount()
+            self.ui.TableFiles.setRowCount(row + 1)
+            self.bulk_rows[file_path] = row
+            self.ui.TableFiles.setItem(row, 0, QTableWidgetItem(file_path))
+            self.ui.TableFiles.setItem(row, 1, QTableWidgetItem(""))
+        text = status.capitalize()
+        if detail and status not in ("locked", "unlocked"):
+            text += f": {detail}"
+        self.ui.TableFiles.item(row, 1).setText(text)
+
+        self.bulk_counts[status] = self.bulk_counts.get(status, 0) + 1
+        done = sum(self.bulk_counts.values())
+        total = self.ui.TableFiles.rowCount()
+        self.ui.ProgressBar.setValue(done * 1000 // total if total else 1000)
+        self.ui.LblStatus.setText(f"{done} of {total} files done")
+
+    def bulk_complete(self):
+        self.ui.ProgressBar.setValue(1000)
+        if not self.bulk_counts:
+            QMessageBox.information(self, "Nothing To Do", "No matching files were found in the folder.")
+            return
+        summary = ", ".join(f"{count} {status}" for status, count in sorted(self.bulk_counts.items()))
+        if set(self.bulk_counts) <= {"locked", "unlocked"}:
+            QMessageBox.information(self, "Folder Processed", f"All files processed: {summary}.")
+        else:
+            QMessageBox.warning(self, "Folder Processed", f"Some files were not processed: {summary}.")
+
+    def set_busy(self, busy):
+        for button in (self.ui.BtnSubmit, self.ui.BtnExtract, self.ui.BtnLockFolder, self.ui.BtnUnlockFolder):
+            button.setEnabled(not busy)
+        if not busy:
+            self.ui.BtnCancel.setEnabled(False)
+
+    def cancel_bulk(self):
+        # Files already in the pool finish; the rest are listed as canceled
+        if isinstance(self.thread, BulkLockThread) and self.thread.isRunning():
+            self.thread.is_canceled = True
+            self.ui.BtnCancel.setEnabled(False)
+            self.ui.LblStatus.setText("Canceling...")
+
+    def start_thread(self, file_path, password, unlock):
+        if self.thread is not None and self.thread.isRunning():
+            return
+        self.set_busy(True)
+        self.ui.ProgressBar.setValue(0)
+        self.ui.LblStatus.setText("Extracting..." if unlock else "Locking...")
+
+        self.thread = LockThread(file_path, password, unlock)
+        self.thread.progress_updated.connect(self.update_progress)
+        self.thread.lock_complete.connect(self.lock_complete)
+        self.thread.lock_failed.connect(self.lock_failed)
+        self.thread.finished.connect(self.thread_finished)
+        self.thread.start()
+
+    def update_progress(self, bytes_done, total):
+        self.ui.ProgressBar.setValue(int(bytes_done * 1000 / total) if total else 1000)
+        mb = 1024 * 1024
+        self.ui.LblStatus.setText(f"{bytes_done / mb:,.1f} / {total / mb:,.1f} MB")
+
+    def lock_complete(self, result_path):
+        if not self.thread.unlock:
+            QMessageBox.information(self, "File Locked",
+                                    f"File has been password protected successfully.\nProtected file: {result_path}")
+        elif result_path:
+            QMessageBox.information(self, "File Extracted", "File has been successfully extracted.")
+        else:
+            QMessageBox.warning(self, "Error",
+                                "Failed to extract the file. Incorrect password or missing password file.")
+
+    def lock_failed(self, title, message):
+        self.ui.ProgressBar.setValue(0)
+        QMessageBox.warning(self, title, message)
+
+    def thread_finished(self):
+        self.set_busy(False)
+        if not isinstance(self.thread, BulkLockThread):
+            self.ui.LblStatus.setText("")
+
     def clear_fields(self):
         self.ui.TxtChooseFile.setText("")
         self.ui.TxtPassword.setText("")
         self.ui.TxtConfirmPassword.setText("")
+        self.ui.TableFiles.setRowCount(0)
+        # Forget any cached password keys along with the fields
+        KEY_CACHE.clear()
 
     def Clear(self):
+        if self.thread is not None and self.thread.isRunning():
+            if isinstance(self.thread, BulkLockThread):
+                self.thread.is_canceled = True
+            self.thread.wait()
         self.ui.close();
 
     @staticmethod
@@ -121,18 +335,6 @@ class FileLock(QWidget):
         return False
 
 
-def encrypt_password_file(input_file_path, output_file_path):
-    key = Fernet.generate_key()
-    cipher_suite = Fernet(key)
-
-    with open(input_file_path, 'rb') as file:
-        file_data = file.read()
-        encrypted_data = cipher_suite.encrypt(file_data)
-
-    with open(output_file_path, 'wb') as encrypted_file:
-        encrypted_file.write(key + encrypted_data)
-
-
 def decrypt_password_file(encrypted_file_path):
     with open(encrypted_file_path, 'rb') as encrypted_file:
         encrypted_data = encrypted_file.read()
@@ -144,61 +346,235 @@ def decrypt_password_file(encrypted_file_path):
     return decrypted_data.decode()
 
 
-def password_protect_file(file_path, password):
+def build_lock_header(params, kdf_salt, file_salt, version=LOCK_VERSION):
+    return LOCK_MAGIC + bytes([version]) + pack_params(params) + kdf_salt + file_salt
+
+
+def read_lock_header(data):
+    """Parses (version, params, kdf salt, file salt) from the start of a protected file, or None for the legacy format"""
+    if not data.startswith(LOCK_MAGIC):
+        return None
+    if len(data) < LOCK_HEADER_SIZE:
+        raise ValueError("Protected file header is truncated.")
+    version = data[len(LOCK_MAGIC)]
+    if version != LOCK_VERSION:
+        raise ValueError(f"Unsupported protected file version: {version}")
+    offset = len(LOCK_MAGIC) + 1
+    params = unpack_params(data[offset:offset + PARAMS_SIZE])
+    offset += PARAMS_SIZE
+    return version, params, data[offset:offset + SALT_SIZE], data[offset + SALT_SIZE:offset + 2 * SALT_SIZE]
+
+
+def master_key_pair(master_key, file_salt):
+    """(file key, header MAC key) for one file under an scrypt master key"""
+    return file_key(master_key, file_salt), file_key(master_key, file_salt, MAC_INFO)
+
+
+def password_keys(password, params, kdf_salt, file_salt, cache=KEY_CACHE):
+    """(file key, header MAC key); the scrypt step comes from the cache when it was run recently"""
+    return master_key_pair(cache.master_key(password, kdf_salt, params), file_salt)
+
+
+def header_mac(mac_key, header):
+    return hmac.new(mac_key, header, hashlib.sha256).digest()
+
+
+def protected_path(file_path):
     file_name = os.path.basename(file_path)
     file_name_root, file_ext = os.path.splitext(file_name)
-    protected_file_name = f"{file_name_root}Protected{file_ext}"
-    protected_file_path = os.path.join(os.path.dirname(file_path), protected_file_name)
-
-    key = Fernet.generate_key()
-    cipher_suite = Fernet(key)
+    return os.path.join(os.path.dirname(file_path), f"{file_name_root}Protected{file_ext}")
 
-    with open(file_path, 'rb') as file:
-        file_data = file.read()
-        encrypted_data = cipher_suite.encrypt(file_data)
 
-    with open(protected_file_path, 'wb') as protected_file:
-        protected_file.write(key + encrypted_data)
+def extracted_path(file_path):
+    return os.path.join(os.path.dirname(file_path), os.path.basename(file_path).replace('Protected', ''))
 
-    password_file = os.path.join(os.path.dirname(file_path), "password.txt")
-    with open(password_file, 'w') as pass_file:
-        pass_file.write(password)
 
-    # Encrypt the password file securely
-    encrypt_password_file(password_file, password_file + '.encrypted')
+def protect_with_master_key(file_path, master_key, params, kdf_salt, progress=None):
+    """Locks a file under an already derived master key and returns the protected path"""
+    protected_file_path = protected_path(file_path)
+    file_salt = os.urandom(SALT_SIZE)
+    key, mac_key = master_key_pair(master_key, file_salt)
+    header = build_lock_header(params, kdf_salt, file_salt)
 
+    # Streamed in chunks, so memory use does not grow with the file
+    CryptoStream.encrypt_file(file_path, protected_file_path, key, progress=progress,
+                              preamble=header + header_mac(mac_key, header))
     return protected_file_path
 
 
-def extract_file(file_path):
-    password, ok = QInputDialog.getText(None, "Password", "Enter the password:", QLineEdit.Password)
-    if not ok:
-        raise Exception("Password entry canceled.")
+def password_protect_file(file_path, password, params=DEFAULT_PARAMS, cache=KEY_CACHE, progress=None):
+    # The key comes from the password, so nothing secret is stored next to the file
+    kdf_salt = cache.lock_salt(password, params)
+    return protect_with_master_key(file_path, cache.master_key(password, kdf_salt, params), params, kdf_salt,
+                                   progress)
 
+
+def unlock_legacy_file(file_data, file_path, password):
+    # Files locked before password keys carry their Fernet key and rely on the shared password file
     password_file = os.path.join(os.path.dirname(file_path), "password.txt.encrypted")
     if not os.path.exists(password_file):
         return None
 
     stored_password = decrypt_password_file(password_file)
+    if password != stored_password:
+        return None
 
-    if password == stored_password:
-        with open(file_path, 'rb') as file:
-            file_data = file.read()
-            key = file_data[:44]
-            cipher_suite = Fernet(key)
+    key = file_data[:44]
+    cipher_suite = Fernet(key)
+    return cipher_suite.decrypt(file_data[44:])
 
-            decrypted_data = cipher_suite.decrypt(file_data[44:])
 
-        extracted_file_name = os.path.basename(file_path).replace('Protected', '')
-        extracted_file_path = os.path.join(os.path.dirname(file_path), extracted_file_name)
+def read_file_header(file_path):
+    """Returns (header bytes with MAC, parsed header); the parsed part is None for legacy files"""
+    with open(file_path, 'rb') as file:
+        head = file.read(LOCK_HEADER_SIZE + MAC_SIZE)
+    return head, read_lock_header(head)
 
-        with open(extracted_file_path, 'wb') as extracted_file:
-            extracted_file.write(decrypted_data)
 
-        return extracted_file_path
-    else:
+def unlock_with_master_key(file_path, master_key, progress=None):
+    """Unlocks a password-key protected file under an already derived master key.
+
+    Raises InvalidToken when the master key does not belong to the file,
+    decided from the header MAC before any of the content is read.
+    """
+    head, (_, _, _, file_salt) = read_file_header(file_path)
+    key, mac_key = master_key_pair(master_key, file_salt)
+    extracted_file_path = extracted_path(file_path)
+
+    if not hmac.compare_digest(header_mac(mac_key, head[:LOCK_HEADER_SIZE]), head[LOCK_HEADER_SIZE:]):
+        raise InvalidToken()
+    CryptoStream.decrypt_file(file_path, extracted_file_path, key, progress=progress,
+                              offset=LOCK_HEADER_SIZE + MAC_SIZE)
+    return extracted_file_path
+
+
+def unlock_file(file_path, password, cache=KEY_CACHE, progress=None):
+    """Decrypts a protected file next to it and returns the new path.
+
+    Raises InvalidToken on a wrong password. Legacy files return None when
+    their password file is missing or does not match.
+    """
+    _, header = read_file_header(file_path)
+    if header is not None:
+        _, params, kdf_salt, _ = header
+        return unlock_with_master_key(file_path, cache.master_key(password, kdf_salt, params), progress)
+
+    with open(file_path, 'rb') as file:
+        file_data = file.read()
+    decrypted_data = unlock_legacy_file(file_data, file_path, password)
+    if decrypted_data is None:
         return None
 
+    extracted_file_path = extracted_path(file_path)
+    with open(extracted_file_path, 'wb') as extracted_file:
+        extracted_file.write(decrypted_data)
+
+    return extracted_file_path
+
+
+def collect_lock_targets(folder, unlock=False):
+    """Files under folder to lock (those not protected yet) or unlock (protected ones), largest first"""
+    targets = []
+    for dir_path, _, files in os.walk(folder):
+        for file in files:
+            file_path = os.path.join(dir_path, file)
+            try:
+                with open(file_path, 'rb') as target:
+                    protected = target.read(len(LOCK_MAGIC)) == LOCK_MAGIC
+                size = os.path.getsize(file_path)
+            except OSError:
+                continue
+            if protected == unlock:
+                targets.append((size, file_path))
+    targets.sort(reverse=True)
+    return [file_path for _, file_path in targets]
+
+
+def _lock_job(file_path, master_key, params, kdf_salt):
+    return protect_with_master_key(file_path, master_key, params, kdf_salt)
+
+
+def _unlock_job(file_path, master_key):
+    return unlock_with_master_key(file_path, master_key)
+
+
+def bulk_lock(file_paths, password, unlock=False, workers=None, params=DEFAULT_PARAMS, cache=KEY_CACHE,
+              is_canceled=None):
+    """Locks or unlocks many files with one password, spread over a process pool.
+
+    scrypt runs here, once per distinct salt, and only the derived master keys
+    are sent to the workers. Yields (file path, status, detail) as each file
+    finishes; status is "locked", "unlocked", "wrong password", "failed" or
+    "canceled". At most 2 * workers files are handed to the pool at a time,
+    and is_canceled is checked at least ten times a second, so a cancel
+    stops new submissions at once and only the files already running finish.
+    """
+    if workers is None:
+        workers = CryptoStream.DEFAULT_WORKERS
+
+    jobs = []
+    if not unlock:
+        kdf_salt = cache.lock_salt(password, params)
+        master_key = cache.master_key(password, kdf_salt, params)
+        jobs = [(file_path, (_lock_job, file_path, master_key, params, kdf_salt)) for file_path in file_paths]
+    else:
+        for file_path in file_paths:
+            if is_canceled and is_canceled():
+                yield file_path, "canceled", ""
+                continue
+            try:
+                _, header = read_file_header(file_path)
+            except (OSError, ValueError) as e:
+                yield file_path, "failed", str(e)
+                continue
+            if header is None:
+                yield file_path, "failed", "Legacy protected file, extract it on its own."
+                continue
+            _, file_params, kdf_salt, _ = header
+            jobs.append((file_path, (_unlock_job, file_path, cache.master_key(password, kdf_salt, file_params))))
+
+    if not jobs:
+        return
+    queued = deque(jobs)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        try:
+            while queued or futures:
+                if is_canceled and is_canceled():
+                    # Files not started yet are dropped, running ones still finish and are reported
+                    while queued:
+                        yield queued.popleft()[0], "canceled", ""
+                    for pending in futures:
+                        pending.cancel()
+                while queued and len(futures) < workers * 2:
+                    file_path, job = queued.popleft()
+                    futures[executor.submit(*job)] = file_path
+                done, _ = wait(futures, timeout=0.1, return_when=FIRST_COMPLETED)
+                for future in done:
+                    file_path = futures.pop(future)
+                    if future.cancelled():
+                        yield file_path, "canceled", ""
+                        continue
+                    try:
+                        result_path = future.result()
+                    except InvalidToken:
+                        yield file_path, "wrong password", "The password does not match this file."
+                    except Exception as e:
+                        yield file_path, "failed", str(e) or type(e).__name__
+                    else:
+                        yield file_path, "unlocked" if unlock else "locked", result_path
+        finally:
+            for pending in futures:
+                pending.cancel()
+
+
+def extract_file(file_path):
+    password, ok = QInputDialog.getText(None, "Password", "Enter the password:", QLineEdit.Password)
+    if not ok:
+        raise Exception("Password entry canceled.")
+
+    return unlock_file(file_path, password)
+
 
 if __name__ == "__main__":
     app = QApplication([])
@@ -0,0 +1,111 @@
+import json
+import os
+import sqlite3
+import time
+
+from HashEngine import DEFAULT_ALGORITHMS, hash_file
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "hashcache.sqlite3")
+DEFAULT_MAX_ENTRIES = 100000
+
+
+class HashCache:
+    """On-disk digest cache keyed by path and validated against (st_ino, st_size, st_mtime_ns).
+
+    Entries that have not been used for the longest time are evicted once the
+    cache holds more than max_entries rows. A single connection is used, so one
+    instance should stay on the thread that created it.
+    """
+
+    def __init__(self, cache_path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.connection = sqlite3.connect(cache_path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            " path TEXT PRIMARY KEY,"
+            " inode INTEGER NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " hashes TEXT NOT NULL,"
+            " last_used INTEGER NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS hashes_last_used ON hashes (last_used)")
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def lookup(self, file_path, stat, algorithms):
+        """Returns the cached digests for the requested algorithms, or None on a miss"""
+        path = os.path.abspath(file_path)
+        row = self.connection.execute(
+            "SELECT inode, size, mtime_ns, hashes FROM hashes WHERE path = ?", (path,)
+        ).fetchone()
+        if row is None or tuple(row[:3]) != (stat.st_ino, stat.st_size, stat.st_mtime_ns):
+            return None
+
+        hashes = json.loads(row[3])
+        if any(name not in hashes for name in algorithms):
+            return None
+
+        self.connection.execute("UPDATE hashes SET last_used = ? WHERE path = ?", (time.time_ns(), path))
+        return {name: hashes[name] for name in algorithms}
+
+    def store(self, file_path, stat, hashes):
+        """Records digests for a file, merging with any still-valid entry for other algorithms"""
+        path = os.path.abspath(file_path)
+        row = self.connection.execute(
+            "SELECT inode, size, mtime_ns, hashes FROM hashes WHERE path = ?", (path,)
+        ).fetchone()
+        merged = {}
+        if row is not None and tuple(row[:3]) == (stat.st_ino, stat.st_size, stat.st_mtime_ns):
+            merged = json.loads(row[3])
+        merged.update(hashes)
+
+        self.connection.execute(
+            "INSERT OR REPLACE INTO hashes (path, inode, size, mtime_ns, hashes, last_used)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (path, stat.st_ino, stat.st_size, stat.st_mtime_ns, json.dumps(merged), time.time_ns()),
+        )
+
+    def evict(self):
+        """Drops the least recently used entries beyond max_entries"""
+        (count,) = self.connection.execute("SELECT COUNT(*) FROM hashes").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            self.connection.execute(
+                "DELETE FROM hashes WHERE path IN (SELECT path FROM hashes ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+
+    def commit(self):
+        self.evict()
+        self.connection.commit()
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+
+def cached_hash_file(file_path, algorithms, cache, verify=False, workers=1, progress=None, is_canceled=None):
+    """hash_file with a cache in front; verify=True always rehashes and refreshes the entry.
+
+    Returns None, without touching the cache, if hashing was canceled.
+    """
+    if algorithms is None:
+        algorithms = list(DEFAULT_ALGORITHMS)
+    stat = os.stat(file_path)
+    if not verify:
+        hashes = cache.lookup(file_path, stat, algorithms)
+        if hashes is not None:
+            return hashes
+
+    hashes = hash_file(file_path, algorithms, workers=workers, progress=progress, is_canceled=is_canceled)
+    if hashes is None:
+        return None
+    cache.store(file_path, stat, hashes)
+    cache.commit()
+    return hashes
@@ -0,0 +1,414 @@
+import argparse
+import hashlib
+import itertools
+import os
+import struct
+import sys
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor, wait
+
+try:
+    import xxhash
+except ImportError:  # optional, XXH64 falls back to pure Python and XXH3 is unavailable
+    xxhash = None
+
+try:
+    import crc32c
+except ImportError:  # optional, CRC32C falls back to a pure Python table
+    crc32c = None
+
+CHUNK_SIZE = 1024 * 1024  # 1 MiB per read keeps memory flat whatever the file size
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+
+class CRC32:
+    """hashlib-style wrapper so zlib.crc32 can be fed chunk by chunk like the other digests"""
+    name = "crc32"
+    digest_size = 4
+
+    def __init__(self, data=b""):
+        self._value = zlib.crc32(data)
+
+    def update(self, data):
+        self._value = zlib.crc32(data, self._value)
+
+    def copy(self):
+        clone = CRC32()
+        clone._value = self._value
+        return clone
+
+    def digest(self):
+        return (self._value & 0xffffffff).to_bytes(4, "big")
+
+    def hexdigest(self):
+        return f"{self._value & 0xffffffff:08x}"
+
+
+def _make_crc32c_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x82F63B78 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+_CRC32C_TABLE = _make_crc32c_table()
+
+
+class CRC32C:
+    """CRC32C (Castagnoli), using the crc32c extension when installed"""
+    name = "crc32c"
+    digest_size = 4
+
+    def __init__(self, data=b""):
+        self._value = 0
+        if data:
+            self.update(data)
+
+    def update(self, data):
+        if crc32c is not None:
+            self._value = crc32c.crc32c(data, self._value)
+            return
+        crc = self._value ^ 0xffffffff
+        table = _CRC32C_TABLE
+        for byte in bytes(data):
+            crc = table[(crc ^ byte) & 0xff] ^ (crc >> 8)
+        self._value = crc ^ 0xffffffff
+
+    def copy(self):
+        clone = CRC32C()
+        clone._value = self._value
+        return clone
+
+    def digest(self):
+        return self._value.to_bytes(4, "big")
+
+    def hexdigest(self):
+        return f"{self._value:08x}"
+
+
+_MASK64 = 0xffffffffffffffff
+_PRIME64_1 = 11400714785074694791
+_PRIME64_2 = 14029467366897019727
+_PRIME64_3 = 1609587929392839161
+_PRIME64_4 = 9650029242287828579
+_PRIME64_5 = 2870177450012600261
+
+
+def _rotl64(value, bits):
+    return ((value << bits) | (value >> (64 - bits))) & _MASK64
+
+
+def _xxh64_round(acc, lane):
+    acc = (acc + lane * _PRIME64_2) & _MASK64
+    return (_rotl64(acc, 31) * _PRIME64_1) & _MASK64
+
+
+class PyXXH64:
+    """Pure Python XXH64, only used when the xxhash extension is missing"""
+    name = "xxh64"
+    digest_size = 8
+
+    def __init__(self, data=b"", seed=0):
+        self._seed = seed
+        self._acc = [
+            (seed + _PRIME64_1 + _PRIME64_2) & _MASK64,
+            (seed + _PRIME64_2) & _MASK64,
+            seed,
+            (seed - _PRIME64_1) & _MASK64,
+        ]
+        self._buffer = b""
+        self._length = 0
+        if data:
+            self.update(data)
+
+    def update(self, data):
+        data = self._buffer + bytes(data)
+        self._length += len(data) - len(self._buffer)
+        stripes = len(data) // 32 * 32
+        v1, v2, v3, v4 = self._acc
+        for l1, l2, l3, l4 in struct.iter_unpack("<4Q", data[:stripes]):
+            v1 = _xxh64_round(v1, l1)
+            v2 = _xxh64_round(v2, l2)
+            v3 = _xxh64_round(v3, l3)
+            v4 = _xxh64_round(v4, l4)
+        self._acc = [v1, v2, v3, v4]
+        self._buffer = data[stripes:]
+
+    def copy(self):
+        clone = PyXXH64(seed=self._seed)
+        clone._acc = list(self._acc)
+        clone._buffer = self._buffer
+        clone._length = self._length
+        return clone
+
+    def intdigest(self):
+        if self._length >= 32:
+            v1, v2, v3, v4 = self._acc
+            h = (_rotl64(v1, 1) + _rotl64(v2, 7) + _rotl64(v3, 12) + _rotl64(v4, 18)) & _MASK64
+            for v in self._acc:
+                h ^= _xxh64_round(0, v)
+                h = (h * _PRIME64_1 + _PRIME64_4) & _MASK64
+        else:
+            h = (self._seed + _PRIME64_5) & _MASK64
+        h = (h + self._length) & _MASK64
+
+        tail = self._buffer
+        offset = 0
+        while offset + 8 <= len(tail):
+            (lane,) = struct.unpack_from("<Q", tail, offset)
+            h ^= _xxh64_round(0, lane)
+            h = (_rotl64(h, 27) * _PRIME64_1 + _PRIME64_4) & _MASK64
+            offset += 8
+        if offset + 4 <= len(tail):
+            (lane,) = struct.unpack_from("<I", tail, offset)
+            h ^= (lane * _PRIME64_1) & _MASK64
+            h = (_rotl64(h, 23) * _PRIME64_2 + _PRIME64_3) & _MASK64
+            offset += 4
+        for byte in tail[offset:]:
+            h ^= (byte * _PRIME64_5) & _MASK64
+            h = (_rotl64(h, 11) * _PRIME64_1) & _MASK64
+
+        h ^= h >> 33
+        h = (h * _PRIME64_2) & _MASK64
+        h ^= h >> 29
+        h = (h * _PRIME64_3) & _MASK64
+        h ^= h >> 32
+        return h
+
+    def digest(self):
+        return self.intdigest().to_bytes(8, "big")
+
+    def hexdigest(self):
+        return f"{self.intdigest():016x}"
+
+
+# Supported algorithms, in the order the File Hasher form shows them
+ALGORITHMS = {
+    "md5": hashlib.md5,
+    "sha256": hashlib.sha256,
+    "blake2b": hashlib.blake2b,
+    "sha3_256": hashlib.sha3_256,
+    "sha512": hashlib.sha512,
+    "crc32": CRC32,
+    "sha1": hashlib.sha1,
+    # Non-cryptographic checksums for quick "has this changed" and dedup checks
+    "xxh64": xxhash.xxh64 if xxhash is not None else PyXXH64,
+    "crc32c": CRC32C,
+}
+if xxhash is not None:
+    ALGORITHMS["xxh3_64"] = xxhash.xxh3_64
+
+# hash_lines also offers the digests the Text Hasher form has and the File Hasher does not
+LINE_ALGORITHMS = dict(ALGORITHMS, blake2s=hashlib.blake2s)
+
+# What gets computed when no selection is given; the fast checksums are opt-in
+DEFAULT_ALGORITHMS = ["md5", "sha256", "blake2b", "sha3_256", "sha512", "crc32", "sha1"]
+
+
+def new_hashers(algorithms=None):
+    """Creates a fresh hasher for every requested algorithm name"""
+    if algorithms is None:
+        algorithms = DEFAULT_ALGORITHMS
+    hashers = {}
+    for name in algorithms:
+        if name not in ALGORITHMS:
+            raise ValueError(f"Unsupported hash algorithm: {name}")
+        hashers[name] = ALGORITHMS[name]()
+    return hashers
+
+
+def iter_chunks(file, chunk_size=CHUNK_SIZE):
+    """Yields the contents of a binary file as memoryview chunks.
+
+    A single buffer is reused for every read, so a chunk is only valid until the
+    next one is requested.
+    """
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    while True:
+        size = file.readinto(buffer)
+        if not size:
+            break
+        yield view[:size]
+
+
+def hash_stream(file, algorithms=None, chunk_size=CHUNK_SIZE, progress=None, is_canceled=None):
+    """Reads a binary stream once and feeds every chunk to all selected hashers.
+
+    progress, if given, is called with the running byte count after every
+    chunk. is_canceled is polled between chunks; when it returns True hashing
+    stops and None is returned.
+    """
+    hashers = new_hashers(algorithms)
+    updates = [hasher.update for hasher in hashers.values()]
+    bytes_done = 0
+    for chunk in iter_chunks(file, chunk_size):
+        if is_canceled and is_canceled():
+            return None
+        for update in updates:
+            update(chunk)
+        bytes_done += len(chunk)
+        if progress:
+            progress(bytes_done)
+    return {name: hasher.hexdigest() for name, hasher in hashers.items()}
+
+
+def _update_group(updates, chunk):
+    for update in updates:
+        update(chunk)
+
+
+def hash_stream_parallel(file, algorithms=None, chunk_size=CHUNK_SIZE, workers=None, progress=None,
+                         is_canceled=None):
+    """Like hash_stream, but every chunk is fanned out to a thread pool.
+
+    hashlib and zlib release the GIL on large buffers, so with one worker per
+    algorithm the wall time approaches that of the slowest digest instead of the
+    sum of all of them. Two buffers are used so the next chunk is read while the
+    current one is being hashed.
+    """
+    hashers = new_hashers(algorithms)
+    if workers is None:
+        workers = DEFAULT_WORKERS
+    workers = max(1, min(workers, len(hashers)))
+
+    # Spread the algorithms over the workers; each group is updated in order by one task
+    groups = [[] for _ in range(workers)]
+    for index, hasher in enumerate(hashers.values()):
+        groups[index % workers].append(hasher.update)
+
+    buffers = [bytearray(chunk_size), bytearray(chunk_size)]
+    views = [memoryview(buffer) for buffer in buffers]
+    pending = []
+    current = 0
+    bytes_done = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            size = file.readinto(buffers[current])
+            # The previous chunk must be fully hashed before the next one is submitted
+            wait(pending)
+            for future in pending:
+                future.result()
+            if pending and progress:
+                progress(bytes_done)
+            if not size:
+                break
+            if is_canceled and is_canceled():
+                return None
+            chunk = views[current][:size]
+            pending = [executor.submit(_update_group, group, chunk) for group in groups]
+            bytes_done += size
+            current ^= 1
+
+    return {name: hasher.hexdigest() for name, hasher in hashers.items()}
+
+
+def hash_file(file_path, algorithms=None, chunk_size=CHUNK_SIZE, workers=1, progress=None, is_canceled=None):
+    """Returns a dict of algorithm name to hex digest for the given file.
+
+    With workers greater than one the digests are computed in parallel threads.
+    See hash_stream for the progress and is_canceled callbacks.
+    """
+    with open(file_path, "rb", buffering=0) as file:
+        if workers > 1:
+            return hash_stream_parallel(file, algorithms, chunk_size, workers, progress, is_canceled)
+        return hash_stream(file, algorithms, chunk_size, progress, is_canceled)
+
+
+def hash_lines(lines, algorithm="sha256", encoding="utf-8"):
+    """Hashes every line independently and returns the hex digests in order.
+
+    str lines are encoded with encoding first, bytes lines are hashed as they
+    are. The constructor is looked up once and bound locally; with short inputs the
+    cost is dominated by creating each hash object, so this tight loop is about
+    as fast as pure Python gets.
+    """
+    if algorithm not in LINE_ALGORITHMS:
+        raise ValueError(f"Unsupported hash algorithm: {algorithm}")
+    constructor = LINE_ALGORITHMS[algorithm]
+    return [constructor(line if isinstance(line, bytes) else line.encode(encoding)).hexdigest() for line in lines]
+
+
+def iter_hash_lines(lines, algorithm="sha256", batch_size=10000, encoding="utf-8"):
+    """Yields lists of digests for successive batches of lines.
+
+    lines may be any iterable, such as an open file, so huge inputs are never
+    held in memory at once. A file opened in binary mode has its raw line
+    bytes hashed. Trailing newlines are stripped before hashing.
+    """
+    lines = iter(lines)
+    while True:
+        batch = list(itertools.islice(lines, batch_size))
+        if not batch:
+            break
+        newline = b"\r\n" if isinstance(batch[0], bytes) else "\r\n"
+        yield hash_lines([line.rstrip(newline) for line in batch], algorithm, encoding)
+
+
+def benchmark_lines(count=1000000, algorithm="sha256", repeat=3):
+    """Times hash_lines against a per-line hashlib.new loop, returns (seconds, lines/s) per path"""
+    lines = [f"identifier-{number:012d}" for number in range(count)]
+    paths = {"hash_lines": lambda: hash_lines(lines, algorithm)}
+    if algorithm in hashlib.algorithms_available:
+        paths["hashlib.new"] = lambda: [hashlib.new(algorithm, line.encode()).hexdigest() for line in lines]
+    results = {}
+    for label, run in paths.items():
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            best = min(best, time.perf_counter() - start)
+        results[label] = (best, count / best if best else 0.0)
+    return results
+
+
+def benchmark(file_path, algorithms=None, chunk_size=CHUNK_SIZE, workers=None, repeat=3):
+    """Times the sequential and parallel paths on the same file, best of `repeat` runs"""
+    if workers is None:
+        workers = DEFAULT_WORKERS
+    file_size = os.path.getsize(file_path)
+    results = {}
+    for label, count in (("sequential", 1), ("parallel", workers)):
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            hash_file(file_path, algorithms, chunk_size, count)
+            best = min(best, time.perf_counter() - start)
+        results[label] = (best, file_size / best / (1024 * 1024) if best else 0.0)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark sequential vs parallel file hashing, or batch line hashing")
+    parser.add_argument("file", nargs="?", help="file to hash")
+    parser.add_argument("--algorithms", nargs="+", choices=list(LINE_ALGORITHMS),
+                        help="digests to compute (default: the cryptographic ones and CRC32)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="worker threads for the parallel path")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="bytes per read")
+    parser.add_argument("--lines", type=int, help="benchmark hash_lines on this many generated lines instead")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per path, best time is reported")
+    args = parser.parse_args()
+
+    if args.lines:
+        algorithm = args.algorithms[0] if args.algorithms else "sha256"
+        timings = benchmark_lines(args.lines, algorithm, args.repeat)
+        for label, (seconds, throughput) in timings.items():
+            print(f"{label:>11}: {seconds:.3f} s  {throughput:,.0f} lines/s")
+        if "hashlib.new" in timings:
+            print(f"    speedup: {timings['hashlib.new'][0] / timings['hash_lines'][0]:.2f}x")
+        sys.exit(0)
+    if not args.file:
+        parser.error("a file is required unless --lines is given")
+    line_only = [name for name in args.algorithms or [] if name not in ALGORITHMS]
+    if line_only:
+        parser.error(f"{', '.join(line_only)} can only be used with --lines")
+
+    timings = benchmark(args.file, args.algorithms, args.chunk_size, args.workers, args.repeat)
+    for label, (seconds, throughput) in timings.items():
+        print(f"{label:>10}: {seconds:.3f} s  {throughput:.1f} MB/s")
+    print(f"   speedup: {timings['sequential'][0] / timings['parallel'][0]:.2f}x")
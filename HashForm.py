@@ -1,9 +1,13 @@
-import hashlib
 import sys
+from functools import partial
 
-from PySide6.QtCore import QFile
+from PySide6.QtCore import QFile, QTimer
 from PySide6.QtUiTools import QUiLoader
-from PySide6.QtWidgets import QApplication, QWidget, QMessageBox
+from PySide6.QtWidgets import QApplication, QWidget, QMessageBox, QFileDialog
+
+from HashEngine import hash_lines, iter_hash_lines
+
+BATCH_SIZE = 20000  # lines hashed and appended to the output per event loop pass
 
 
 class HashForm(QWidget):
@@ -23,13 +27,22 @@ class HashForm(QWidget):
         ui_file.close()
 
         # Button Events
-        self.ui.MD5_Encrypt.clicked.connect(self.encrypt_md5)
-        self.ui.SHA_3.clicked.connect(self.sha3_encrypt)
-        self.ui.Blake_2.clicked.connect(self.blake2_encrypt)
-        self.ui.SHA_256.clicked.connect(self.sha256_encrypt)
+        self.ui.MD5_Encrypt.clicked.connect(partial(self.hash_text, "md5"))
+        self.ui.SHA_3.clicked.connect(partial(self.hash_text, "sha3_256"))
+        self.ui.Blake_2.clicked.connect(partial(self.hash_text, "blake2s"))
+        self.ui.SHA_256.clicked.connect(partial(self.hash_text, "sha256"))
+        self.ui.Btn_LoadFile.clicked.connect(self.load_lines_file)
         self.ui.Btn_Clear.clicked.connect(self.clear_text)
         self.ui.Btn_Close.clicked.connect(self.close)
 
+        # Batch mode hashes lines in slices from a timer so the widgets stay responsive
+        self.lines_file = None
+        self.lines_source = None
+        self.batches = None
+        self.lines_done = 0
+        self.batch_timer = QTimer(self)
+        self.batch_timer.timeout.connect(self.append_batch)
+
         # Set the window properties
         self.setWindowTitle("Hash Form")
         self.setMinimumSize(800, 600)
@@ -42,43 +55,72 @@ class HashForm(QWidget):
 
     # Rest of the code...
 
-    def encrypt_md5(self):
-        text = self.ui.Encrypt_Text.toPlainText()
-        if not text:
-            self.show_error_dialog("Please enter text to encrypt.")
+    def hash_text(self, algorithm):
+        self.stop_batch()
+
+        if self.lines_file:
+            try:
+                # Raw line bytes, so a line that is not valid UTF-8 still gets its true digest
+                self.lines_source = open(self.lines_file, "rb")
+            except IOError as e:
+                self.show_error_dialog(f"Error reading the file: {str(e)}")
+                return
+            self.start_batch(self.lines_source, algorithm)
             return
-        hashed_text = hashlib.md5(text.encode()).hexdigest()
-        self.ui.Hash_Text.setPlainText(hashed_text)
 
-    def sha3_encrypt(self):
         text = self.ui.Encrypt_Text.toPlainText()
         if not text:
             self.show_error_dialog("Please enter text to encrypt.")
             return
-        hash_value = hashlib.sha3_256(text.encode()).hexdigest()
-        self.ui.Hash_Text.setPlainText(hash_value)
 
-    def blake2_encrypt(self):
-        text = self.ui.Encrypt_Text.toPlainText()
-        if not text:
-            self.show_error_dialog("Please enter text to encrypt.")
-            return
-        hash_value = hashlib.blake2s(text.encode()).hexdigest()
-        self.ui.Hash_Text.setPlainText(hash_value)
+        if self.ui.ChkBatch.isChecked():
+            self.start_batch(text.splitlines(), algorithm)
+        else:
+            self.ui.Hash_Text.setPlainText(hash_lines([text], algorithm)[0])
 
-    def sha256_encrypt(self):
-        text = self.ui.Encrypt_Text.toPlainText()
-        if not text:
-            self.show_error_dialog("Please enter text to encrypt.")
+    def start_batch(self, lines, algorithm):
+        self.ui.Hash_Text.clear()
+        self.lines_done = 0
+        self.batches = iter_hash_lines(lines, algorithm, BATCH_SIZE)
+        self.batch_timer.start(0)
+
+    def append_batch(self):
+        try:
+            digests = next(self.batches)
+        except StopIteration:
+            self.stop_batch()
+            return
+        self.ui.Hash_Text.appendPlainText("\n".join(digests))
+        self.lines_done += len(digests)
+        self.ui.Hash_Identify.setText(f"{self.lines_done:,} lines hashed")
+
+    def stop_batch(self):
+        self.batch_timer.stop()
+        self.batches = None
+        if self.lines_source is not None:
+            self.lines_source.close()
+            self.lines_source = None
+
+    def load_lines_file(self):
+        file_path, _ = QFileDialog.getOpenFileName(self, "Choose a file with one entry per line")
+        if not file_path:
             return
-        hash_value = hashlib.sha256(text.encode()).hexdigest()
-        self.ui.Hash_Text.setPlainText(hash_value)
+        # The file is streamed when hashing starts instead of being pasted into the text box
+        self.lines_file = file_path
+        self.ui.ChkBatch.setChecked(True)
+        self.ui.Encrypt_Text.setPlainText(f"Lines will be read from:\n{file_path}")
+        self.ui.Encrypt_Text.setReadOnly(True)
 
     def clear_text(self):
+        self.stop_batch()
+        self.lines_file = None
+        self.ui.Encrypt_Text.setReadOnly(False)
         self.ui.Encrypt_Text.clear()
         self.ui.Hash_Text.clear()
+        self.ui.Hash_Identify.clear()
 
     def close(self):
+        self.stop_batch()
         self.ui.close()
 
     def show_error_dialog(self, message):
@@ -106,6 +148,7 @@ class HashForm(QWidget):
         self.ui.SHA_3.setStyleSheet(button_style)
         self.ui.Blake_2.setStyleSheet(button_style)
         self.ui.SHA_256.setStyleSheet(button_style)
+        self.ui.Btn_LoadFile.setStyleSheet(button_style)
         self.ui.Btn_Clear.setStyleSheet(button_style)
         self.ui.Btn_Close.setStyleSheet(button_style)
 
@@ -0,0 +1,272 @@
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from stat import S_ISREG
+
+from HashCache import DEFAULT_CACHE_PATH, HashCache
+from HashEngine import ALGORITHMS, DEFAULT_ALGORITHMS, DEFAULT_WORKERS, hash_file
+
+MANIFEST_VERSION = 1
+
+# Line based manifest formats and the digest each one carries
+CHECKSUM_FORMATS = {
+    "sha256": "sha256",  # sha256sum
+    "b2": "blake2b",  # b2sum (BLAKE2b-512)
+    "md5": "md5",  # md5sum
+    "sha1": "sha1",  # sha1sum
+    "sha512": "sha512",  # sha512sum
+}
+
+
+def walk_tree(root):
+    """Lists every regular file under root as (relative path, stat result), largest first"""
+    entries = []
+    for dir_path, _, files in os.walk(root):
+        for file in files:
+            file_path = os.path.join(dir_path, file)
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            if not S_ISREG(stat.st_mode):
+                # Reading a FIFO or a device would block or never end
+                continue
+            relative_path = os.path.relpath(file_path, root).replace(os.sep, "/")
+            entries.append((relative_path, stat))
+
+    # Big files go first so a single large file does not hold up the end of the run
+    entries.sort(key=lambda entry: entry[1].st_size, reverse=True)
+    return entries
+
+
+def _hash_entry(file_path, algorithms):
+    return hash_file(file_path, algorithms)
+
+
+def _hash_entries(root, entries, algorithms, workers):
+    # Yields (relative path, stat, hashes) as the process pool finishes each file
+    if not entries:
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for relative_path, stat in entries:
+            file_path = os.path.join(root, relative_path)
+            futures[executor.submit(_hash_entry, file_path, algorithms)] = (relative_path, stat)
+
+        try:
+            for future in as_completed(futures):
+                relative_path, stat = futures[future]
+                yield relative_path, stat, future.result()
+        finally:
+            # When the caller stops early, files not yet started are dropped instead of hashed
+            for future in futures:
+                future.cancel()
+
+
+def hash_tree(root, algorithms=None, workers=None, progress=None, cache=None, verify=False, is_canceled=None):
+    """Hashes every file under root in a process pool.
+
+    Returns a dict of relative path to {"size", "mtime_ns", "hashes"}. The
+    optional progress callback receives (files done, total files). When a
+    HashCache is given, unchanged files are answered from it with only a stat
+    call; verify=True bypasses the lookups but still refreshes the cache.
+    is_canceled is polled as files finish; when it returns True hashing
+    stops and None is returned.
+    """
+    if algorithms is None:
+        algorithms = list(DEFAULT_ALGORITHMS)
+    if workers is None:
+        workers = DEFAULT_WORKERS
+
+    entries = walk_tree(root)
+    results = {}
+    pending = []
+    for relative_path, stat in entries:
+        hashes = None
+        if cache is not None and not verify:
+            hashes = cache.lookup(os.path.join(root, relative_path), stat, algorithms)
+        if hashes is None:
+            pending.append((relative_path, stat))
+        else:
+            results[relative_path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hashes": hashes}
+
+    done = len(results)
+    if progress and done:
+        progress(done, len(entries))
+
+    hashed = _hash_entries(root, pending, algorithms, workers)
+    for relative_path, stat, hashes in hashed:
+        if is_canceled and is_canceled():
+            hashed.close()
+            break
+        results[relative_path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hashes": hashes}
+        if cache is not None:
+            cache.store(os.path.join(root, relative_path), stat, hashes)
+        done += 1
+        if progress:
+            progress(done, len(entries))
+
+    if cache is not None:
+        # Digests finished before a cancel are still worth keeping
+        cache.commit()
+    if is_canceled and is_canceled():
+        return None
+    return results
+
+
+def _escape_name(name):
+    # Same escaping coreutils uses for names containing a backslash or newline
+    if "\\" in name or "\n" in name:
+        return True, name.replace("\\", "\\\\").replace("\n", "\\n")
+    return False, name
+
+
+def write_checksum_manifest(results, manifest_path, checksum_format="sha256"):
+    """Writes a manifest that `sha256sum -c` (or b2sum, md5sum...) can check"""
+    algorithm = CHECKSUM_FORMATS[checksum_format]
+    with open(manifest_path, "w", encoding="utf-8", newline="\n") as manifest:
+        for relative_path in sorted(results):
+            escaped, name = _escape_name(relative_path)
+            prefix = "\\" if escaped else ""
+            manifest.write(f"{prefix}{results[relative_path]['hashes'][algorithm]}  {name}\n")
+
+
+def write_json_manifest(results, manifest_path, root, algorithms=None):
+    """Writes a JSON manifest with every computed digest plus size and mtime per file"""
+    if algorithms is None:
+        algorithms = list(DEFAULT_ALGORITHMS)
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "root": os.path.abspath(root),
+        "algorithms": list(algorithms),
+        "files": {relative_path: results[relative_path] for relative_path in sorted(results)},
+    }
+    with open(manifest_path, "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+
+
+def write_manifest(results, manifest_path, root, algorithms=None):
+    """Picks the manifest format from the file extension (.json or one of CHECKSUM_FORMATS)"""
+    extension = os.path.splitext(manifest_path)[1].lstrip(".").lower()
+    if extension == "json":
+        write_json_manifest(results, manifest_path, root, algorithms)
+    elif extension in CHECKSUM_FORMATS:
+        write_checksum_manifest(results, manifest_path, extension)
+    else:
+        raise ValueError(f"Unknown manifest format: .{extension}")
+
+
+def load_manifest(manifest_path):
+    """Reads a JSON manifest written by write_json_manifest"""
+    with open(manifest_path, "r", encoding="utf-8") as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"Unsupported manifest version: {manifest.get('version')}")
+    return manifest
+
+
+def verify_manifest(manifest_path, root=None, strict=False, workers=None):
+    """Compares a directory against a JSON manifest.
+
+    Only files whose size or mtime changed are rehashed (every file with
+    strict=True), and a file whose size changed is reported as modified
+    without reading it. The manifest itself is left out when it lies under
+    root. Returns a dict of "added", "removed", "modified" and
+    "unchanged" lists of relative paths.
+    """
+    manifest = load_manifest(manifest_path)
+    if root is None:
+        root = manifest["root"]
+    if workers is None:
+        workers = DEFAULT_WORKERS
+    recorded = manifest["files"]
+    algorithms = manifest["algorithms"]
+
+    report = {"added": [], "removed": [], "modified": [], "unchanged": []}
+    current = dict(walk_tree(root))
+    # A manifest saved inside the tree it covers is not one of its files
+    try:
+        manifest_relative = os.path.relpath(os.path.realpath(manifest_path), os.path.realpath(root))
+        current.pop(manifest_relative.replace(os.sep, "/"), None)
+    except ValueError:
+        pass  # on another drive than root
+    report["added"] = sorted(set(current) - set(recorded))
+    report["removed"] = sorted(set(recorded) - set(current))
+
+    suspects = []
+    for relative_path in sorted(set(current) & set(recorded)):
+        stat = current[relative_path]
+        entry = recorded[relative_path]
+        if stat.st_size != entry["size"]:
+            report["modified"].append(relative_path)
+        elif strict or stat.st_mtime_ns != entry["mtime_ns"]:
+            suspects.append((relative_path, stat))
+        else:
+            report["unchanged"].append(relative_path)
+
+    suspects.sort(key=lambda entry: entry[1].st_size, reverse=True)
+    for relative_path, _, hashes in _hash_entries(root, suspects, algorithms, workers):
+        if hashes == recorded[relative_path]["hashes"]:
+            report["unchanged"].append(relative_path)
+        else:
+            report["modified"].append(relative_path)
+
+    report["modified"].sort()
+    report["unchanged"].sort()
+    return report
+
+
+def _create_command(args):
+    algorithms = args.algorithms or list(DEFAULT_ALGORITHMS)
+    for output in args.output:
+        extension = os.path.splitext(output)[1].lstrip(".").lower()
+        if extension in CHECKSUM_FORMATS and CHECKSUM_FORMATS[extension] not in algorithms:
+            algorithms.append(CHECKSUM_FORMATS[extension])
+
+    if args.no_cache:
+        tree = hash_tree(args.root, algorithms, workers=args.workers)
+    else:
+        with HashCache(args.cache) as hash_cache:
+            tree = hash_tree(args.root, algorithms, workers=args.workers, cache=hash_cache, verify=args.verify)
+    for output in args.output:
+        write_manifest(tree, output, args.root, algorithms)
+    print(f"Hashed {len(tree)} files")
+    return 0
+
+
+def _verify_command(args):
+    report = verify_manifest(args.manifest, args.root, args.strict, args.workers)
+    for status in ("added", "removed", "modified"):
+        for relative_path in report[status]:
+            print(f"{status.upper():>8}  {relative_path}")
+    print(", ".join(f"{len(report[status])} {status}" for status in report))
+    return 1 if report["added"] or report["removed"] or report["modified"] else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hash a directory tree into a manifest, or verify one")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    create_parser = subparsers.add_parser("create", help="hash a directory and write manifests")
+    create_parser.add_argument("root", help="directory to hash")
+    create_parser.add_argument("--output", required=True, action="append",
+                               help="manifest path; .json, .sha256, .b2, .md5, .sha1 or .sha512 (repeatable)")
+    create_parser.add_argument("--algorithms", nargs="+", choices=list(ALGORITHMS),
+                               help="digests to compute (default: the cryptographic ones and CRC32)")
+    create_parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="hashing processes")
+    create_parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="hash cache database")
+    create_parser.add_argument("--no-cache", action="store_true", help="do not read or update the hash cache")
+    create_parser.add_argument("--verify", action="store_true", help="rehash every file, ignoring cached digests")
+    create_parser.set_defaults(handler=_create_command)
+
+    verify_parser = subparsers.add_parser("verify", help="report files changed since a JSON manifest was written")
+    verify_parser.add_argument("manifest", help="JSON manifest to check against")
+    verify_parser.add_argument("--root", help="directory to check (default: the root recorded in the manifest)")
+    verify_parser.add_argument("--strict", action="store_true", help="rehash every file, not only those with a new mtime")
+    verify_parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="hashing processes")
+    verify_parser.set_defaults(handler=_verify_command)
+
+    args = parser.parse_args()
+    sys.exit(args.handler(args))
@@ -0,0 +1,213 @@
+"""Local store of encryption keys, looked up by the key id a container header records.
+
+Every key is wrapped under one master key. That master key is kept in the OS
+keyring (Windows Credential Manager, macOS Keychain, Secret Service) when the
+optional keyring package has a usable backend, so a copy of keystore.sqlite3
+alone reveals no keys. Without a keyring it falls back to keystore.key next
+to the database, readable only by its owner; then the store protects against
+other users on the machine, not against anyone who can read the owner's
+files or copy both files.
+"""
+import argparse
+import base64
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import keyring
+    from keyring.errors import KeyringError
+except ImportError:  # optional, the master key then lives in a key file
+    keyring = None
+
+import CryptoStream
+
+APP_FOLDER = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_STORE_PATH = os.path.join(APP_FOLDER, "keystore.sqlite3")
+DEFAULT_MASTER_KEY_PATH = os.path.join(APP_FOLDER, "keystore.key")
+DEFAULT_CACHE_SIZE = 256
+KEY_ID_SIZE = 16
+KEYRING_SERVICE = "SecureScript key store"
+
+
+class KeyNotFound(KeyError):
+    """Raised when a key id is not in the store"""
+
+
+def _keyring_get(master_key_path):
+    # Each key file path has its own keyring entry, so separate stores keep separate keys
+    if keyring is None:
+        return None
+    try:
+        return keyring.get_password(KEYRING_SERVICE, os.path.abspath(master_key_path))
+    except KeyringError:
+        return None
+
+
+def _keyring_set(master_key_path, key_text):
+    if keyring is None:
+        return False
+    try:
+        keyring.set_password(KEYRING_SERVICE, os.path.abspath(master_key_path), key_text)
+    except KeyringError:
+        return False
+    return _keyring_get(master_key_path) == key_text
+
+
+def load_master_key(master_key_path=DEFAULT_MASTER_KEY_PATH):
+    """Reads the key that wraps every stored key, creating it on first use.
+
+    A key file that already exists is used as it is, so older stores stay
+    readable; move_master_key_to_keyring moves it. A new key goes to the OS
+    keyring when there is one, and to master_key_path otherwise.
+    """
+    if not os.path.exists(master_key_path):
+        key_text = _keyring_get(master_key_path)
+        if key_text is not None:
+            return CryptoStream.key_from_text(key_text)
+        key_text = base64.urlsafe_b64encode(os.urandom(CryptoStream.KEY_SIZE)).decode()
+        if _keyring_set(master_key_path, key_text):
+            return CryptoStream.key_from_text(key_text)
+        # Owner-only permissions; the store is useless without this file
+        fd = os.open(master_key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with open(fd, "wb") as master_file:
+            master_file.write(key_text.encode())
+    with open(master_key_path, "rb") as master_file:
+        return CryptoStream.key_from_text(master_file.read().strip())
+
+
+def move_master_key_to_keyring(master_key_path=DEFAULT_MASTER_KEY_PATH):
+    """Moves an existing master key file into the OS keyring and deletes the file"""
+    with open(master_key_path, "rb") as master_file:
+        key_text = master_file.read().strip().decode()
+    CryptoStream.key_from_text(key_text)
+    if not _keyring_set(master_key_path, key_text):
+        raise RuntimeError("No usable OS keyring; install the keyring package or keep the key file.")
+    os.remove(master_key_path)
+
+
+class KeyStore:
+    """Local index from key id to key, with every key AES-GCM wrapped under the master key.
+
+    Unwrapped keys are kept in an LRU cache of cache_size entries, so
+    decrypting thousands of files under a handful of keys touches the
+    database once per key. The connection is shared between threads behind a
+    lock.
+    """
+
+    def __init__(self, store_path=DEFAULT_STORE_PATH, master_key_path=DEFAULT_MASTER_KEY_PATH,
+                 cache_size=DEFAULT_CACHE_SIZE):
+        self.master_key = load_master_key(master_key_path)
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(store_path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS keys ("
+            " key_id TEXT PRIMARY KEY,"
+            " wrapped BLOB NOT NULL,"
+            " label TEXT NOT NULL,"
+            " created INTEGER NOT NULL)"
+        )
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add_key(self, key, label=""):
+        """Stores a key and returns its new hex key id"""
+        key_id = os.urandom(KEY_ID_SIZE).hex()
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO keys (key_id, wrapped, label, created) VALUES (?, ?, ?, ?)",
+                (key_id, CryptoStream.wrap_key(self.master_key, key), label, int(time.time())),
+            )
+            self.connection.commit()
+            self._remember(key_id, key)
+        return key_id
+
+    def new_key(self, label=""):
+        """Generates and stores a random key; returns (key id, key)"""
+        key = os.urandom(CryptoStream.KEY_SIZE)
+        return self.add_key(key, label), key
+
+    def get_key(self, key_id):
+        """Returns the unwrapped key for key_id, raising KeyNotFound if it is not stored"""
+        with self.lock:
+            if key_id in self.cache:
+                self.cache.move_to_end(key_id)
+                return self.cache[key_id]
+            row = self.connection.execute("SELECT wrapped FROM keys WHERE key_id = ?", (key_id,)).fetchone()
+            if row is None:
+                raise KeyNotFound(key_id)
+            key = CryptoStream.unwrap_key(self.master_key, row[0])
+            self._remember(key_id, key)
+            return key
+
+    def _remember(self, key_id, key):
+        self.cache[key_id] = key
+        self.cache.move_to_end(key_id)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def list_keys(self):
+        """Returns (key id, label, created) rows, newest first"""
+        with self.lock:
+            return self.connection.execute("SELECT key_id, label, created FROM keys ORDER BY created DESC").fetchall()
+
+    def close(self):
+        with self.lock:
+            self.cache.clear()
+            self.connection.close()
+
+
+def key_id_extension(key_id):
+    """Header extensions that record which stored key a container was encrypted under"""
+    return {CryptoStream.EXT_KEY_ID: bytes.fromhex(key_id)}
+
+
+def read_key_id(file_path):
+    """The hex key id recorded in a container header, or None if it has none"""
+    with open(file_path, "rb") as file:
+        header = CryptoStream.read_header(file)
+    key_id = header.extensions.get(CryptoStream.EXT_KEY_ID)
+    return key_id.hex() if key_id is not None else None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the local encryption key store")
+    parser.add_argument("--store", default=DEFAULT_STORE_PATH, help="key store database")
+    parser.add_argument("--master-key", default=DEFAULT_MASTER_KEY_PATH,
+                        help="file holding the wrapping key, or naming its keyring entry")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="list stored key ids")
+    subparsers.add_parser("move-to-keyring", help="move the wrapping key file into the OS keyring")
+    import_parser = subparsers.add_parser("import", help="store a base64 key, such as an old key.key file")
+    import_parser.add_argument("key_file")
+    import_parser.add_argument("--label", default="", help="note stored with the key")
+    export_parser = subparsers.add_parser("export", help="print a stored key as base64")
+    export_parser.add_argument("key_id")
+    lookup_parser = subparsers.add_parser("lookup", help="print the key id recorded in an encrypted file")
+    lookup_parser.add_argument("file")
+    args = parser.parse_args()
+
+    if args.command == "move-to-keyring":
+        move_master_key_to_keyring(args.master_key)
+        print(f"Moved {args.master_key} into the OS keyring")
+        raise SystemExit(0)
+    with KeyStore(args.store, args.master_key) as store:
+        if args.command == "list":
+            for row_key_id, row_label, row_created in store.list_keys():
+                print(f"{row_key_id}  {time.strftime('%Y-%m-%d %H:%M', time.localtime(row_created))}  {row_label}")
+        elif args.command == "import":
+            with open(args.key_file, "rb") as imported:
+                print(store.add_key(CryptoStream.key_from_text(imported.read().strip()), args.label))
+        elif args.command == "export":
+            print(base64.urlsafe_b64encode(store.get_key(args.key_id)).decode())
+        else:
+            print(read_key_id(args.file) or "No key id recorded in this file")
@@ -13,6 +13,19 @@ a = Analysis(
         ('FileEncrypt.py', '.'),
         ('FileCompress.py', '.'),
         ('FileShredder.py', '.'),
+        ('HashEngine.py', '.'),
+        ('HashManifest.py', '.'),
+        ('HashCache.py', '.'),
+        ('TreeHash.py', '.'),
+        ('DuplicateFinder.py', '.'),
+        ('CryptoStream.py', '.'),
+        ('BatchEncrypt.py', '.'),
+        ('PasswordKey.py', '.'),
+        ('KeyStore.py', '.'),
+        ('CompressPipeline.py', '.'),
+        ('ParallelCompress.py', '.'),
+        ('ParallelZip.py', '.'),
+        ('ArchiveExtract.py', '.'),
     ],
     hiddenimports=[],
     hookspath=[],
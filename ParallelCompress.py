@@ -0,0 +1,572 @@
+import argparse
+import bz2
+import contextlib
+import lzma
+import mmap
+import os
+import re
+import shutil
+import tarfile
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import py7zr
+import pyzstd
+
+DEFAULT_THREADS = os.cpu_count() or 1
+COPY_SIZE = 1024 * 1024
+
+# Format name: (lowest level, highest level, default level)
+LEVELS = {"zst": (1, 22, 3), "xz": (0, 9, 6), "bz2": (1, 9, 9), "zip": (0, 9, 6)}
+FORMATS = ("zst", "xz", "bz2", "tar.zst", "tar.xz")
+
+# LZMA dictionary size of each xz preset; xz itself uses blocks of three dictionaries when multi-threaded
+XZ_DICT_SIZES = [1 << 18, 1 << 20, 1 << 21, 1 << 22, 1 << 22, 1 << 23, 1 << 23, 1 << 24, 1 << 25, 1 << 26]
+# Memory one liblzma encoder uses at each preset, from the xz manual
+XZ_ENCODER_MEMORY = [m * 1024 * 1024 for m in (3, 9, 17, 32, 48, 94, 94, 186, 370, 674)]
+# Like xz -T, the thread count is lowered so encoders and buffered blocks stay within this
+XZ_MEMORY_LIMIT = 2 * 1024 ** 3
+
+
+class CompressCanceled(Exception):
+    """Raised inside a running compression when it is canceled"""
+
+
+def check_canceled(is_canceled):
+    if is_canceled and is_canceled():
+        raise CompressCanceled()
+
+
+def codec_of(compression_type):
+    """The codec of a format name: tar.zst uses zst and tar.xz uses xz"""
+    return compression_type.rsplit(".", 1)[-1]
+
+
+# Sampling: the first SAMPLE_SIZE bytes decide whether a file is worth compressing
+SAMPLE_SIZE = 64 * 1024
+MIN_SAMPLE = 4096  # smaller files are compressed anyway, there is little to save
+INCOMPRESSIBLE_RATIO = 0.97  # a sample that fast zlib cannot shrink by 3% is stored
+STORE_SHARE = 0.9  # 7z stores the whole archive when this share of its bytes is incompressible
+STORE_ZSTD_LEVEL = pyzstd.compressionLevel_values.min  # close to a plain copy
+
+# Leading bytes of formats that are compressed or encrypted already
+COMPRESSED_MAGIC = (
+    b"\xff\xd8\xff",  # JPEG
+    b"\x89PNG\r\n\x1a\n",
+    b"GIF8",
+    b"PK\x03\x04",  # zip, and docx, jar, apk...
+    b"\x1f\x8b",  # gzip
+    b"BZh",
+    b"\xfd7zXZ\x00",
+    b"\x28\xb5\x2f\xfd",  # zstd
+    b"7z\xbc\xaf\x27\x1c",
+    b"Rar!\x1a\x07",
+    b"OggS",
+    b"fLaC",
+    b"ID3",  # MP3
+    b"SSCS",  # FileEncrypt containers
+    b"SSLK",  # FileLock files
+)
+
+# Start of a bz2 stream: "BZh", the level, then the magic of a first block or of an empty stream's end
+BZ2_STREAM_START = re.compile(rb"BZh[1-9](?:\x31\x41\x59\x26\x53\x59|\x17\x72\x45\x38\x50\x90)")
+# Streams are decompressed whole in memory, so only files of block-sized streams, as pbzip2
+# and ParallelBz2Writer write them, take the parallel path
+BZ2_MAX_STREAM = 1024 * 1024  # compressed bytes of one stream
+BZ2_MAX_OUTPUT = 1024 * 1024  # decompressed bytes of one stream
+
+
+def xz_block_size(level):
+    return 3 * XZ_DICT_SIZES[level]
+
+
+def xz_threads(level, threads, block_size=None, memory_limit=XZ_MEMORY_LIMIT):
+    """threads, lowered until every thread's encoder and its two in-flight blocks fit in memory_limit"""
+    per_thread = XZ_ENCODER_MEMORY[level] + 2 * (block_size or xz_block_size(level))
+    return max(1, min(threads, memory_limit // per_thread))
+
+
+class ParallelBlockWriter:
+    """Write-only file object that compresses fixed-size blocks on a thread pool.
+
+    Each block_size block becomes a separate compressed stream and the
+    streams are written in order. xz and bzip2 both read concatenated
+    streams back as one file. liblzma and libbz2 release the GIL, so the
+    blocks compress in parallel. At most 2 * threads blocks are in flight,
+    which bounds memory.
+    """
+
+    def __init__(self, fileobj, threads, block_size):
+        self.fileobj = fileobj
+        self.threads = max(1, threads)
+        self.block_size = block_size
+        self.buffer = bytearray()
+        self.pending = deque()
+        self.blocks = 0
+        self.executor = ThreadPoolExecutor(max_workers=self.threads)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def compress_block(self, block):
+        raise NotImplementedError
+
+    def _submit(self, block):
+        self.pending.append(self.executor.submit(self.compress_block, block))
+        self.blocks += 1
+        while len(self.pending) >= self.threads * 2:
+            self.fileobj.write(self.pending.popleft().result())
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            self._submit(bytes(self.buffer[:self.block_size]))
+            del self.buffer[:self.block_size]
+        return len(data)
+
+    def close(self):
+        if self.executor is None:
+            return
+        try:
+            # An empty input still needs one (empty) stream to be a valid file
+            if self.buffer or not self.blocks:
+                self._submit(bytes(self.buffer))
+                self.buffer.clear()
+            while self.pending:
+                self.fileobj.write(self.pending.popleft().result())
+        finally:
+            self.abort()
+
+    def abort(self):
+        if self.executor is None:
+            return
+        for future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.executor.shutdown()
+        self.executor = None
+
+
+class ParallelXzWriter(ParallelBlockWriter):
+    """.xz output with one stream per block of three dictionary sizes, as xz -T splits its input.
+
+    High presets need hundreds of MiB per encoder, so fewer threads than
+    asked for are used when they would not fit in memory_limit.
+    """
+
+    def __init__(self, fileobj, level=LEVELS["xz"][2], threads=DEFAULT_THREADS, block_size=None,
+                 memory_limit=XZ_MEMORY_LIMIT):
+        block_size = block_size or xz_block_size(level)
+        super().__init__(fileobj, xz_threads(level, threads, block_size, memory_limit), block_size)
+        self.level = level
+
+    def compress_block(self, block):
+        return lzma.compress(block, format=lzma.FORMAT_XZ, preset=self.level)
+
+
+class ParallelBz2Writer(ParallelBlockWriter):
+    """.bz2 output with one stream per level * 100 kB block, as pbzip2 writes it"""
+
+    def __init__(self, fileobj, level=LEVELS["bz2"][2], threads=DEFAULT_THREADS):
+        super().__init__(fileobj, threads, level * 100_000)
+        self.level = level
+
+    def compress_block(self, block):
+        return bz2.compress(block, self.level)
+
+
+class _NotOneStream(Exception):
+    """A split bz2 segment was not exactly one complete stream"""
+
+
+def _decompress_bz2_stream(data):
+    decompressor = bz2.BZ2Decompressor()
+    output = decompressor.decompress(data, BZ2_MAX_OUTPUT)
+    if not decompressor.eof or decompressor.unused_data:
+        raise _NotOneStream()
+    return output
+
+
+def decompress_bz2(input_path, dst, threads=DEFAULT_THREADS):
+    """Decompresses a .bz2 file into dst, a seekable file, with its streams in parallel.
+
+    Multi-stream files, such as those from ParallelBz2Writer or pbzip2, are
+    split at stream headers and each stream is decompressed on the thread
+    pool. Compressed data can look like a header by chance; such a split
+    fails to decompress as exactly one stream. The file is then decompressed
+    sequentially, which is also the path for single-stream files, for
+    streams larger than BZ2_MAX_STREAM or BZ2_MAX_OUTPUT, and the one that
+    reports corrupt data.
+    """
+    if threads > 1 and os.path.getsize(input_path):
+        with open(input_path, "rb") as src, mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            starts = [match.start() for match in BZ2_STREAM_START.finditer(mapped)]
+            segments = list(zip(starts, starts[1:] + [len(mapped)]))
+            small = all(end - start <= BZ2_MAX_STREAM for start, end in segments)
+            if len(starts) > 1 and starts[0] == 0 and small:
+                try:
+                    _decompress_bz2_streams(mapped, segments, dst, threads)
+                    return
+                except (_NotOneStream, OSError):
+                    # The sequential pass either succeeds or raises the real error
+                    dst.seek(0)
+                    dst.truncate()
+
+    with bz2.open(input_path, "rb") as reader:
+        shutil.copyfileobj(reader, dst, COPY_SIZE)
+
+
+def _decompress_bz2_streams(mapped, segments, dst, threads):
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        pending = deque()
+        try:
+            for start, end in segments:
+                pending.append(executor.submit(_decompress_bz2_stream, mapped[start:end]))
+                if len(pending) >= threads * 2:
+                    dst.write(pending.popleft().result())
+            while pending:
+                dst.write(pending.popleft().result())
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def looks_incompressible(file_path):
+    """Guesses from a file's first SAMPLE_SIZE bytes whether compressing it is wasted work.
+
+    Known compressed, media and encrypted formats are recognised by their
+    magic bytes. Anything else is trial-compressed with fast zlib and counts
+    as incompressible when that saves less than 3%.
+    """
+    with open(file_path, "rb") as file:
+        sample = file.read(SAMPLE_SIZE)
+    if sample.startswith(COMPRESSED_MAGIC):
+        return True
+    # MP4/MOV/HEIC keep their signature after a box size, WebP after a RIFF header
+    if sample[4:8] == b"ftyp" or (sample[:4] == b"RIFF" and sample[8:12] == b"WEBP"):
+        return True
+    if len(sample) < MIN_SAMPLE:
+        return False
+    return len(zlib.compress(sample, 1)) >= len(sample) * INCOMPRESSIBLE_RATIO
+
+
+class LevelSwitchingZstdWriter:
+    """zstd writer whose level can change as it goes; each change starts a new frame.
+
+    Concatenated frames decompress as one stream, so a tar can be written
+    with already-compressed members passed through at STORE_ZSTD_LEVEL.
+    """
+
+    def __init__(self, fileobj, level=LEVELS["zst"][2], threads=DEFAULT_THREADS):
+        self.fileobj = fileobj
+        self.threads = threads
+        self.level = level
+        self.compressor = pyzstd.ZstdCompressor(zstd_options(level, threads))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def set_level(self, level):
+        if level == self.level:
+            return
+        self.fileobj.write(self.compressor.flush())
+        self.level = level
+        self.compressor = pyzstd.ZstdCompressor(zstd_options(level, self.threads))
+
+    def write(self, data):
+        self.fileobj.write(self.compressor.compress(data))
+        return len(data)
+
+    def close(self):
+        if self.compressor is not None:
+            self.fileobj.write(self.compressor.flush())
+            self.compressor = None
+
+
+def zstd_options(level, threads):
+    # nbWorkers 0 is zstd's single-threaded mode; any other count compresses on that many threads
+    return {pyzstd.CParameter.compressionLevel: level,
+            pyzstd.CParameter.nbWorkers: threads if threads > 1 else 0}
+
+
+def open_writer(fileobj, codec, level=None, threads=DEFAULT_THREADS):
+    """A write-only compressing file object around fileobj; closing it does not close fileobj"""
+    if level is None:
+        level = LEVELS[codec][2]
+    if codec == "zst":
+        return pyzstd.ZstdFile(fileobj, "w", level_or_option=zstd_options(level, threads))
+    if codec == "xz":
+        if threads <= 1:
+            # One stream compresses slightly better and matches what xz -T1 writes
+            return lzma.LZMAFile(fileobj, "w", format=lzma.FORMAT_XZ, preset=level)
+        return ParallelXzWriter(fileobj, level, threads)
+    if codec == "bz2":
+        if threads <= 1:
+            return bz2.BZ2File(fileobj, "w", compresslevel=level)
+        return ParallelBz2Writer(fileobj, level, threads)
+    raise ValueError(f"Unknown compression type: {codec}")
+
+
+def open_reader(fileobj, codec):
+    """A read-only decompressing file object around fileobj; both formats may hold several streams"""
+    if codec == "zst":
+        return pyzstd.ZstdFile(fileobj, "r")
+    if codec == "xz":
+        return lzma.LZMAFile(fileobj, "r")
+    if codec == "bz2":
+        return bz2.BZ2File(fileobj, "r")
+    raise ValueError(f"Unknown compression type: {codec}")
+
+
+def compress_file(input_path, output_path, codec, level=None, threads=DEFAULT_THREADS, progress=None,
+                  is_canceled=None):
+    """Compresses one file; progress(name, bytes done, size) is called after each COPY_SIZE block"""
+    name = os.path.basename(input_path)
+    size = os.path.getsize(input_path)
+    bytes_done = 0
+    with open(input_path, "rb") as src, open(output_path, "wb") as dst:
+        with open_writer(dst, codec, level, threads) as writer:
+            while True:
+                check_canceled(is_canceled)
+                block = src.read(COPY_SIZE)
+                if not block:
+                    break
+                writer.write(block)
+                bytes_done += len(block)
+                if progress:
+                    progress(name, bytes_done, size)
+
+
+def decompress_file(input_path, output_path, codec, threads=DEFAULT_THREADS):
+    if codec == "bz2":
+        with open(output_path, "wb") as dst:
+            decompress_bz2(input_path, dst, threads)
+        return
+    with open(input_path, "rb") as src, open(output_path, "wb") as dst:
+        with open_reader(src, codec) as reader:
+            shutil.copyfileobj(reader, dst, COPY_SIZE)
+
+
+class _ProgressWriter:
+    # Sits between tarfile and the compressor, counting tar bytes and checking for a cancel on each write
+    def __init__(self, fileobj, total, progress, is_canceled):
+        self.fileobj = fileobj
+        self.total = total
+        self.progress = progress
+        self.is_canceled = is_canceled
+        self.name = ""
+        self.bytes_done = 0
+
+    def write(self, data):
+        check_canceled(self.is_canceled)
+        self.fileobj.write(data)
+        self.bytes_done += len(data)
+        if self.progress:
+            # Headers and padding count too, so the total is only an estimate
+            self.progress(self.name, min(self.bytes_done, self.total), self.total)
+        return len(data)
+
+
+def compress_tar(folder_path, output_path, codec, level=None, threads=DEFAULT_THREADS, store_incompressible=False,
+                 progress=None, is_canceled=None):
+    """Writes folder_path as a .tar.zst or .tar.xz archive, or a plain .tar when codec is None.
+
+    With store_incompressible, .tar.zst members that looks_incompressible
+    picks out are written at STORE_ZSTD_LEVEL instead of level.
+    progress(member, bytes done, total bytes) is called as the tar is written.
+    """
+    folder_path = os.path.normpath(folder_path)
+    if level is None and codec is not None:
+        level = LEVELS[codec][2]
+    total = sum(os.lstat(file_path).st_size for file_path in _tree_files(folder_path)) if progress else 0
+    level_switching = codec == "zst" and store_incompressible
+    with open(output_path, "wb") as dst:
+        if codec is None:
+            writer = contextlib.nullcontext(dst)
+        elif level_switching:
+            writer = LevelSwitchingZstdWriter(dst, level, threads)
+        else:
+            writer = open_writer(dst, codec, level, threads)
+        with writer as compressed:
+            counter = _ProgressWriter(compressed, total, progress, is_canceled)
+
+            def member_filter(tarinfo):
+                # Called before each member is added. tarfile buffers a few kB, so the
+                # switch lands slightly before the member's data, which costs nothing.
+                counter.name = tarinfo.name
+                if level_switching and tarinfo.isfile():
+                    member_path = os.path.join(os.path.dirname(folder_path), tarinfo.name)
+                    compressed.set_level(STORE_ZSTD_LEVEL if looks_incompressible(member_path) else level)
+                return tarinfo
+
+            # Stream mode, so tarfile only ever calls write() on the compressor
+            with tarfile.open(fileobj=counter, mode="w|") as tar:
+                tar.add(folder_path, arcname=os.path.basename(folder_path), filter=member_filter)
+
+
+def _tree_files(path):
+    if not os.path.isdir(path):
+        return [path]
+    return [os.path.join(root, file) for root, _, files in os.walk(path) for file in files]
+
+
+def compress_7z(path, output_path, store_incompressible=False, progress=None, is_canceled=None):
+    """Writes path as a .7z archive, one file at a time so progress and a cancel are seen between files.
+
+    py7zr applies one filter chain to a whole archive, so with
+    store_incompressible the archive is written with the COPY filter when
+    at least STORE_SHARE of its bytes look incompressible, and with LZMA2
+    otherwise; in a mixed tree the incompressible files are still
+    recompressed. Storing them as a second folder would need py7zr's append
+    mode, which writes archives that fail their CRC checks.
+    """
+    path = os.path.normpath(path)
+    sizes = {file_path: os.lstat(file_path).st_size for file_path in _tree_files(path)}
+    total = sum(sizes.values())
+    filters = None
+    if store_incompressible:
+        stored = sum(size for file_path, size in sizes.items() if looks_incompressible(file_path))
+        if total and stored >= total * STORE_SHARE:
+            filters = [{"id": py7zr.FILTER_COPY}]
+    bytes_done = 0
+    with py7zr.SevenZipFile(output_path, "w", filters=filters) as archive:
+        # What writeall does, with directories first so empty ones are kept
+        base = os.path.dirname(path)
+        if os.path.isdir(path):
+            for root, _, _ in os.walk(path):
+                archive.write(root, os.path.relpath(root, base))
+        for file_path, size in sizes.items():
+            check_canceled(is_canceled)
+            arcname = os.path.relpath(file_path, base)
+            archive.write(file_path, arcname)
+            bytes_done += size
+            if progress:
+                progress(arcname, bytes_done, total)
+
+
+class _CountingSink:
+    # Discards output, keeping its size, so the benchmark measures compression rather than disk speed
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return len(data)
+
+
+def benchmark(input_path, thread_counts=(1, DEFAULT_THREADS), codecs=("zst", "xz", "bz2"), levels=None):
+    """Compresses input_path with each codec and thread count; returns (codec, threads, seconds, ratio) rows"""
+    with open(input_path, "rb") as src:
+        data = src.read()
+    rows = []
+    for codec in codecs:
+        level = (levels or {}).get(codec)
+        for threads in thread_counts:
+            sink = _CountingSink()
+            start = time.perf_counter()
+            with open_writer(sink, codec, level, threads) as writer:
+                for offset in range(0, len(data), COPY_SIZE):
+                    writer.write(data[offset:offset + COPY_SIZE])
+            seconds = time.perf_counter() - start
+            rows.append((codec, threads, seconds, len(data) / sink.size if sink.size else 0.0))
+    return rows
+
+
+def _write_mixed_corpus(folder, size_mb):
+    # Half compressible text, half files that are compressed or encrypted already
+    part = size_mb * 1024 * 1024 // 8
+    words = [os.urandom(4).hex().encode() for _ in range(4096)]
+    text = b" ".join(words[index % 4096] for index in range(0, part * 4 // 9 * 9, 9))[:part]
+    files = {
+        "logs/app.log": text, "logs/build.log": text[::-1], "src/module.py": text.upper(), "notes.txt": text.lower(),
+        "photo.jpg": b"\xff\xd8\xff\xe0" + os.urandom(part),
+        "video.mp4": b"\x00\x00\x00\x18ftypmp42" + os.urandom(part),
+        "backup.gz": b"\x1f\x8b\x08\x00" + os.urandom(part),
+        "noise.bin": os.urandom(part),  # no magic, found by the trial compression
+    }
+    for name, data in files.items():
+        os.makedirs(os.path.join(folder, os.path.dirname(name)), exist_ok=True)
+        with open(os.path.join(folder, name), "wb") as file:
+            file.write(data)
+
+
+def benchmark_sampling(folder=None, size_mb=32, threads=DEFAULT_THREADS):
+    """Archives a folder (by default a generated mixed corpus) as zip, 7z and tar.zst with and without
+    sampling; returns (format, sampling, seconds, output bytes) rows"""
+    import tempfile
+    import ParallelZip
+
+    rows = []
+    with tempfile.TemporaryDirectory() as work:
+        if folder is None:
+            folder = os.path.join(work, "corpus")
+            _write_mixed_corpus(folder, size_mb)
+        for compression_type in ("zip", "7z", "tar.zst"):
+            for sampling in (False, True):
+                output = os.path.join(work, f"out.{compression_type}")
+                start = time.perf_counter()
+                if compression_type == "zip":
+                    ParallelZip.compress_folder(folder, output, threads=threads, store_incompressible=sampling)
+                elif compression_type == "7z":
+                    compress_7z(folder, output, sampling)
+                else:
+                    compress_tar(folder, output, "zst", threads=threads, store_incompressible=sampling)
+                rows.append((compression_type, sampling, time.perf_counter() - start, os.path.getsize(output)))
+                os.remove(output)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-threaded zstd, xz and bzip2 compression")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    compress_parser = subparsers.add_parser("compress", help="compress a file, or a folder as a tar archive")
+    compress_parser.add_argument("input")
+    compress_parser.add_argument("--format", choices=FORMATS, default="zst")
+    compress_parser.add_argument("--level", type=int, help="compression level (default depends on the format)")
+    compress_parser.add_argument("--threads", type=int, default=DEFAULT_THREADS)
+    decompress_parser = subparsers.add_parser("decompress", help="decompress a .zst/.xz/.bz2 file or extract a tar")
+    decompress_parser.add_argument("input")
+    decompress_parser.add_argument("--threads", type=int, default=DEFAULT_THREADS, help="used for .bz2 files")
+    benchmark_parser = subparsers.add_parser("benchmark", help="time 1 thread against many on one file")
+    benchmark_parser.add_argument("input")
+    benchmark_parser.add_argument("--threads", type=int, default=DEFAULT_THREADS)
+    sampling_parser = subparsers.add_parser("sample-benchmark",
+                                            help="time archiving with and without storing incompressible files")
+    sampling_parser.add_argument("--folder", help="folder to archive (default: a generated mixed corpus)")
+    sampling_parser.add_argument("--size-mb", type=int, default=32, help="size of the generated corpus")
+    sampling_parser.add_argument("--threads", type=int, default=DEFAULT_THREADS)
+    args = parser.parse_args()
+
+    if args.command == "compress":
+        output = f"{os.path.normpath(args.input)}.{args.format}"
+        if args.format.startswith("tar."):
+            compress_tar(args.input, output, codec_of(args.format), args.level, args.threads)
+        else:
+            compress_file(args.input, output, args.format, args.level, args.threads)
+        print(output)
+    elif args.command == "decompress":
+        base, extension = os.path.splitext(args.input)
+        if base.endswith(".tar"):
+            from ArchiveExtract import extract_tar
+            extract_tar(args.input, os.path.dirname(os.path.abspath(args.input)), extension[1:])
+        else:
+            decompress_file(args.input, base, extension[1:], args.threads)
+    elif args.command == "sample-benchmark":
+        for row_type, sampling, seconds, size in benchmark_sampling(args.folder, args.size_mb, args.threads):
+            print(f"{row_type:>7} {'sampled' if sampling else 'all    '}: {seconds:7.2f} s  {size:>14,} bytes")
+    else:
+        input_size = os.path.getsize(args.input)
+        for row_codec, row_threads, seconds, ratio in benchmark(args.input, sorted({1, args.threads})):
+            print(f"{row_codec:>4} {row_threads:>3} threads: {seconds:7.2f} s  "
+                  f"{input_size / (1024 * 1024) / seconds:8.1f} MB/s  ratio {ratio:.2f}")
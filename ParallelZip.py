@@ -0,0 +1,263 @@
+import argparse
+import os
+import struct
+import tempfile
+import time
+import zlib
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from ParallelCompress import COPY_SIZE, DEFAULT_THREADS, LEVELS, check_canceled, looks_incompressible
+
+DEFAULT_LEVEL = LEVELS["zip"][2]
+SPOOL_SIZE = 16 * 1024 * 1024  # compressed entries larger than this are buffered on disk
+
+# Beyond these a field no longer fits and the ZIP64 form is written
+ZIP64_LIMIT = (1 << 31) - 1
+ZIP_FILECOUNT_LIMIT = (1 << 16) - 1
+# What a classic field holds when its real value is in a ZIP64 record
+MAX_32 = 0xFFFFFFFF
+MAX_16 = 0xFFFF
+
+LOCAL_HEADER = struct.Struct("<4s2B4HL2L2H")
+CENTRAL_HEADER = struct.Struct("<4s4B4HL2L5H2L")
+END_RECORD = struct.Struct("<4s4H2LH")
+ZIP64_END_RECORD = struct.Struct("<4sQ2H2L4Q")
+ZIP64_LOCATOR = struct.Struct("<4sLQL")
+
+METHOD_STORED = 0
+METHOD_DEFLATED = 8
+VERSION_DEFAULT = 20
+VERSION_ZIP64 = 45
+FLAG_UTF8 = 0x800
+CREATE_SYSTEM = 0 if os.name == "nt" else 3
+
+ZipEntry = namedtuple("ZipEntry", "file_path arcname")
+_Deflated = namedtuple("_Deflated", "method crc size compressed_size data mode date_time")
+_CentralRecord = namedtuple("_CentralRecord", "name flags method crc size compressed_size offset mode date_time")
+
+
+def zip_entries(folder_path):
+    """Every file under folder_path with its archive name, relative to folder_path"""
+    entries = []
+    for root, _, files in os.walk(folder_path):
+        for file in files:
+            file_path = os.path.join(root, file)
+            entries.append(ZipEntry(file_path, os.path.relpath(file_path, folder_path).replace(os.sep, "/")))
+    return entries
+
+
+def _dos_date_time(mtime):
+    # Zip timestamps cannot go before 1980 and have two-second resolution
+    year, month, day, hour, minute, second = time.localtime(mtime)[:6]
+    if year < 1980:
+        year, month, day, hour, minute, second = 1980, 1, 1, 0, 0, 0
+    return ((year - 1980) << 9) | (month << 5) | day, (hour << 11) | (minute << 5) | (second // 2)
+
+
+def _store_entry(file_path, file_stat):
+    # Only the CRC is computed here, over exactly the size recorded; the data is copied
+    # straight from the same open file when written, and checked against the CRC again
+    data = open(file_path, "rb")
+    try:
+        crc = 0
+        remaining = file_stat.st_size
+        while remaining:
+            block = data.read(min(COPY_SIZE, remaining))
+            if not block:
+                raise OSError(f"{file_path} changed while it was being archived.")
+            crc = zlib.crc32(block, crc)
+            remaining -= len(block)
+        data.seek(0)
+    except BaseException:
+        data.close()
+        raise
+    return _Deflated(METHOD_STORED, crc, file_stat.st_size, file_stat.st_size, data, file_stat.st_mode,
+                     _dos_date_time(file_stat.st_mtime))
+
+
+def _deflate_entry(file_path, level, store_incompressible=False):
+    """Runs on a worker: raw-deflates one file and computes its CRC. zlib releases the GIL.
+
+    With store_incompressible, files that looks_incompressible picks out
+    are stored as they are.
+    """
+    file_stat = os.stat(file_path)
+    if store_incompressible and looks_incompressible(file_path):
+        return _store_entry(file_path, file_stat)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    data = tempfile.SpooledTemporaryFile(SPOOL_SIZE)
+    crc = 0
+    size = 0
+    try:
+        with open(file_path, "rb") as src:
+            while True:
+                block = src.read(COPY_SIZE)
+                if not block:
+                    break
+                crc = zlib.crc32(block, crc)
+                size += len(block)
+                data.write(compressor.compress(block))
+        data.write(compressor.flush())
+        compressed_size = data.tell()
+        data.seek(0)
+    except BaseException:
+        data.close()
+        raise
+    return _Deflated(METHOD_DEFLATED, crc, size, compressed_size, data, file_stat.st_mode,
+                     _dos_date_time(file_stat.st_mtime))
+
+
+def _encode_name(arcname):
+    try:
+        return arcname.encode("ascii"), 0
+    except UnicodeEncodeError:
+        return arcname.encode("utf-8"), FLAG_UTF8
+
+
+def _write_entry(dst, arcname, deflated):
+    """Writes one local header and its compressed data; returns the central directory record"""
+    offset = dst.tell()
+    name, flags = _encode_name(arcname)
+    date, dos_time = deflated.date_time
+    zip64 = deflated.size > ZIP64_LIMIT or deflated.compressed_size > ZIP64_LIMIT
+    if zip64:
+        # The local ZIP64 field always holds both sizes
+        extra = struct.pack("<2H2Q", 1, 16, deflated.size, deflated.compressed_size)
+        sizes = (MAX_32, MAX_32)
+    else:
+        extra = b""
+        sizes = (deflated.compressed_size, deflated.size)
+    dst.write(LOCAL_HEADER.pack(b"PK\x03\x04", VERSION_ZIP64 if zip64 else VERSION_DEFAULT, 0, flags,
+                                deflated.method, dos_time, date, deflated.crc, *sizes, len(name), len(extra)))
+    dst.write(name)
+    dst.write(extra)
+    # A stored file could have changed since its CRC was taken, so copy exactly the size recorded
+    copied, crc = _copy_exactly(deflated.data, dst, deflated.compressed_size)
+    if copied != deflated.compressed_size or (deflated.method == METHOD_STORED and crc != deflated.crc):
+        raise OSError(f"{arcname} changed while it was being archived.")
+    return _CentralRecord(name, flags, deflated.method, deflated.crc, deflated.size, deflated.compressed_size, offset,
+                          deflated.mode, deflated.date_time)
+
+
+def _copy_exactly(src, dst, size):
+    # Returns the bytes copied and their CRC
+    copied = 0
+    crc = 0
+    while copied < size:
+        block = src.read(min(COPY_SIZE, size - copied))
+        if not block:
+            break
+        dst.write(block)
+        crc = zlib.crc32(block, crc)
+        copied += len(block)
+    return copied, crc
+
+
+def _write_central_directory(dst, records):
+    start = dst.tell()
+    for record in records:
+        # The central ZIP64 field holds only the values that overflow, in this order
+        zip64_values = []
+        size, compressed_size, offset = record.size, record.compressed_size, record.offset
+        if size > ZIP64_LIMIT:
+            zip64_values.append(size)
+            size = MAX_32
+        if compressed_size > ZIP64_LIMIT:
+            zip64_values.append(compressed_size)
+            compressed_size = MAX_32
+        if offset > ZIP64_LIMIT:
+            zip64_values.append(offset)
+            offset = MAX_32
+        extra = b""
+        if zip64_values:
+            extra = struct.pack(f"<2H{len(zip64_values)}Q", 1, 8 * len(zip64_values), *zip64_values)
+        version = VERSION_ZIP64 if zip64_values else VERSION_DEFAULT
+        date, dos_time = record.date_time
+        dst.write(CENTRAL_HEADER.pack(b"PK\x01\x02", version, CREATE_SYSTEM, version, 0, record.flags,
+                                      record.method, dos_time, date, record.crc, compressed_size, size,
+                                      len(record.name), len(extra), 0, 0, 0,
+                                      (record.mode & 0xFFFF) << 16, offset))
+        dst.write(record.name)
+        dst.write(extra)
+    end = dst.tell()
+
+    count, size, offset = len(records), end - start, start
+    if count > ZIP_FILECOUNT_LIMIT or size > ZIP64_LIMIT or offset > ZIP64_LIMIT:
+        dst.write(ZIP64_END_RECORD.pack(b"PK\x06\x06", ZIP64_END_RECORD.size - 12, VERSION_ZIP64,
+                                        VERSION_ZIP64, 0, 0, count, count, size, offset))
+        dst.write(ZIP64_LOCATOR.pack(b"PK\x06\x07", 0, end, 1))
+        count, size, offset = min(count, MAX_16), min(size, MAX_32), min(offset, MAX_32)
+    dst.write(END_RECORD.pack(b"PK\x05\x06", 0, 0, count, count, size, offset, 0))
+
+
+def write_zip(output_path, entries, level=DEFAULT_LEVEL, threads=DEFAULT_THREADS, progress=None,
+              store_incompressible=False, is_canceled=None):
+    """Writes a deflated zip archive of entries, compressing several entries at once.
+
+    Workers read and raw-deflate whole entries while the calling thread
+    appends each finished one, in entry order, with its local header. The
+    central directory follows, using ZIP64 records when sizes, offsets or
+    the entry count overflow the classic fields. At most 2 * threads
+    entries are held at once. progress receives the number of entries
+    written so far. store_incompressible stores already-compressed files
+    instead of deflating them again. When is_canceled returns True no more
+    entries are submitted, pending ones are canceled and CompressCanceled is
+    raised.
+    """
+    records = []
+    with open(output_path, "wb") as dst, ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        pending = deque()
+
+        def write_next():
+            entry, future = pending.popleft()
+            deflated = future.result()
+            with deflated.data:
+                records.append(_write_entry(dst, entry.arcname, deflated))
+            if progress:
+                progress(len(records))
+
+        try:
+            for entry in entries:
+                check_canceled(is_canceled)
+                future = executor.submit(_deflate_entry, entry.file_path, level, store_incompressible)
+                pending.append((entry, future))
+                if len(pending) >= max(1, threads) * 2:
+                    write_next()
+            while pending:
+                check_canceled(is_canceled)
+                write_next()
+        finally:
+            for _, future in pending:
+                if not future.cancel() and not future.exception():
+                    future.result().data.close()
+        _write_central_directory(dst, records)
+
+
+def compress_folder(folder_path, output_path, level=DEFAULT_LEVEL, threads=DEFAULT_THREADS, store_incompressible=False):
+    write_zip(output_path, zip_entries(folder_path), level, threads, store_incompressible=store_incompressible)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a zip archive with entries deflated in parallel")
+    parser.add_argument("folder", help="folder to archive")
+    parser.add_argument("output", nargs="?", help="zip path (default: the folder name with .zip)")
+    parser.add_argument("--level", type=int, default=DEFAULT_LEVEL, help="deflate level, 0-9")
+    parser.add_argument("--threads", type=int, default=DEFAULT_THREADS)
+    parser.add_argument("--compare", action="store_true", help="also time zipfile writing the same folder")
+    args = parser.parse_args()
+
+    output = args.output or f"{os.path.normpath(args.folder)}.zip"
+    start_time = time.perf_counter()
+    compress_folder(args.folder, output, args.level, args.threads)
+    print(f"parallel: {time.perf_counter() - start_time:.2f} s, {os.path.getsize(output):,} bytes")
+    if args.compare:
+        import zipfile
+
+        start_time = time.perf_counter()
+        with zipfile.ZipFile(output + ".zipfile", "w", zipfile.ZIP_DEFLATED, compresslevel=args.level,
+                             strict_timestamps=False) as zipf:
+            for zip_entry in zip_entries(args.folder):
+                zipf.write(zip_entry.file_path, zip_entry.arcname)
+        print(f" zipfile: {time.perf_counter() - start_time:.2f} s, {os.path.getsize(output + '.zipfile'):,} bytes")
+        os.remove(output + ".zipfile")
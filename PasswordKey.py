@@ -0,0 +1,171 @@
+import argparse
+import hashlib
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+
+# Password keys are derived in two steps: scrypt(password, kdf salt) gives a master key,
+# and HKDF(master key, file salt) gives each file its own key. Files locked together share
+# the kdf salt, so unlocking them costs one scrypt run; the file salt keeps their keys apart.
+SALT_SIZE = 16
+KEY_SIZE = 32
+PARAMS_FORMAT = ">BBB"  # log2(n), r, p
+PARAMS_SIZE = struct.calcsize(PARAMS_FORMAT)
+# Headers come from untrusted files and are read before their MAC can be checked,
+# so parameters beyond these limits are refused rather than run
+MAX_LOG2_N = 22
+MAX_R = 32
+MAX_P = 16
+MAX_MEMORY = 4 * 1024 ** 3
+
+KdfParams = namedtuple("KdfParams", "log2_n r p")
+DEFAULT_PARAMS = KdfParams(15, 8, 1)  # 32 MiB, around 0.1 s on a desktop CPU
+
+DEFAULT_TTL = 300.0
+DEFAULT_MAX_ENTRIES = 16
+
+
+def pack_params(params):
+    return struct.pack(PARAMS_FORMAT, *params)
+
+
+def unpack_params(data):
+    params = KdfParams(*struct.unpack(PARAMS_FORMAT, data))
+    if not 10 <= params.log2_n <= MAX_LOG2_N or not 1 <= params.r <= MAX_R or not 1 <= params.p <= MAX_P:
+        raise ValueError("Invalid key derivation parameters.")
+    if scrypt_memory(params) > MAX_MEMORY:
+        raise ValueError("Key derivation parameters ask for too much memory.")
+    return params
+
+
+def scrypt_memory(params):
+    """Bytes of memory one scrypt run with these parameters needs"""
+    return 128 * params.r * (1 << params.log2_n)
+
+
+def derive_master_key(password, salt, params=DEFAULT_PARAMS):
+    """Runs scrypt; this is the expensive step the cache exists for"""
+    if isinstance(password, str):
+        password = password.encode()
+    kdf = Scrypt(salt=salt, length=KEY_SIZE, n=1 << params.log2_n, r=params.r, p=params.p)
+    return kdf.derive(password)
+
+
+def file_key(master_key, file_salt, info=b"SecureScript file key"):
+    """Cheap per-file key from a master key, so files never share a key"""
+    return HKDF(algorithm=hashes.SHA256(), length=KEY_SIZE, salt=file_salt, info=info).derive(master_key)
+
+
+class DerivedKeyCache:
+    """In-process cache of scrypt master keys with TTL expiry.
+
+    Entries are keyed by a hash of the password together with the salt and
+    parameters, so a batch of files locked in one go is unlocked with a single
+    scrypt run. Keys live only in memory and are dropped after ttl seconds or
+    when the cache is cleared.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        # Salt to reuse when locking more files under the same password
+        self.lock_salts = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _password_id(password):
+        if isinstance(password, str):
+            password = password.encode()
+        return hashlib.sha256(password).digest()
+
+    def _expire(self, now):
+        for cache_key in [cache_key for cache_key, (expires, _) in self.entries.items() if expires <= now]:
+            del self.entries[cache_key]
+        for password_id in [password_id for password_id, (expires, _, _) in self.lock_salts.items()
+                            if expires <= now]:
+            del self.lock_salts[password_id]
+
+    def master_key(self, password, salt, params=DEFAULT_PARAMS):
+        """Returns the scrypt master key, deriving it only on a cache miss"""
+        cache_key = (self._password_id(password), salt, tuple(params))
+        with self.lock:
+            now = time.monotonic()
+            self._expire(now)
+            if cache_key in self.entries:
+                self.entries.move_to_end(cache_key)
+                return self.entries[cache_key][1]
+
+        # Derive outside the lock so other passwords are not held up
+        key = derive_master_key(password, salt, params)
+        with self.lock:
+            self.entries[cache_key] = (time.monotonic() + self.ttl, key)
+            self.entries.move_to_end(cache_key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return key
+
+    def lock_salt(self, password, params=DEFAULT_PARAMS):
+        """Salt for locking under this password: reused within the TTL, fresh afterwards"""
+        password_id = self._password_id(password)
+        with self.lock:
+            self._expire(time.monotonic())
+            entry = self.lock_salts.get(password_id)
+            if entry is not None and entry[2] == tuple(params):
+                return entry[1]
+            salt = os.urandom(SALT_SIZE)
+            self.lock_salts[password_id] = (time.monotonic() + self.ttl, salt, tuple(params))
+            return salt
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.lock_salts.clear()
+
+
+KEY_CACHE = DerivedKeyCache()
+
+
+def benchmark(costs=(14, 15, 16, 17, 18), r=8, p=1, repeat=3):
+    """Times one scrypt derivation for each log2(n) in costs; returns (params, seconds, memory bytes) rows"""
+    rows = []
+    salt = os.urandom(SALT_SIZE)
+    for log2_n in costs:
+        params = KdfParams(log2_n, r, p)
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            derive_master_key(b"benchmark password", salt, params)
+            best = min(best, time.perf_counter() - start)
+        rows.append((params, best, scrypt_memory(params)))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark scrypt cost parameters and the derived key cache")
+    parser.add_argument("--costs", type=int, nargs="+", default=[14, 15, 16, 17, 18], help="log2(n) values to time")
+    parser.add_argument("-r", type=int, default=DEFAULT_PARAMS.r, help="scrypt block size")
+    parser.add_argument("-p", type=int, default=DEFAULT_PARAMS.p, help="scrypt parallelism")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per setting, best time is reported")
+    parser.add_argument("--files", type=int, default=100, help="files in the simulated batch unlock")
+    args = parser.parse_args()
+
+    for row_params, seconds, memory in benchmark(args.costs, args.r, args.p, args.repeat):
+        print(f"n=2^{row_params.log2_n:<2} r={row_params.r} p={row_params.p}: "
+              f"{seconds * 1000:8.1f} ms  {memory / (1024 * 1024):6.0f} MiB")
+
+    # A batch unlock with the default parameters, with and without the cache
+    cache = DerivedKeyCache()
+    batch_salt = os.urandom(SALT_SIZE)
+    start = time.perf_counter()
+    for _ in range(args.files):
+        file_key(cache.master_key("batch password", batch_salt), os.urandom(SALT_SIZE))
+    cached = time.perf_counter() - start
+    per_file = benchmark([DEFAULT_PARAMS.log2_n], DEFAULT_PARAMS.r, DEFAULT_PARAMS.p, 1)[0][1]
+    print(f"{args.files} file keys: {cached:.2f} s with the cache, about {per_file * args.files:.2f} s without")
@@ -8,7 +8,7 @@ a = Analysis(
     ['MainForm.py'],
     pathex=[],
     binaries=[],
-    datas=[('.\\HashForm.py', '.'), ('.\\FileHasher.py', '.'), ('.\\FileCompress.py', '.'), ('.\\FileEncrypt.py', '.'), ('.\\FileShredder.py', '.'), ('.\\FileLock.py', '.')],
+    datas=[('.\\HashForm.py', '.'), ('.\\FileHasher.py', '.'), ('.\\FileCompress.py', '.'), ('.\\FileEncrypt.py', '.'), ('.\\FileShredder.py', '.'), ('.\\FileLock.py', '.'), ('.\\HashEngine.py', '.'), ('.\\HashManifest.py', '.'), ('.\\HashCache.py', '.'), ('.\\TreeHash.py', '.'), ('.\\DuplicateFinder.py', '.'), ('.\\CryptoStream.py', '.'), ('.\\BatchEncrypt.py', '.'), ('.\\PasswordKey.py', '.'), ('.\\KeyStore.py', '.'), ('.\\CompressPipeline.py', '.'), ('.\\ParallelCompress.py', '.'), ('.\\ParallelZip.py', '.'), ('.\\ArchiveExtract.py', '.')],
     hiddenimports=[],
     hookspath=[],
     hooksconfig={},
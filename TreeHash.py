@@ -0,0 +1,185 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from HashEngine import DEFAULT_WORKERS
+
+try:
+    import blake3
+except ImportError:  # optional, the tree is built from BLAKE2b digests instead
+    blake3 = None
+
+TREE_CHUNK_SIZE = 4 * 1024 * 1024  # bytes covered by each leaf digest
+TREE_VERSION = 1
+
+# Prefixes keep leaf and interior node inputs from ever colliding
+LEAF_PREFIX = b"\x00"
+NODE_PREFIX = b"\x01"
+
+
+def default_algorithm():
+    return "blake3" if blake3 is not None else "blake2b"
+
+
+def tree_label(algorithm, chunk_size=TREE_CHUNK_SIZE):
+    """Names what the root is, such as merkle-blake3-4MiB; it is not the plain digest of the file"""
+    size = f"{chunk_size // (1024 * 1024)}MiB" if chunk_size % (1024 * 1024) == 0 else f"{chunk_size}B"
+    return f"merkle-{algorithm}-{size}"
+
+
+def _new_hasher(algorithm):
+    if algorithm == "blake3":
+        if blake3 is None:
+            raise ValueError("The blake3 package is required for this tree hash")
+        return blake3.blake3()
+    if algorithm == "blake2b":
+        return hashlib.blake2b(digest_size=32)
+    raise ValueError(f"Unsupported tree hash algorithm: {algorithm}")
+
+
+def _hash_leaf(algorithm, data):
+    hasher = _new_hasher(algorithm)
+    hasher.update(LEAF_PREFIX)
+    hasher.update(data)
+    return hasher.digest()
+
+
+def merkle_root(algorithm, leaves):
+    """Folds leaf digests pairwise up to a single root; an odd node is carried up unchanged"""
+    level = list(leaves)
+    while len(level) > 1:
+        parents = []
+        for index in range(0, len(level) - 1, 2):
+            hasher = _new_hasher(algorithm)
+            hasher.update(NODE_PREFIX + level[index] + level[index + 1])
+            parents.append(hasher.digest())
+        if len(level) % 2:
+            parents.append(level[-1])
+        level = parents
+    return level[0]
+
+
+def tree_hash_file(file_path, chunk_size=TREE_CHUNK_SIZE, workers=None, algorithm=None, progress=None,
+                   is_canceled=None):
+    """Hashes fixed-size ranges of a memory-mapped file in parallel and combines them into a Merkle root.
+
+    Returns a dict with the algorithm, chunk size, file size, hex root and the
+    hex digest of every chunk, or None if is_canceled returned True. progress
+    receives the number of bytes hashed so far.
+    """
+    if algorithm is None:
+        algorithm = default_algorithm()
+    if workers is None:
+        workers = DEFAULT_WORKERS
+    _new_hasher(algorithm)  # fail early on an unavailable algorithm
+
+    file_size = os.path.getsize(file_path)
+    leaves = []
+    if file_size == 0:
+        leaves.append(_hash_leaf(algorithm, b""))
+    else:
+        with open(file_path, "rb") as file, \
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped, \
+                ThreadPoolExecutor(max_workers=workers) as executor:
+            view = memoryview(mapped)
+            # Keep only a bounded window of chunks in flight so cancel is quick
+            pending = deque()
+            try:
+                for offset in range(0, file_size, chunk_size):
+                    pending.append(executor.submit(_hash_leaf, algorithm, view[offset:offset + chunk_size]))
+                    if len(pending) < workers * 2:
+                        continue
+                    leaves.append(pending.popleft().result())
+                    if progress:
+                        # Only the last leaf can be short, so this never passes the file size
+                        progress(min(len(leaves) * chunk_size, file_size))
+                    if is_canceled and is_canceled():
+                        return None
+                while pending:
+                    leaves.append(pending.popleft().result())
+                if progress:
+                    progress(file_size)
+            finally:
+                # Every slice of the map has to be gone before it can be closed
+                for future in pending:
+                    future.cancel()
+                executor.shutdown(wait=True)
+                view.release()
+
+    return {
+        "version": TREE_VERSION,
+        "label": tree_label(algorithm, chunk_size),
+        "algorithm": algorithm,
+        "chunk_size": chunk_size,
+        "size": file_size,
+        "root": merkle_root(algorithm, leaves).hex(),
+        "chunks": [leaf.hex() for leaf in leaves],
+    }
+
+
+def changed_ranges(recorded, current):
+    """Lists the (offset, length) byte ranges whose chunk digests differ between two tree hashes"""
+    if recorded["algorithm"] != current["algorithm"] or recorded["chunk_size"] != current["chunk_size"]:
+        raise ValueError("Tree hashes were made with different algorithms or chunk sizes")
+
+    chunk_size = current["chunk_size"]
+    size = max(recorded["size"], current["size"])
+    ranges = []
+    for index in range(max(len(recorded["chunks"]), len(current["chunks"]))):
+        old = recorded["chunks"][index] if index < len(recorded["chunks"]) else None
+        new = current["chunks"][index] if index < len(current["chunks"]) else None
+        if old == new:
+            continue
+        offset = index * chunk_size
+        length = min(chunk_size, size - offset)
+        # Merge with the previous range when the changes are adjacent
+        if ranges and ranges[-1][0] + ranges[-1][1] == offset:
+            ranges[-1] = (ranges[-1][0], ranges[-1][1] + length)
+        else:
+            ranges.append((offset, length))
+    return ranges
+
+
+def write_tree_hash(result, output_path):
+    with open(output_path, "w", encoding="utf-8") as output:
+        json.dump(result, output, indent=2)
+
+
+def load_tree_hash(input_path):
+    with open(input_path, "r", encoding="utf-8") as tree_file:
+        result = json.load(tree_file)
+    if result.get("version") != TREE_VERSION:
+        raise ValueError(f"Unsupported tree hash version: {result.get('version')}")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parallel tree hash of a single file, with chunk-level verify")
+    parser.add_argument("file", help="file to hash")
+    parser.add_argument("--output", help="write the root and chunk digests to this JSON file")
+    parser.add_argument("--verify", help="compare against a JSON tree hash written earlier and list changed ranges")
+    parser.add_argument("--chunk-size", type=int, default=TREE_CHUNK_SIZE, help="bytes per leaf")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="hashing threads")
+    parser.add_argument("--algorithm", choices=["blake3", "blake2b"],
+                        help="leaf and node hash (default: blake3 if installed)")
+    args = parser.parse_args()
+
+    if args.verify:
+        recorded = load_tree_hash(args.verify)
+        tree = tree_hash_file(args.file, recorded["chunk_size"], args.workers, recorded["algorithm"])
+        if tree["root"] == recorded["root"]:
+            print("OK")
+            sys.exit(0)
+        for offset, length in changed_ranges(recorded, tree):
+            print(f"CHANGED  bytes {offset}-{offset + length - 1} ({length} bytes)")
+        sys.exit(1)
+
+    tree = tree_hash_file(args.file, args.chunk_size, args.workers, args.algorithm)
+    if args.output:
+        write_tree_hash(tree, args.output)
+    print(f"{tree['root']}  {args.file}  ({tree['label']}, {len(tree['chunks'])} chunks)")
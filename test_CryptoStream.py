@@ -0,0 +1,57 @@
+import os
+import tempfile
+import tracemalloc
+import unittest
+
+import CryptoStream
+
+CHUNK_SIZE = 256 * 1024
+FILE_CHUNKS = 64
+
+
+class PeakMemoryTest(unittest.TestCase):
+    """Encrypting and decrypting a file must hold a few chunks in memory, not the file"""
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.folder.name, "plain.bin")
+        with open(self.source, "wb") as file:
+            # A short last chunk as well as full ones
+            for _ in range(FILE_CHUNKS):
+                file.write(os.urandom(CHUNK_SIZE))
+            file.write(os.urandom(1234))
+        self.key = os.urandom(CryptoStream.KEY_SIZE)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def peak(self, function, *args, **kwargs):
+        tracemalloc.start()
+        try:
+            function(*args, **kwargs)
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def check_round_trip(self, workers, chunk_limit):
+        encrypted = self.source + ".enc"
+        decrypted = self.source + ".out"
+        limit = chunk_limit * CHUNK_SIZE
+        encrypt_peak = self.peak(CryptoStream.encrypt_file, self.source, encrypted, self.key, CHUNK_SIZE,
+                                 workers=workers)
+        decrypt_peak = self.peak(CryptoStream.decrypt_file, encrypted, decrypted, self.key, workers=workers)
+        self.assertLess(encrypt_peak, limit)
+        self.assertLess(decrypt_peak, limit)
+        with open(self.source, "rb") as original, open(decrypted, "rb") as result:
+            self.assertEqual(original.read(), result.read())
+
+    def test_sequential(self):
+        self.check_round_trip(1, 4)
+
+    def test_parallel(self):
+        # Up to two chunks per worker are in flight, plus the one being written
+        self.check_round_trip(4, 2 * 4 + 4)
+
+
+if __name__ == "__main__":
+    unittest.main()